@@ -0,0 +1,257 @@
+"""Access tokens, rotating refresh tokens and revocation.
+
+Access tokens are short-lived JWTs carrying the claims authorization needs
+(``sub`` and ``user_type``), so authenticated requests are served without
+reading the user from MongoDB. They are signed with the first key of
+JWT_SIGNING_KEYS (``kid:secret,kid:secret``; default: SECRET_KEY under
+kid ``default``) and verified with the key named by their ``kid`` header.
+To rotate, put the new key first and drop the old one once
+ACCESS_TOKEN_EXPIRE_MINUTES have passed.
+
+Refresh tokens are opaque and stored as SHA-256 hashes in ``refresh_tokens``
+(TTL index on ``expires_at``). Each use rotates it: the token is marked used
+and a new one of the same family is issued. A used token presented again
+means a copy leaked, and revokes the whole family.
+
+Deactivating a user revokes their refresh tokens and adds them to
+``revocations``: their access tokens issued until then are refused. Each
+worker keeps that list in memory and reloads it every REVOCATION_REFRESH
+seconds, so a revocation made by another worker applies within that delay.
+Entries expire with the last access token they can affect.
+
+Browsers cannot send headers on WebSocket or EventSource connections, so the
+merchant event streams take a ticket instead of the access token in their
+URL (where access logs would keep it): an authenticated POST exchanges the
+access token for a random ticket, stored hashed in ``event_tickets``, that
+works once within EVENT_TICKET_TTL seconds. The connection then carries the
+access token's claims and ends when that token expires or is revoked.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import secrets
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from jose import JWTError, jwt
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = float(os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES', '15'))
+REFRESH_TOKEN_EXPIRE_DAYS = float(os.environ.get('REFRESH_TOKEN_EXPIRE_DAYS', '30'))
+REVOCATION_REFRESH = float(os.environ.get('REVOCATION_REFRESH', '5'))
+EVENT_TICKET_TTL = float(os.environ.get('EVENT_TICKET_TTL', '30'))
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def signing_keys_from_env(fallback_secret: str) -> Dict[str, str]:
+    spec = os.environ.get('JWT_SIGNING_KEYS', '')
+    keys = {}
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        kid, sep, secret = entry.partition(':')
+        if not sep or not kid or not secret:
+            raise ValueError("JWT_SIGNING_KEYS entries must look like kid:secret")
+        keys[kid] = secret
+    return keys or {"default": fallback_secret}
+
+
+def _hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class RevocationList:
+    """User ids whose access tokens issued up to ``revoked_at`` are refused."""
+
+    def __init__(self, collection, refresh_interval: float = REVOCATION_REFRESH, clock: Callable[[], float] = time.time):
+        self.collection = collection
+        self.refresh_interval = refresh_interval
+        self._clock = clock
+        self._revoked: Dict[str, float] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    async def revoke(self, user_id: str, lifetime: float):
+        now = self._clock()
+        self._revoked[user_id] = now
+        await self.collection.update_one(
+            {"_id": user_id},
+            {"$set": {"revoked_at": now, "expires_at": datetime.utcfromtimestamp(now + lifetime)}},
+            upsert=True,
+        )
+
+    async def is_revoked(self, user_id: str, issued_at: float) -> bool:
+        if self._loaded_at is None or self._clock() - self._loaded_at >= self.refresh_interval:
+            await self._reload()
+        revoked_at = self._revoked.get(user_id)
+        # iat has a one-second resolution: a token from the same second is refused too
+        return revoked_at is not None and issued_at <= revoked_at
+
+    async def _reload(self):
+        async with self._lock:
+            now = self._clock()
+            if self._loaded_at is not None and now - self._loaded_at < self.refresh_interval:
+                return  # another request reloaded it while we waited
+            try:
+                docs = await self.collection.find(
+                    {"expires_at": {"$gt": datetime.utcfromtimestamp(now)}}, {"revoked_at": 1}
+                ).to_list(None)
+            except PyMongoError as e:
+                # Keep the list we have and retry after the next interval
+                logger.warning(f"Could not reload token revocations: {e!r}")
+            else:
+                self._revoked = {doc["_id"]: doc["revoked_at"] for doc in docs}
+            self._loaded_at = now
+
+    def __len__(self) -> int:
+        return len(self._revoked)
+
+
+class AuthTokens:
+    def __init__(
+        self,
+        db,
+        signing_keys: Dict[str, str],
+        access_ttl: float = ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        refresh_ttl: float = REFRESH_TOKEN_EXPIRE_DAYS * 86400,
+        ticket_ttl: float = EVENT_TICKET_TTL,
+        clock: Callable[[], float] = time.time,
+    ):
+        if not signing_keys:
+            raise ValueError("At least one signing key is needed")
+        self.refresh_tokens = db.refresh_tokens
+        self.tickets = db.event_tickets
+        self.revocations = RevocationList(db.revocations, clock=clock)
+        self.signing_keys = signing_keys
+        self.signing_kid = next(iter(signing_keys))
+        self.access_ttl = access_ttl
+        self.refresh_ttl = refresh_ttl
+        self.ticket_ttl = ticket_ttl
+        self._clock = clock
+        self.counters = {"issued": 0, "refreshed": 0, "reused": 0, "rejected": 0, "tickets": 0}
+
+    def access_token(self, user_id: str, user_type: str) -> str:
+        now = int(self._clock())
+        claims = {"sub": user_id, "user_type": user_type, "iat": now, "exp": now + int(self.access_ttl)}
+        return jwt.encode(
+            claims, self.signing_keys[self.signing_kid], algorithm=ALGORITHM, headers={"kid": self.signing_kid}
+        )
+
+    async def issue(self, user_id: str, user_type: str, family: Optional[str] = None) -> Dict[str, Any]:
+        """A new access token and refresh token (a new family unless ``family`` is given)."""
+        now = self._clock()
+        refresh_token = secrets.token_urlsafe(32)
+        await self.refresh_tokens.insert_one({
+            "_id": _hash(refresh_token),
+            "user_id": user_id,
+            "family": family or secrets.token_hex(16),
+            "created_at": datetime.utcfromtimestamp(now),
+            "expires_at": datetime.utcfromtimestamp(now + self.refresh_ttl),
+            "used_at": None,
+        })
+        self.counters["issued"] += 1
+        return {
+            "access_token": self.access_token(user_id, user_type),
+            "refresh_token": refresh_token,
+            "expires_in": int(self.access_ttl),
+        }
+
+    async def verify(self, token: str) -> Dict[str, Any]:
+        """Claims of a valid, unrevoked access token; raises InvalidToken."""
+        try:
+            # Tokens from before key ids were added have no kid; SECRET_KEY signed them
+            kid = jwt.get_unverified_header(token).get("kid", "default")
+            if kid not in self.signing_keys:
+                raise JWTError(f"Unknown signing key {kid!r}")
+            claims = jwt.decode(token, self.signing_keys[kid], algorithms=[ALGORITHM])
+        except JWTError as e:
+            self.counters["rejected"] += 1
+            raise InvalidToken(str(e))
+        if not claims.get("sub"):
+            raise InvalidToken("Token has no subject")
+        if await self.revocations.is_revoked(claims["sub"], claims.get("iat", 0)):
+            self.counters["rejected"] += 1
+            raise InvalidToken("Token was revoked")
+        return claims
+
+    async def check(self, claims: Dict[str, Any]):
+        """Raise InvalidToken once the token behind ``claims`` has expired or been revoked.
+
+        For connections that outlive a single verify (event streams).
+        """
+        if claims.get("exp") is not None and claims["exp"] <= self._clock():
+            raise InvalidToken("Token has expired")
+        if await self.revocations.is_revoked(claims["sub"], claims.get("iat", 0)):
+            raise InvalidToken("Token was revoked")
+
+    def expires_in(self, claims: Dict[str, Any]) -> Optional[float]:
+        return None if claims.get("exp") is None else claims["exp"] - self._clock()
+
+    async def issue_ticket(self, claims: Dict[str, Any]) -> Dict[str, Any]:
+        """A single-use ticket standing for the verified access token ``claims``."""
+        now = self._clock()
+        ticket = secrets.token_urlsafe(32)
+        await self.tickets.insert_one({
+            "_id": _hash(ticket),
+            "claims": {key: claims[key] for key in ("sub", "user_type", "iat", "exp") if key in claims},
+            "expires_at": datetime.utcfromtimestamp(now + self.ticket_ttl),
+        })
+        self.counters["tickets"] += 1
+        return {"ticket": ticket, "expires_in": int(self.ticket_ttl)}
+
+    async def redeem_ticket(self, ticket: str) -> Dict[str, Any]:
+        """Spend a ticket; returns the claims it was issued for. Raises InvalidToken."""
+        now = datetime.utcfromtimestamp(self._clock())
+        doc = await self.tickets.find_one_and_delete({"_id": _hash(ticket), "expires_at": {"$gt": now}})
+        if doc is None:
+            self.counters["rejected"] += 1
+            raise InvalidToken("Ticket is invalid, expired or already used")
+        await self.check(doc["claims"])
+        return doc["claims"]
+
+    async def rotate(self, refresh_token: str) -> Dict[str, Any]:
+        """Spend a refresh token; returns its ``user_id`` and ``family``. Raises InvalidToken."""
+        now = datetime.utcfromtimestamp(self._clock())
+        token_hash = _hash(refresh_token)
+        doc = await self.refresh_tokens.find_one_and_update(
+            {"_id": token_hash, "used_at": None, "expires_at": {"$gt": now}},
+            {"$set": {"used_at": now}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            spent = await self.refresh_tokens.find_one({"_id": token_hash})
+            if spent is not None and spent.get("used_at") is not None:
+                self.counters["reused"] += 1
+                logger.warning(f"Refresh token reused for user {spent['user_id']}; revoking its family")
+                await self.refresh_tokens.delete_many({"family": spent["family"]})
+            self.counters["rejected"] += 1
+            raise InvalidToken("Refresh token is invalid, expired or already used")
+        self.counters["refreshed"] += 1
+        return {"user_id": doc["user_id"], "family": doc["family"]}
+
+    async def revoke_family(self, refresh_token: str):
+        """Log a session out: its refresh tokens stop working (access tokens run out)."""
+        doc = await self.refresh_tokens.find_one({"_id": _hash(refresh_token)}, {"family": 1})
+        if doc is not None:
+            await self.refresh_tokens.delete_many({"family": doc["family"]})
+
+    async def revoke_user(self, user_id: str):
+        """Every session of the user: refresh tokens and access tokens issued so far."""
+        await self.refresh_tokens.delete_many({"user_id": user_id})
+        await self.revocations.revoke(user_id, self.access_ttl + 60)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "signing_kid": self.signing_kid,
+            "verification_kids": list(self.signing_keys),
+            "access_ttl": self.access_ttl,
+            "revoked_users": len(self.revocations),
+            **self.counters,
+        }
@@ -0,0 +1,52 @@
+"""Motor client construction and the readiness ping.
+
+Pool and timeout settings come from the environment so that each worker
+process can be sized for its share of the deployment: with N workers the
+server sees up to N * MONGO_MAX_POOL_SIZE connections.
+
+The client connects lazily (Motor passes ``connect=False``), so creating it
+at import time is safe under ``gunicorn --preload``: no sockets or monitor
+threads exist until the first operation inside a worker.
+"""
+import asyncio
+import os
+import time
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from metrics import METRICS_ENABLED, MongoCommandMetrics
+
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '50'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '300000'))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '30000'))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '5000'))
+# Secondary reads may lag the primary; only change this for read-mostly replicas
+MONGO_READ_PREFERENCE = os.environ.get('MONGO_READ_PREFERENCE', 'primary')
+
+READINESS_TIMEOUT = float(os.environ.get('READINESS_TIMEOUT', '2'))
+
+
+def create_client(url: str) -> AsyncIOMotorClient:
+    return AsyncIOMotorClient(
+        url,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        readPreference=MONGO_READ_PREFERENCE,
+        retryWrites=True,
+        event_listeners=[MongoCommandMetrics()] if METRICS_ENABLED else [],
+    )
+
+
+async def ping(db, timeout: float = READINESS_TIMEOUT) -> float:
+    """Round-trip a ``ping`` command; returns its latency in ms. Raises on failure or timeout."""
+    began = time.perf_counter()
+    await asyncio.wait_for(db.command("ping"), timeout)
+    return round((time.perf_counter() - began) * 1000, 2)
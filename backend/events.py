@@ -0,0 +1,181 @@
+"""In-process pub/sub for real-time merchant notifications.
+
+Handlers publish events to a channel (``merchant:<id>``); WebSocket and SSE
+connections subscribe to it. How an event reaches the subscribers of other
+worker processes depends on the broker:
+
+- LocalBroker: delivers only inside the current process (single worker,
+  development, tests).
+- ChangeStreamBroker: writes the event to the ``events`` collection and
+  every process delivers what it sees on a change stream over it. Needs a
+  replica set; events expire after EVENTS_TTL seconds.
+
+Slow subscribers never block publishers: each has a bounded queue and the
+oldest events are dropped when it fills up.
+"""
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+EVENT_BROKER = os.environ.get('EVENT_BROKER', 'local')  # "local" or "mongo"
+EVENTS_TTL = int(os.environ.get('EVENTS_TTL', '3600'))
+SUBSCRIBER_QUEUE_SIZE = int(os.environ.get('SUBSCRIBER_QUEUE_SIZE', '100'))
+
+
+def merchant_channel(merchant_id: str) -> str:
+    return f"merchant:{merchant_id}"
+
+
+class Subscription:
+    def __init__(self, broker: "LocalBroker", channel: str, maxsize: int = SUBSCRIBER_QUEUE_SIZE):
+        self.broker = broker
+        self.channel = channel
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def put(self, event: Dict[str, Any]):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Next event, or None if ``timeout`` passes first."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def __aiter__(self) -> AsyncIterator[Dict[str, Any]]:
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        return await self.queue.get()
+
+    def close(self):
+        self.broker._unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LocalBroker:
+    def __init__(self):
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self.counters = {"published": 0, "delivered": 0}
+
+    def subscribe(self, channel: str) -> Subscription:
+        subscription = Subscription(self, channel)
+        self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.channel)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.channel]
+
+    def deliver(self, channel: str, event: Dict[str, Any]):
+        for subscription in self._subscribers.get(channel, ()):
+            subscription.put(event)
+            self.counters["delivered"] += 1
+
+    async def publish(self, channel: str, event: Dict[str, Any]):
+        self.counters["published"] += 1
+        self.deliver(channel, event)
+
+    async def publish_many(self, events: List[Tuple[str, Dict[str, Any]]]):
+        """Publish ``(channel, event)`` pairs, in order."""
+        for channel, event in events:
+            await self.publish(channel, event)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "local",
+            "channels": len(self._subscribers),
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+            "dropped": sum(s.dropped for subs in self._subscribers.values() for s in subs),
+            **self.counters,
+        }
+
+
+class ChangeStreamBroker(LocalBroker):
+    def __init__(self, db, retry_delay: float = 5):
+        super().__init__()
+        self.collection = db.events
+        self.retry_delay = retry_delay
+        self._task: Optional[asyncio.Task] = None
+
+    async def publish(self, channel: str, event: Dict[str, Any]):
+        self.counters["published"] += 1
+        await self.collection.insert_one({"channel": channel, "event": event, "created_at": datetime.utcnow()})
+
+    async def publish_many(self, events: List[Tuple[str, Dict[str, Any]]]):
+        # One round trip for a whole batch of transactions
+        if not events:
+            return
+        self.counters["published"] += len(events)
+        created_at = datetime.utcnow()
+        await self.collection.insert_many(
+            [{"channel": channel, "event": event, "created_at": created_at} for channel, event in events]
+        )
+
+    async def _watch(self):
+        resume_token = None
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        while True:
+            try:
+                async with self.collection.watch(pipeline, resume_after=resume_token) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        document = change["fullDocument"]
+                        self.deliver(document["channel"], document["event"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Event change stream interrupted: {e}")
+                await asyncio.sleep(self.retry_delay)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "backend": "mongo", "watching": self._task is not None}
+
+
+def create_broker(db) -> LocalBroker:
+    if EVENT_BROKER == "mongo":
+        return ChangeStreamBroker(db)
+    if EVENT_BROKER != "local":
+        raise ValueError(f"Unknown EVENT_BROKER: {EVENT_BROKER}")
+    return LocalBroker()
+
+
+def format_sse(event: Dict[str, Any]) -> bytes:
+    data = json.dumps(event, default=str)
+    return f"event: {event.get('type', 'message')}\ndata: {data}\n\n".encode()
@@ -0,0 +1,272 @@
+"""Transaction history exports as CSV or Parquet.
+
+Rows are read from a Motor cursor in chunks of EXPORT_CHUNK_SIZE, turned
+into a pandas DataFrame and encoded (in a thread) as CSV lines or as one
+Parquet row group, so memory is bounded by one chunk whatever the size of
+the history. Parquet goes through pyarrow (pandas' Parquet engine); without
+it only CSV is offered.
+
+- ``stream_export``: the encoded chunks, for a StreamingResponse;
+- ``ExportJobs``: the same export written in the background (at most
+  EXPORT_MAX_JOBS at a time per worker) to the private export store, from
+  which only its owner can download it. Job state is in the ``export_jobs``
+  collection, so any worker can report it; jobs expire after EXPORT_JOB_TTL
+  seconds and a sweep every EXPORT_SWEEP_INTERVAL seconds deletes their
+  files. A job left "running" by a worker that died stays so until it
+  expires.
+"""
+import asyncio
+import io
+import logging
+import os
+import typing
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional, Tuple
+
+import pandas as pd
+from pymongo import ASCENDING
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', '5000'))
+EXPORT_MAX_JOBS = int(os.environ.get('EXPORT_MAX_JOBS', '2'))
+EXPORT_JOB_TTL = int(os.environ.get('EXPORT_JOB_TTL', '86400'))
+EXPORT_SWEEP_INTERVAL = float(os.environ.get('EXPORT_SWEEP_INTERVAL', '3600'))
+
+# Oldest first, as accounting expects; the (user, created_at, id) indexes serve it in reverse
+EXPORT_SORT = [("created_at", ASCENDING), ("id", ASCENDING)]
+
+FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+}
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - depends on the deployment
+    pa = pq = None
+
+
+def parquet_available() -> bool:
+    return pq is not None
+
+
+def _column_type(annotation):
+    """The non-None type of ``Optional[X]`` (or X)."""
+    args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+    return args[0] if typing.get_origin(annotation) is typing.Union and len(args) == 1 else annotation
+
+
+def _arrow_type(python_type):
+    return {
+        int: pa.int64(),
+        float: pa.float64(),
+        bool: pa.bool_(),
+        datetime: pa.timestamp("ms"),
+    }.get(python_type, pa.string())
+
+
+class _Spool(io.RawIOBase):
+    """Write-only sink whose bytes are taken out after each row group."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+class ExportWriter:
+    """Encodes chunks of documents with the fields of ``model``, in field order."""
+
+    def __init__(self, model, fmt: str):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown export format: {fmt}")
+        if fmt == "parquet" and not parquet_available():
+            raise ValueError("Parquet exports require pyarrow")
+        self.fmt = fmt
+        self.media_type, self.extension = FORMATS[fmt]
+        self.types = {name: _column_type(field.annotation) for name, field in model.model_fields.items()}
+        self.columns = list(self.types)
+        self.projection = {"_id": 0, **{name: 1 for name in self.columns}}
+        # Nullable integers, or pandas turns a column with gaps into floats ("12.0")
+        self._dtypes = {name: "Int64" for name, kind in self.types.items() if kind is int}
+        self.rows = 0
+        self._sink = None
+        self._parquet = None
+        if fmt == "parquet":
+            self._schema = pa.schema([(name, _arrow_type(kind)) for name, kind in self.types.items()])
+            self._sink = _Spool()
+            self._parquet = pq.ParquetWriter(self._sink, self._schema, compression="zstd")
+
+    def write(self, docs: List[Mapping[str, Any]]) -> bytes:
+        frame = pd.DataFrame.from_records(docs, columns=self.columns).astype(self._dtypes)
+        first = self.rows == 0
+        self.rows += len(frame)
+        if self._parquet is None:
+            return frame.to_csv(index=False, header=first, date_format="%Y-%m-%dT%H:%M:%S.%f").encode()
+        self._parquet.write_table(pa.Table.from_pandas(frame, schema=self._schema, preserve_index=False))
+        return self._sink.take()
+
+    def close(self) -> bytes:
+        """The trailing bytes (Parquet footer; CSV header of an empty export)."""
+        if self._parquet is None:
+            return b"" if self.rows else (",".join(self.columns) + "\n").encode()
+        self._parquet.close()
+        return self._sink.take()
+
+
+async def stream_export(
+    collection,
+    query: Dict[str, Any],
+    writer: ExportWriter,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> AsyncIterator[bytes]:
+    cursor = collection.find(query, writer.projection).sort(EXPORT_SORT).batch_size(chunk_size)
+    try:
+        chunk = []
+        async for doc in cursor:
+            chunk.append(doc)
+            if len(chunk) >= chunk_size:
+                yield await asyncio.to_thread(writer.write, chunk)
+                chunk = []
+        if chunk:
+            yield await asyncio.to_thread(writer.write, chunk)
+        tail = await asyncio.to_thread(writer.close)
+        if tail:
+            yield tail
+    finally:
+        await cursor.close()
+
+
+class ExportJobs:
+    """Background exports into ``store``, which must not be publicly readable."""
+
+    def __init__(self, collection, store, max_jobs: int = EXPORT_MAX_JOBS, ttl: int = EXPORT_JOB_TTL):
+        self.collection = collection
+        self.store = store
+        self.ttl = ttl
+        self._slots = asyncio.Semaphore(max_jobs)
+        self._tasks = set()
+        self._sweeper: Optional[asyncio.Task] = None
+        self.counters = {"started": 0, "completed": 0, "failed": 0, "expired": 0}
+
+    async def start(self, user_id: str, source, query: Dict[str, Any], writer: ExportWriter) -> Dict[str, Any]:
+        job = {
+            "_id": uuid.uuid4().hex,
+            "user_id": user_id,
+            "format": writer.fmt,
+            "status": "queued",
+            "created_at": datetime.utcnow(),
+        }
+        await self.collection.insert_one(job)
+        task = asyncio.create_task(self._run(job["_id"], source, query, writer))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self.counters["started"] += 1
+        return self._public(job)
+
+    async def get(self, job_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        job = await self.collection.find_one({"_id": job_id, "user_id": user_id})
+        return None if job is None else self._public(job)
+
+    async def download(self, job_id: str, user_id: str) -> Optional[Tuple[Dict[str, Any], AsyncIterator[bytes]]]:
+        """The completed job of ``user_id`` and the chunks of its file, or None."""
+        job = await self.collection.find_one({"_id": job_id, "user_id": user_id, "status": "completed"})
+        if job is None or not await self.store.exists(job["key"]):
+            return None
+        return self._public(job), self.store.iter_chunks(job["key"])
+
+    async def _run(self, job_id: str, source, query: Dict[str, Any], writer: ExportWriter):
+        # Keyed by job: two identical exports must not share a file that expires with either
+        key = f"{job_id}{writer.extension}"
+        path = Path(self.store.staging_dir) / f"export-{key}"
+        try:
+            async with self._slots:
+                await self.collection.update_one({"_id": job_id}, {"$set": {"status": "running"}})
+                size = 0
+                f = await asyncio.to_thread(open, path, "wb")
+                try:
+                    async for data in stream_export(source, query, writer):
+                        size += len(data)
+                        await asyncio.to_thread(f.write, data)
+                finally:
+                    await asyncio.to_thread(f.close)
+                await self.store.commit(path, key, writer.media_type)
+                await asyncio.to_thread(path.unlink, missing_ok=True)
+            await self.collection.update_one({"_id": job_id}, {"$set": {
+                "status": "completed", "key": key, "rows": writer.rows, "bytes": size,
+                "completed_at": datetime.utcnow(),
+            }})
+            self.counters["completed"] += 1
+        except asyncio.CancelledError:
+            await self._fail(job_id, path, "Interrupted by a server shutdown, please retry")
+            raise
+        except Exception as e:
+            logger.exception(f"Export job {job_id} failed")
+            await self._fail(job_id, path, str(e))
+
+    async def _fail(self, job_id: str, path: Path, error: str):
+        self.counters["failed"] += 1
+        path.unlink(missing_ok=True)
+        try:
+            await self.collection.update_one(
+                {"_id": job_id}, {"$set": {"status": "failed", "error": error, "completed_at": datetime.utcnow()}}
+            )
+        except Exception as e:
+            logger.warning(f"Could not record the failure of export job {job_id}: {e!r}")
+
+    async def sweep(self) -> int:
+        """Delete the files of expired jobs (their state is removed by the TTL index)."""
+        expired = await self.store.delete_older_than(datetime.utcnow() - timedelta(seconds=self.ttl))
+        self.counters["expired"] += expired
+        return expired
+
+    async def _sweep_forever(self, interval: float):
+        while True:
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Export sweep failed")
+            await asyncio.sleep(interval)
+
+    def start_sweeper(self, interval: float = EXPORT_SWEEP_INTERVAL):
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_forever(interval))
+
+    async def drain(self, timeout: float = 10):
+        """Stop the sweeper, wait for running jobs (up to ``timeout``), then cancel the rest (marked failed)."""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+        if not self._tasks:
+            return
+        await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    @staticmethod
+    def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+        return {"id": job["_id"], **{k: v for k, v in job.items() if k not in ("_id", "user_id", "key")}}
+
+    def stats(self) -> Dict[str, Any]:
+        return {"active": len(self._tasks), **self.counters}
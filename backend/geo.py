@@ -0,0 +1,144 @@
+"""Geospatial helpers for store search.
+
+Stores carry a GeoJSON ``location`` point (derived from address.latitude and
+address.longitude) covered by a 2dsphere index, so nearby and viewport
+queries only touch the stores in range.
+
+    python geo.py backfill
+"""
+import asyncio
+import base64
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+DEFAULT_RADIUS_METERS = 5000
+MAX_RADIUS_METERS = 50000
+
+
+def valid_coordinates(latitude: Optional[float], longitude: Optional[float]) -> bool:
+    return (
+        isinstance(latitude, (int, float)) and isinstance(longitude, (int, float))
+        and -90 <= latitude <= 90 and -180 <= longitude <= 180
+    )
+
+
+def point(latitude: float, longitude: float) -> Dict[str, Any]:
+    # GeoJSON orders coordinates longitude first
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
+
+def location_for_address(address: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not address:
+        return None
+    latitude, longitude = address.get("latitude"), address.get("longitude")
+    return point(latitude, longitude) if valid_coordinates(latitude, longitude) else None
+
+
+def box_polygon(min_lat: float, min_lng: float, max_lat: float, max_lng: float) -> Dict[str, Any]:
+    """GeoJSON polygon for a map viewport; boxes crossing the antimeridian are not supported."""
+    if min_lat >= max_lat or min_lng >= max_lng:
+        raise ValueError("min must be smaller than max")
+    ring = [[min_lng, min_lat], [max_lng, min_lat], [max_lng, max_lat], [min_lng, max_lat], [min_lng, min_lat]]
+    return {"type": "Polygon", "coordinates": [ring]}
+
+
+def encode_distance_cursor(distance: float, ids: List[str]) -> str:
+    raw = json.dumps([distance, ids]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_distance_cursor(cursor: str) -> Tuple[float, List[str]]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        distance, ids = json.loads(base64.urlsafe_b64decode(padded))
+        return float(distance), [str(i) for i in ids]
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+
+async def nearby_stores(
+    db,
+    latitude: float,
+    longitude: float,
+    radius: float,
+    limit: int,
+    category: Optional[str] = None,
+    cursor: Optional[str] = None,
+    projection: Optional[Dict[str, Any]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Active stores within ``radius`` meters, nearest first, with a ``distance`` field.
+
+    The cursor holds the last distance returned and the ids seen at exactly
+    that distance, so the next page resumes with $geoNear's minDistance.
+    """
+    query: Dict[str, Any] = {"is_active": True}
+    if category:
+        query["category"] = category
+    geo_near: Dict[str, Any] = {
+        "near": point(latitude, longitude),
+        "distanceField": "distance",
+        "maxDistance": radius,
+        "spherical": True,
+        "key": "location",
+    }
+    if cursor:
+        min_distance, seen_ids = decode_distance_cursor(cursor)
+        geo_near["minDistance"] = min_distance
+        query["id"] = {"$nin": seen_ids}
+    geo_near["query"] = query
+
+    docs = await db.stores.aggregate([
+        {"$geoNear": geo_near},
+        {"$limit": limit + 1},
+        {"$project": projection or {"_id": 0}},
+    ]).to_list(limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]["distance"]
+        tied = [doc["id"] for doc in docs if doc["distance"] == last]
+        if cursor and min_distance == last:
+            tied += seen_ids
+        next_cursor = encode_distance_cursor(last, tied)
+    return docs, next_cursor
+
+
+async def backfill_store_locations(db) -> int:
+    """Set ``location`` on stores saved before it existed; returns how many were updated."""
+    updated = 0
+    cursor = db.stores.find(
+        {"location": {"$exists": False}, "address.latitude": {"$ne": None}, "address.longitude": {"$ne": None}},
+        {"_id": 0, "id": 1, "address": 1},
+    )
+    async for store in cursor:
+        location = location_for_address(store.get("address"))
+        if location:
+            result = await db.stores.update_one({"id": store["id"]}, {"$set": {"location": location}})
+            updated += result.modified_count
+    return updated
+
+
+async def _main() -> int:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ.get('DB_NAME', 'paycoin_db')]
+    try:
+        print(f"Backfilled {await backfill_store_locations(db)} store locations")
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] != "backfill":
+        print("usage: python geo.py backfill")
+        sys.exit(2)
+    sys.exit(asyncio.run(_main()))
@@ -0,0 +1,144 @@
+"""Password hashing off the event loop.
+
+bcrypt is slow on purpose (~100-300 ms per call), so register/login hand the
+work to a bounded executor instead of running it inside the async handler.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+from passlib.context import CryptContext
+
+import metrics
+
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+HASH_POOL_KIND = os.environ.get('HASH_POOL_KIND', 'thread')  # "thread" or "process"
+HASH_POOL_WORKERS = int(os.environ.get('HASH_POOL_WORKERS', str(min(4, os.cpu_count() or 1))))
+HASH_POOL_MAX_QUEUE = int(os.environ.get('HASH_POOL_MAX_QUEUE', '64'))
+
+
+class HashPoolSaturated(Exception):
+    """Raised when the hashing queue is full and the request should be shed."""
+
+
+@lru_cache(maxsize=None)
+def _context(rounds: int) -> CryptContext:
+    # Pinning min/max to the configured cost makes needs_update() flag hashes
+    # created with any other cost factor, in either direction.
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds,
+    )
+
+
+# Module-level so they can be pickled into a process pool.
+def _hash(password: str, rounds: int) -> Tuple[str, float]:
+    start = time.perf_counter()
+    hashed = _context(rounds).hash(password)
+    return hashed, time.perf_counter() - start
+
+
+def _verify_and_update(password: str, hashed: str, rounds: int) -> Tuple[Tuple[bool, Optional[str]], float]:
+    start = time.perf_counter()
+    result = _context(rounds).verify_and_update(password, hashed)
+    return result, time.perf_counter() - start
+
+
+class PasswordHasher:
+    def __init__(
+        self,
+        rounds: int = BCRYPT_ROUNDS,
+        kind: str = HASH_POOL_KIND,
+        workers: int = HASH_POOL_WORKERS,
+        max_queue: int = HASH_POOL_MAX_QUEUE,
+    ):
+        self.rounds = rounds
+        self.kind = kind
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: Optional[Executor] = None
+        self._pending = 0
+        self._counters = {
+            "hash_calls": 0,
+            "verify_calls": 0,
+            "rehashes": 0,
+            "rejected": 0,
+            "hash_seconds_total": 0.0,
+            "hash_seconds_max": 0.0,
+            "wait_seconds_total": 0.0,
+        }
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                # bcrypt releases the GIL, so threads give real parallelism.
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="bcrypt"
+                )
+        return self._executor
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self._pending - self.workers)
+
+    async def _submit(self, counter: str, fn, *args) -> Any:
+        if self._pending >= self.workers + self.max_queue:
+            self._counters["rejected"] += 1
+            raise HashPoolSaturated()
+
+        self._counters[counter] += 1
+        self._pending += 1
+        submitted = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result, elapsed = await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self._pending -= 1
+
+        total = time.perf_counter() - submitted
+        self._counters["hash_seconds_total"] += elapsed
+        self._counters["hash_seconds_max"] = max(self._counters["hash_seconds_max"], elapsed)
+        self._counters["wait_seconds_total"] += max(0.0, total - elapsed)
+        operation = ("hash" if counter == "hash_calls" else "verify",)
+        metrics.BCRYPT_DURATION.observe(elapsed, operation)
+        metrics.BCRYPT_WAIT.observe(max(0.0, total - elapsed), operation)
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._submit("hash_calls", _hash, password, self.rounds)
+
+    async def verify_and_update(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """Verify a password; also return a fresh hash if the cost factor changed."""
+        valid, new_hash = await self._submit("verify_calls", _verify_and_update, password, hashed, self.rounds)
+        if new_hash:
+            self._counters["rehashes"] += 1
+        return valid, new_hash
+
+    def stats(self) -> Dict[str, Any]:
+        calls = self._counters["hash_calls"] + self._counters["verify_calls"]
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "rounds": self.rounds,
+            "in_flight": min(self._pending, self.workers),
+            "queue_depth": self.queue_depth,
+            "max_queue": self.max_queue,
+            "avg_hash_seconds": self._counters["hash_seconds_total"] / calls if calls else 0.0,
+            **self._counters,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher()
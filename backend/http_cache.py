@@ -0,0 +1,100 @@
+"""Server-side response cache with strong ETags for public endpoints.
+
+Serialized response bodies are cached per namespace and query string.
+Writers call ``invalidate(namespace)``, which bumps the namespace
+generation so every older entry becomes unreachable. Entries also expire
+after ``ttl`` seconds, which bounds staleness when another worker process
+did the write.
+
+Responses are sent with ``Cache-Control: private, no-cache``: shared caches
+keep nothing and browsers revalidate every time with ``If-None-Match``, which
+the strong ETag answers with an empty 304 while the data is unchanged. A
+max-age would let clients keep showing a deleted product or a stale price.
+"""
+import asyncio
+import hashlib
+import os
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from fastapi import Request, Response
+
+from cache import TTLCache
+
+CATALOG_CACHE_SIZE = int(os.environ.get('CATALOG_CACHE_SIZE', '1000'))
+CATALOG_CACHE_TTL = float(os.environ.get('CATALOG_CACHE_TTL', '30'))
+CACHE_CONTROL = "private, no-cache"
+
+Producer = Callable[[], Awaitable[Tuple[bytes, Dict[str, str]]]]
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    # If-None-Match uses the weak comparison function
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        maxsize: int = CATALOG_CACHE_SIZE,
+        ttl: float = CATALOG_CACHE_TTL,
+    ):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._generations: Dict[str, int] = {}
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.not_modified = 0
+
+    def invalidate(self, namespace: str):
+        self._generations[namespace] = self._generations.get(namespace, 0) + 1
+
+    def _key(self, namespace: str, request: Request) -> Hashable:
+        query = tuple(sorted(request.query_params.multi_items()))
+        return (namespace, self._generations.get(namespace, 0), request.url.path, query)
+
+    async def _load(self, key: Hashable, produce: Producer):
+        """Fetch or build the cached entry; concurrent misses share one build."""
+        entry = self.entries.get(key)
+        if entry is not None:
+            return entry
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            body, headers = await produce()
+            entry = (body, make_etag(body), headers)
+            self.entries.set(key, entry)
+            future.set_result(entry)
+            return entry
+        except BaseException as e:
+            future.set_exception(e)
+            # Waiters re-raise it; mark it retrieved so nothing is logged twice
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def respond(self, request: Request, namespace: str, produce: Producer) -> Response:
+        body, etag, headers = await self._load(self._key(namespace, request), produce)
+        response_headers = {
+            **headers,
+            "ETag": etag,
+            "Cache-Control": CACHE_CONTROL,
+        }
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=response_headers)
+        return Response(content=body, media_type="application/json", headers=response_headers)
+
+    def stats(self) -> Dict[str, object]:
+        return {**self.entries.stats(), "not_modified": self.not_modified}
@@ -0,0 +1,154 @@
+"""Idempotency-Key support for write endpoints.
+
+The first request with a given key runs the handler and stores its response
+in the ``idempotency_keys`` collection (expired by a TTL index after
+IDEMPOTENCY_TTL seconds, and kept in an in-memory front cache). Repeats get
+the stored response back without running the handler again.
+
+Concurrent duplicates are serialized: within a process by a per-key lock,
+across processes by the "in_progress" record the first request inserts,
+which the others wait on. A record left in progress by a crashed worker is
+taken over after IDEMPOTENCY_LOCK_TIMEOUT seconds.
+"""
+import asyncio
+import hashlib
+import json
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from cache import TTLCache
+
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', '86400'))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '10000'))
+IDEMPOTENCY_WAIT = float(os.environ.get('IDEMPOTENCY_WAIT', '10'))
+IDEMPOTENCY_LOCK_TIMEOUT = float(os.environ.get('IDEMPOTENCY_LOCK_TIMEOUT', '60'))
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyConflict(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def fingerprint(payload: Any) -> str:
+    """Stable hash of a JSON request body."""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(
+        self,
+        cache_size: int = IDEMPOTENCY_CACHE_SIZE,
+        ttl: float = IDEMPOTENCY_TTL,
+        wait: float = IDEMPOTENCY_WAIT,
+        lock_timeout: float = IDEMPOTENCY_LOCK_TIMEOUT,
+        poll_interval: float = 0.05,
+    ):
+        self.cache = TTLCache(maxsize=cache_size, ttl=ttl)
+        self.wait = wait
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self._locks: Dict[str, Tuple[asyncio.Lock, int]] = {}
+        self.counters = {"executed": 0, "replayed": 0, "conflicts": 0}
+
+    @asynccontextmanager
+    async def _locked(self, record_id: str):
+        lock, users = self._locks.get(record_id, (None, 0))
+        lock = lock or asyncio.Lock()
+        self._locks[record_id] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[record_id]
+            if users == 1:
+                del self._locks[record_id]
+            else:
+                self._locks[record_id] = (lock, users - 1)
+
+    def _replay(self, record: Dict[str, Any], request_fingerprint: str) -> Tuple[Any, bool]:
+        if record["fingerprint"] != request_fingerprint:
+            self.counters["conflicts"] += 1
+            raise IdempotencyConflict(422, "Idempotency-Key was already used with a different request")
+        self.counters["replayed"] += 1
+        return record["response"], True
+
+    async def _claim(self, collection, record_id: str, request_fingerprint: str) -> Tuple[bool, Any]:
+        """Insert the in-progress record; returns (claimed, the other request's record)."""
+        now = datetime.utcnow()
+        try:
+            await collection.insert_one(
+                {"_id": record_id, "fingerprint": request_fingerprint, "state": "in_progress", "created_at": now}
+            )
+            return True, None
+        except DuplicateKeyError:
+            pass
+        # Take over a record abandoned by a worker that died mid-request
+        abandoned = await collection.update_one(
+            {"_id": record_id, "state": "in_progress", "created_at": {"$lt": now - timedelta(seconds=self.lock_timeout)}},
+            {"$set": {"fingerprint": request_fingerprint, "created_at": now}},
+        )
+        if abandoned.modified_count:
+            return True, None
+        return False, await collection.find_one({"_id": record_id})
+
+    async def _wait_done(self, collection, record_id: str) -> Any:
+        """Poll until another process finishes the key; None if its record disappeared."""
+        deadline = asyncio.get_running_loop().time() + self.wait
+        while True:
+            record = await collection.find_one({"_id": record_id})
+            if record is None or record["state"] == "done":
+                return record
+            if asyncio.get_running_loop().time() >= deadline:
+                self.counters["conflicts"] += 1
+                raise IdempotencyConflict(409, "A request with this Idempotency-Key is still in progress")
+            await asyncio.sleep(self.poll_interval)
+
+    async def run(
+        self,
+        collection,
+        scope: str,
+        key: str,
+        request_fingerprint: str,
+        produce: Callable[[], Awaitable[Any]],
+    ) -> Tuple[Any, bool]:
+        """Return (response, replayed). ``produce`` must return a JSON-serializable body."""
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise IdempotencyConflict(400, f"Idempotency-Key must have 1 to {MAX_KEY_LENGTH} characters")
+        record_id = f"{scope}:{key}"
+
+        async with self._locked(record_id):
+            while True:
+                record = self.cache.get(record_id)
+                if record is not None:
+                    return self._replay(record, request_fingerprint)
+                claimed, existing = await self._claim(collection, record_id, request_fingerprint)
+                if claimed:
+                    break
+                if existing is not None and existing["state"] == "in_progress":
+                    existing = await self._wait_done(collection, record_id)
+                if existing is None:
+                    continue  # the other request failed or expired; run it ourselves
+                self.cache.set(record_id, existing)
+                return self._replay(existing, request_fingerprint)
+
+            try:
+                response = await produce()
+            except BaseException:
+                # Nothing was stored, so a retry may run the handler again
+                await collection.delete_one({"_id": record_id, "state": "in_progress"})
+                raise
+            await collection.update_one({"_id": record_id}, {"$set": {"state": "done", "response": response}})
+            self.cache.set(record_id, {"fingerprint": request_fingerprint, "response": response})
+            self.counters["executed"] += 1
+            return response, False
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "cache": self.cache.stats(), "locks": len(self._locks)}
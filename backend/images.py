@@ -0,0 +1,122 @@
+"""Background generation of resized image variants.
+
+After an upload is committed, ImageVariantProcessor renders downscaled
+copies (IMAGE_VARIANT_SIZES, longest side in px) in a process pool, stores
+them in the blob store and hands the resulting {size: url} map to a
+callback that records it on the owning document. List endpoints can then
+serve the smallest variant that is large enough instead of the original.
+
+Requires Pillow; without it uploads keep working and no variants are made.
+"""
+import asyncio
+import io
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, Dict, Optional, Sequence, Set
+
+logger = logging.getLogger(__name__)
+
+IMAGE_VARIANT_SIZES = tuple(
+    int(size) for size in os.environ.get('IMAGE_VARIANT_SIZES', '64,256,1024').split(',')
+)
+IMAGE_VARIANT_FORMAT = os.environ.get('IMAGE_VARIANT_FORMAT', 'webp')  # "webp" or "jpeg"
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', '2'))
+# Refuse to decode anything bigger than this (decompression bombs)
+MAX_IMAGE_PIXELS = 40_000_000
+
+_FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg")}
+
+
+def render_variants(data: bytes, sizes: Sequence[int], fmt: str = IMAGE_VARIANT_FORMAT) -> Dict[int, bytes]:
+    """Downscale ``data`` to each size smaller than the original. Runs in a worker process."""
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    pil_format, _ = _FORMATS[fmt]
+    variants = {}
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        if pil_format == "JPEG":
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        for size in sorted(sizes):
+            if size >= max(image.size):
+                break
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)
+            buffer = io.BytesIO()
+            resized.save(buffer, pil_format, quality=80)
+            variants[size] = buffer.getvalue()
+    return variants
+
+
+def select_variant(original: Optional[str], variants: Optional[Dict[str, str]], size: Optional[int]) -> Optional[str]:
+    """Smallest variant whose longest side is at least ``size``; the original otherwise."""
+    if not size or not variants:
+        return original
+    adequate = sorted(int(s) for s in variants if int(s) >= size)
+    return variants[str(adequate[0])] if adequate else original
+
+
+class ImageVariantProcessor:
+    def __init__(
+        self,
+        store,
+        sizes: Sequence[int] = IMAGE_VARIANT_SIZES,
+        fmt: str = IMAGE_VARIANT_FORMAT,
+        workers: int = IMAGE_WORKERS,
+    ):
+        self.store = store
+        self.sizes = tuple(sizes)
+        self.fmt = fmt
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._tasks: Set[asyncio.Task] = set()
+        try:
+            import PIL  # noqa: F401
+            self.enabled = True
+        except ImportError:
+            logger.warning("Pillow is not installed; image variants are disabled")
+            self.enabled = False
+
+    async def generate(self, source_url: str) -> Dict[str, str]:
+        """Render and store the variants of a blob-store URL; returns {size: url}."""
+        key = self.store.key_for_url(source_url)
+        if key is None:
+            return {}
+        data = await self.store.read(key)
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        rendered = await loop.run_in_executor(self._executor, render_variants, data, self.sizes, self.fmt)
+        _, content_type = _FORMATS[self.fmt]
+        return {str(size): await self.store.put(blob, content_type) for size, blob in rendered.items()}
+
+    def submit(self, source_url: str, on_done: Callable[[Dict[str, str]], Awaitable[None]]):
+        """Generate variants in the background and pass them to ``on_done``."""
+        if not self.enabled or self.store.key_for_url(source_url) is None:
+            return
+
+        async def run():
+            try:
+                variants = await self.generate(source_url)
+                if variants:
+                    await on_done(variants)
+            except Exception as e:
+                logger.warning(f"Could not generate variants for {source_url}: {e}")
+
+        task = asyncio.create_task(run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def drain(self, timeout: float = 10):
+        """Wait for pending jobs (up to ``timeout``), then stop the worker pool."""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in self._tasks:
+            task.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,364 @@
+"""MongoDB index bootstrap and query-plan verification.
+
+Every query issued by the API handlers is listed in HANDLER_QUERIES; the
+``verify`` command explains each one against a live database and fails if
+any of them would run as a collection scan.
+
+    python indexes.py ensure
+    python indexes.py verify
+"""
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+from dotenv import load_dotenv
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+from events import EVENTS_TTL
+from exports import EXPORT_JOB_TTL
+from idempotency import IDEMPOTENCY_TTL
+
+logger = logging.getLogger(__name__)
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+    ],
+    # List endpoints sort on (created_at, id) newest first, see pagination.py.
+    "stores": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel(
+            [("is_active", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="is_active_created_at",
+        ),
+        IndexModel(
+            [("merchant_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="merchant_id_created_at",
+        ),
+        IndexModel(
+            [("location", "2dsphere"), ("is_active", ASCENDING), ("category", ASCENDING)],
+            name="location_2dsphere",
+        ),
+        IndexModel([("search_terms", ASCENDING), ("is_active", ASCENDING)], name="search_terms"),
+    ],
+    "products": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel(
+            [("is_active", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="is_active_created_at",
+        ),
+        IndexModel(
+            [("is_active", ASCENDING), ("merchant_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="is_active_merchant_id_created_at",
+        ),
+        IndexModel(
+            [("merchant_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="merchant_id_created_at",
+        ),
+        # GET /search (multikey over the prefix terms)
+        IndexModel([("search_terms", ASCENDING), ("is_active", ASCENDING)], name="search_terms"),
+    ],
+    "transactions": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel(
+            [("from_user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="from_user_id_created_at",
+        ),
+        IndexModel(
+            [("to_user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="to_user_id_created_at",
+        ),
+        # A signed quote can back at most one transaction
+        IndexModel(
+            [("quote_id", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"quote_id": {"$type": "string"}},
+            name="quote_id_unique",
+        ),
+        # Batch ingestion: a client idempotency key is used once per payer
+        IndexModel(
+            [("from_user_id", ASCENDING), ("idempotency_key", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"idempotency_key": {"$type": "string"}},
+            name="from_user_id_idempotency_key_unique",
+        ),
+        # Settlement watcher: pending transactions due for a receipt check
+        IndexModel(
+            [("status", ASCENDING), ("settlement_next_check_at", ASCENDING), ("created_at", ASCENDING)],
+            partialFilterExpression={"status": "pending"},
+            name="pending_settlement",
+        ),
+    ],
+    "idempotency_keys": [
+        # Lookups are by _id; this only expires old keys
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=IDEMPOTENCY_TTL, name="created_at_ttl"),
+    ],
+    "events": [
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=EVENTS_TTL, name="created_at_ttl"),
+    ],
+    # Looked up by _id (and user_id); only expires old jobs
+    "export_jobs": [
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=EXPORT_JOB_TTL, name="created_at_ttl"),
+    ],
+    # Refresh tokens are looked up by _id (their hash); sessions are revoked by family or user
+    "refresh_tokens": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+        IndexModel([("family", ASCENDING)], name="family"),
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+    ],
+    "revocations": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+    # Event stream tickets are redeemed by _id; unused ones expire
+    "event_tickets": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+    # Rate-limit buckets are looked up by _id; full buckets expire
+    "rate_limits": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+    # Platform summary job: the unfinished run of a range, then its partition checkpoints
+    "platform_summary_runs": [
+        IndexModel([("key", ASCENDING), ("status", ASCENDING)], name="key_status"),
+    ],
+    "platform_summary_partials": [
+        IndexModel([("run_id", ASCENDING)], name="run_id"),
+    ],
+    "analytics_rollups": [
+        IndexModel(
+            [
+                ("merchant_id", ASCENDING),
+                ("granularity", ASCENDING),
+                ("bucket", ASCENDING),
+                ("token_type", ASCENDING),
+                ("status", ASCENDING),
+            ],
+            unique=True,
+            name="merchant_bucket_unique",
+        ),
+    ],
+}
+
+LIST_SORT = [("created_at", DESCENDING), ("id", DESCENDING)]
+
+# (handler, collection, "find" filter [+ "sort"] or "aggregate" pipeline) with sample values.
+HANDLER_QUERIES: List[Dict[str, Any]] = [
+    {"handler": "register", "collection": "users", "find": {"email": "probe@example.com"}},
+    {"handler": "get_current_user", "collection": "users", "find": {"id": "probe"}},
+    {"handler": "auth_tokens.AuthTokens.revoke_family", "collection": "refresh_tokens", "find": {"family": "probe"}},
+    {"handler": "auth_tokens.AuthTokens.revoke_user", "collection": "refresh_tokens", "find": {"user_id": "probe"}},
+    {
+        "handler": "auth_tokens.RevocationList",
+        "collection": "revocations",
+        "find": {"expires_at": {"$gt": datetime(2024, 1, 1)}},
+    },
+    {"handler": "get_stores", "collection": "stores", "find": {"is_active": True}, "sort": LIST_SORT},
+    {
+        "handler": "get_nearby_stores",
+        "collection": "stores",
+        "aggregate": [
+            {"$geoNear": {
+                "near": {"type": "Point", "coordinates": [-46.65, -23.56]},
+                "distanceField": "distance",
+                "maxDistance": 5000,
+                "spherical": True,
+                "key": "location",
+                "query": {"is_active": True},
+            }},
+            {"$limit": 100},
+        ],
+    },
+    {
+        "handler": "get_stores_within",
+        "collection": "stores",
+        "find": {
+            "is_active": True,
+            "location": {"$geoWithin": {"$geometry": {
+                "type": "Polygon",
+                "coordinates": [[[-46.7, -23.6], [-46.6, -23.6], [-46.6, -23.5], [-46.7, -23.5], [-46.7, -23.6]]],
+            }}},
+        },
+        "sort": LIST_SORT,
+    },
+    {"handler": "get_my_stores", "collection": "stores", "find": {"merchant_id": "probe"}, "sort": LIST_SORT},
+    {"handler": "get_products", "collection": "products", "find": {"is_active": True}, "sort": LIST_SORT},
+    {
+        "handler": "get_products",
+        "collection": "products",
+        "find": {"is_active": True, "merchant_id": "probe"},
+        "sort": LIST_SORT,
+    },
+    {"handler": "get_my_products", "collection": "products", "find": {"merchant_id": "probe"}, "sort": LIST_SORT},
+    {
+        "handler": "search_catalog",
+        "collection": "products",
+        "aggregate": [
+            {"$match": {"is_active": True, "search_terms": {"$all": ["cam", "azul"]}}},
+            {"$limit": 20000},
+            {"$facet": {"total": [{"$count": "count"}]}},
+        ],
+    },
+    {
+        "handler": "search_catalog",
+        "collection": "stores",
+        "aggregate": [
+            {"$match": {"is_active": True, "search_terms": {"$all": ["pad"]}}},
+            {"$limit": 20000},
+            {"$facet": {"total": [{"$count": "count"}]}},
+        ],
+    },
+    {
+        "handler": "get_user_transactions",
+        "collection": "transactions",
+        "find": {"$or": [{"from_user_id": "probe"}, {"to_user_id": "probe"}]},
+        "sort": LIST_SORT,
+    },
+    {
+        "handler": "export_transactions",
+        "collection": "transactions",
+        "find": {
+            "$or": [{"from_user_id": "probe"}, {"to_user_id": "probe"}],
+            "created_at": {"$gte": datetime(2024, 1, 1), "$lt": datetime(2025, 1, 1)},
+        },
+        "sort": [("created_at", ASCENDING), ("id", ASCENDING)],
+    },
+    {
+        "handler": "reports.load_transactions",
+        "collection": "transactions",
+        "find": {
+            "to_user_id": "probe",
+            "status": {"$in": ["pending", "completed"]},
+            "created_at": {"$gte": datetime(2024, 1, 1), "$lt": datetime(2025, 1, 1)},
+        },
+        "sort": [("created_at", DESCENDING), ("id", DESCENDING)],
+    },
+    {
+        "handler": "create_transactions_batch",
+        "collection": "transactions",
+        "find": {"from_user_id": "probe", "idempotency_key": {"$in": ["a", "b"]}},
+    },
+    {
+        "handler": "get_dashboard_analytics",
+        "collection": "analytics_rollups",
+        "find": {"merchant_id": "probe", "granularity": "day", "bucket": {"$gte": datetime(2024, 1, 1)}},
+    },
+    {
+        "handler": "settlement.SettlementWatcher",
+        "collection": "transactions",
+        "find": {
+            "status": "pending",
+            "transaction_hash": {"$type": "string"},
+            "settlement_next_check_at": {"$not": {"$gt": datetime(2024, 1, 1)}},
+        },
+        "sort": [("created_at", ASCENDING)],
+    },
+    {
+        "handler": "platform_summary.load_partition",
+        "collection": "transactions",
+        "find": {
+            "to_user_id": {"$gte": "a", "$lt": "b"},
+            "status": {"$in": ["pending", "completed"]},
+            "created_at": {"$gte": datetime(2024, 1, 1), "$lt": datetime(2024, 2, 1)},
+        },
+    },
+    {
+        "handler": "platform_summary.partition_bounds",
+        "collection": "transactions",
+        "aggregate": [
+            {"$sort": {"to_user_id": ASCENDING}},
+            {"$group": {"_id": "$to_user_id", "count": {"$sum": 1}}},
+        ],
+    },
+    {
+        "handler": "rollups.rebuild",
+        "collection": "transactions",
+        "aggregate": [
+            {"$match": {"to_user_id": "probe"}},
+            {"$group": {"_id": "$token_type", "sum": {"$sum": "$amount"}}},
+        ],
+    },
+]
+
+
+async def ensure_indexes(db):
+    """Create every index in INDEXES. Raises if one cannot be built (e.g. duplicate emails)."""
+    for collection, models in INDEXES.items():
+        try:
+            await db[collection].create_indexes(models)
+        except Exception:
+            logger.exception("Could not create indexes on %s", collection)
+            raise
+
+
+def _walk(node: Any) -> Iterator[Dict[str, Any]]:
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from _walk(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _walk(value)
+
+
+def find_collscans(explain_doc: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Return the COLLSCAN stages found in the winning plan(s) of an explain() result."""
+    scans = []
+    for node in _walk(explain_doc):
+        if "winningPlan" in node:
+            scans.extend(
+                stage for stage in _walk(node["winningPlan"]) if stage.get("stage") == "COLLSCAN"
+            )
+    return scans
+
+
+async def explain_query(db, query: Dict[str, Any]) -> Dict[str, Any]:
+    if "aggregate" in query:
+        return await db.command(
+            "aggregate", query["collection"], pipeline=query["aggregate"], explain=True
+        )
+    cursor = db[query["collection"]].find(query["find"])
+    if query.get("sort"):
+        cursor = cursor.sort(query["sort"])
+    return await cursor.explain()
+
+
+async def verify_query_plans(db) -> List[str]:
+    """Explain every handler query; return a description of each one that scans a collection."""
+    failures = []
+    for query in HANDLER_QUERIES:
+        plan = await explain_query(db, query)
+        if find_collscans(plan):
+            failures.append(f"{query['handler']} ({query['collection']}): COLLSCAN")
+    return failures
+
+
+async def _main(command: str) -> int:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ.get('DB_NAME', 'paycoin_db')]
+    try:
+        await ensure_indexes(db)
+        if command == "ensure":
+            print("Indexes created")
+            return 0
+        failures = await verify_query_plans(db)
+        for failure in failures:
+            print(failure)
+        print(f"{len(HANDLER_QUERIES) - len(failures)}/{len(HANDLER_QUERIES)} queries use an index")
+        return 1 if failures else 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in ("ensure", "verify"):
+        print("usage: python indexes.py ensure|verify")
+        sys.exit(2)
+    sys.exit(asyncio.run(_main(sys.argv[1])))
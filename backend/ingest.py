@@ -0,0 +1,104 @@
+"""Bulk ingestion helpers for POST /api/transactions/batch.
+
+The request body is either a JSON array or NDJSON (one object per line,
+parsed as it streams in). Documents are written with a single insert_many;
+write errors are mapped back to the position of the item that caused them.
+"""
+import json
+import os
+from typing import Any, Dict, List
+
+from fastapi import Request
+from pymongo.errors import BulkWriteError
+
+TRANSACTION_BATCH_MAX = int(os.environ.get('TRANSACTION_BATCH_MAX', '1000'))
+# Body size allowance per item; a batch body may be at most max_items times this
+MAX_ITEM_BYTES = 4096
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+DUPLICATE_KEY = 11000
+
+
+class BatchRejected(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _parse_line(line: bytes, number: int) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError:
+        raise BatchRejected(400, f"Invalid JSON on line {number}")
+
+
+async def read_items(request: Request, max_items: int = TRANSACTION_BATCH_MAX) -> List[Any]:
+    """Parse the batch body; raises BatchRejected (400/413) on bad or oversized input."""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    max_bytes, received = max_items * MAX_ITEM_BYTES, 0
+    too_large = BatchRejected(413, f"A batch holds at most {max_items} transactions")
+    if content_type in NDJSON_TYPES:
+        items: List[Any] = []
+        buffer, number = b"", 0
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_bytes:
+                raise too_large
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                number += 1
+                if line.strip():
+                    items.append(_parse_line(line, number))
+                    if len(items) > max_items:
+                        raise too_large
+        if buffer.strip():
+            items.append(_parse_line(buffer, number + 1))
+    else:
+        body = bytearray()
+        async for chunk in request.stream():
+            body += chunk
+            if len(body) > max_bytes:
+                raise too_large
+        try:
+            items = json.loads(body)
+        except ValueError:
+            raise BatchRejected(400, "Body must be a JSON array or NDJSON")
+        if not isinstance(items, list):
+            raise BatchRejected(400, "Body must be a JSON array or NDJSON")
+    if not items:
+        raise BatchRejected(400, "Batch is empty")
+    if len(items) > max_items:
+        raise too_large
+    return items
+
+
+async def insert_batch(collection, docs: List[Dict[str, Any]], ordered: bool = False) -> Dict[int, Dict[str, Any]]:
+    """insert_many ``docs``; return the write error for each position that was not inserted.
+
+    With ``ordered`` the server stops at the first error, so every later
+    position is reported with code None ("not attempted").
+    """
+    if not docs:
+        return {}
+    try:
+        await collection.insert_many(docs, ordered=ordered)
+    except BulkWriteError as e:
+        errors = {error["index"]: error for error in e.details.get("writeErrors", [])}
+        if ordered and errors:
+            first = min(errors)
+            errors.update({i: {"code": None} for i in range(first + 1, len(docs))})
+        return errors
+    return {}
+
+
+def duplicate_of(error: Dict[str, Any], field: str) -> bool:
+    """True if ``error`` is a duplicate key error on an index containing ``field``."""
+    if error.get("code") != DUPLICATE_KEY:
+        return False
+    key_pattern = error.get("keyPattern")
+    if key_pattern is not None:
+        return field in key_pattern
+    return field in error.get("errmsg", "")
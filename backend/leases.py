@@ -0,0 +1,42 @@
+"""Named leases in MongoDB, so a singleton background job runs in one worker.
+
+Every worker process may try to take a lease; the one that holds it renews it
+on each pass and the others skip their pass. A lease whose holder died is
+taken over once ``expires_at`` passes.
+"""
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from pymongo.errors import DuplicateKeyError
+
+
+def default_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class Lease:
+    def __init__(self, collection, name: str, ttl: timedelta, owner: Optional[str] = None):
+        self.collection = collection
+        self.name = name
+        self.ttl = ttl
+        self.owner = owner or default_owner()
+
+    async def acquire(self, now: Optional[datetime] = None) -> bool:
+        """Take or renew the lease; False while another owner holds an unexpired one."""
+        now = now or datetime.utcnow()
+        try:
+            await self.collection.update_one(
+                {"_id": self.name, "$or": [{"owner": self.owner}, {"expires_at": {"$lte": now}}]},
+                {"$set": {"owner": self.owner, "expires_at": now + self.ttl}},
+                upsert=True,
+            )
+            return True
+        except DuplicateKeyError:
+            # The filter missed and the upsert collided with the holder's document
+            return False
+
+    async def release(self):
+        await self.collection.delete_one({"_id": self.name, "owner": self.owner})
@@ -0,0 +1,68 @@
+"""Readiness and graceful drain for one worker process.
+
+On SIGTERM/SIGINT uvicorn stops accepting connections and waits up to its
+graceful-shutdown timeout for open requests before running the lifespan
+shutdown. Long-lived responses (the merchant WebSocket and SSE streams)
+would hold that wait until the timeout, so ``Lifecycle`` chains onto the
+server's signal handlers and flips to draining as soon as the signal
+arrives: /api/health/ready starts answering 503 and event streams end so
+their clients reconnect to a worker that is staying up.
+"""
+import asyncio
+import logging
+import signal
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DRAIN_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+
+class Lifecycle:
+    def __init__(self):
+        self.started = False
+        self._draining = asyncio.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._previous: Dict[int, object] = {}
+
+    @property
+    def draining(self) -> bool:
+        return self._draining.is_set()
+
+    @property
+    def ready(self) -> bool:
+        return self.started and not self.draining
+
+    def begin_drain(self):
+        if not self.draining:
+            logger.info("Draining: readiness now fails and event streams are closing")
+            self._draining.set()
+
+    async def wait_draining(self):
+        await self._draining.wait()
+
+    def install_signal_handlers(self):
+        """Chain onto the SIGTERM/SIGINT handlers the server installed (main thread only)."""
+        self._loop = asyncio.get_running_loop()
+        for sig in DRAIN_SIGNALS:
+            try:
+                previous = signal.getsignal(sig)
+                signal.signal(sig, self._on_signal)
+            except ValueError:
+                # Not the main thread (e.g. TestClient); the server owns signals there
+                return
+            self._previous[sig] = previous
+
+    def restore_signal_handlers(self):
+        for sig, previous in self._previous.items():
+            signal.signal(sig, previous)
+        self._previous.clear()
+
+    def _on_signal(self, sig, frame):
+        self._loop.call_soon_threadsafe(self.begin_drain)
+        previous = self._previous.get(sig)
+        if callable(previous):
+            previous(sig, frame)
+        elif previous == signal.SIG_DFL:
+            signal.signal(sig, signal.SIG_DFL)
+            signal.raise_signal(sig)
@@ -0,0 +1,90 @@
+"""Logging setup, request ids and the access log.
+
+LOG_FORMAT=json writes one JSON object per line (for log shippers) instead
+of the plain text format; either way records logged while a request is
+being served carry its ``request_id``. The id comes from a sane incoming
+X-Request-ID header (so a proxy's id is kept) or is generated, and is
+returned in the X-Request-ID response header.
+
+ACCESS_LOG=true adds one line per HTTP request with the route template,
+status and duration. It is off by default because uvicorn already logs
+requests; turn uvicorn's off (--no-access-log) when enabling it.
+"""
+import contextvars
+import json
+import logging
+import os
+import re
+import uuid
+from datetime import datetime, timezone
+from typing import Iterable, Optional, Tuple
+
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')  # "text" or "json"
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'info').upper()
+ACCESS_LOG = os.environ.get('ACCESS_LOG', 'false').lower() == 'true'
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+
+request_id: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+access_logger = logging.getLogger("access")
+
+
+def request_id_from_headers(headers: Iterable[Tuple[bytes, bytes]]) -> str:
+    for name, value in headers:
+        if name == b"x-request-id":
+            candidate = value.decode("latin-1")
+            if _VALID_REQUEST_ID.match(candidate):
+                return candidate
+            break
+    return uuid.uuid4().hex
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        rid = getattr(record, "request_id", "-")
+        if rid != "-":
+            entry["request_id"] = rid
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure(log_format: str = LOG_FORMAT, level: str = LOG_LEVEL):
+    handler = logging.StreamHandler()
+    handler.addFilter(RequestIdFilter())
+    handler.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT))
+    logging.basicConfig(level=level, handlers=[handler])
+
+
+def access(scope, route: str, status_code: int, elapsed: float, enabled: Optional[bool] = None):
+    if not (ACCESS_LOG if enabled is None else enabled):
+        return
+    client = scope.get("client")
+    fields = {
+        "method": scope["method"],
+        "path": scope["path"],
+        "route": route,
+        "status": status_code,
+        "duration_ms": round(elapsed * 1000, 2),
+        "client": client[0] if client else None,
+    }
+    access_logger.info(
+        f'{fields["method"]} {fields["path"]} {status_code} {fields["duration_ms"]}ms',
+        extra={"fields": fields},
+    )
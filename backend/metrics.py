@@ -0,0 +1,279 @@
+"""Prometheus text-format metrics for the API, MongoDB and bcrypt.
+
+A small in-process registry (counters and histograms keyed by label
+tuples, plus an in-flight gauge) rendered at GET /metrics. Recording is a
+dict lookup and a few additions under a lock: Motor reports command events
+from its driver threads, so every metric is thread-safe.
+
+- ``InstrumentationMiddleware``: per-route request count, latency histogram
+  and in-flight gauge, keyed by the route template so that label
+  cardinality stays bounded. It also assigns the request id
+  (see logs.py) and writes the access log.
+- ``MongoCommandMetrics``: a pymongo command listener timing every command
+  by name and collection.
+- hashing.py records the time bcrypt spends hashing and waiting for a
+  worker; ratelimit.py counts the requests it refuses.
+
+Values are per process; with several workers each scrape sees the worker
+that answered it.
+"""
+import bisect
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from pymongo import monitoring
+
+import logs
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+BCRYPT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels: Labels = ()) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in values
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label tuple: one count per bucket, one for +Inf, then the sum
+        self._series: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, labels: Labels = ()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, labels: Labels = ()) -> int:
+        series = self._series.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            snapshot = [(labels, list(series)) for labels, series in self._series.items()]
+        lines = self._header()
+        for labels, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-1]!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+def route_label(scope) -> str:
+    """Route template of a routed request (FastAPI sets scope["route"]), the mount path for mounted apps."""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if "endpoint" in scope:
+        return scope.get("root_path") or "unmatched"
+    return "unmatched"
+
+
+class InFlight(_Metric):
+    """Gauge of requests being served, labelled when scraped.
+
+    The route is only known once the router has run, so requests are
+    tracked by scope and grouped by method and route at render time.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help, ("method", "route"))
+        self._active: Dict[int, dict] = {}
+
+    def enter(self, scope):
+        self._active[id(scope)] = scope
+
+    def exit(self, scope):
+        self._active.pop(id(scope), None)
+
+    def value(self, labels: Labels) -> int:
+        return sum(1 for scope in list(self._active.values()) if (scope["method"], route_label(scope)) == labels)
+
+    def render(self) -> List[str]:
+        counts: Dict[Labels, int] = {}
+        for scope in list(self._active.values()):
+            labels = (scope["method"], route_label(scope))
+            counts[labels] = counts.get(labels, 0) + 1
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {count}" for labels, count in counts.items()
+        ]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "HTTP requests by route template and status.", ("method", "route", "status")))
+HTTP_DURATION = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Time until the response body was sent.", ("method", "route")))
+HTTP_IN_FLIGHT = REGISTRY.register(InFlight(
+    "http_requests_in_flight", "Requests (and open event streams) being served."))
+MONGO_COMMANDS = REGISTRY.register(Counter(
+    "mongodb_commands_total", "MongoDB commands by outcome.", ("command", "collection", "outcome")))
+MONGO_DURATION = REGISTRY.register(Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command round-trip time reported by the driver.",
+    ("command", "collection"), MONGO_BUCKETS))
+BCRYPT_DURATION = REGISTRY.register(Histogram(
+    "bcrypt_duration_seconds", "Time spent inside bcrypt per operation.", ("operation",), BCRYPT_BUCKETS))
+BCRYPT_WAIT = REGISTRY.register(Histogram(
+    "bcrypt_queue_wait_seconds", "Time waiting for a free hashing worker.", ("operation",), BCRYPT_BUCKETS))
+RATE_LIMIT_REJECTIONS = REGISTRY.register(Counter(
+    "rate_limit_rejections_total", "Requests refused with 429 by the rate limiter.", ("route_class", "scope")))
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Time every MongoDB command; ``duration_micros`` comes from the driver."""
+
+    def __init__(self):
+        # request_id -> collection, from the started event (finished events do not carry it)
+        self._collections: Dict[int, str] = {}
+
+    def started(self, event):
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        else:
+            collection = event.command.get(event.command_name)
+        self._collections[event.request_id] = collection if isinstance(collection, str) else ""
+
+    def _finished(self, event, outcome: str):
+        collection = self._collections.pop(event.request_id, "")
+        MONGO_COMMANDS.inc((event.command_name, collection, outcome))
+        MONGO_DURATION.observe(event.duration_micros / 1e6, (event.command_name, collection))
+
+    def succeeded(self, event):
+        self._finished(event, "ok")
+
+    def failed(self, event):
+        self._finished(event, "error")
+
+
+class InstrumentationMiddleware:
+    """Request id, access log and per-route metrics for HTTP requests.
+
+    Labels use the route template (``/api/upload/image/{image_type}``), read
+    from the scope after routing, so cardinality stays bounded and no extra
+    route matching is done.
+    """
+
+    def __init__(self, app, enabled: bool = METRICS_ENABLED):
+        self.app = app
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = logs.request_id_from_headers(scope["headers"])
+        token = logs.request_id.set(request_id)
+        status_code = 500
+        began = time.perf_counter()
+
+        async def send_with_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode())]
+            await send(message)
+
+        if self.enabled:
+            HTTP_IN_FLIGHT.enter(scope)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            elapsed = time.perf_counter() - began
+            route = route_label(scope)
+            if self.enabled:
+                HTTP_IN_FLIGHT.exit(scope)
+                HTTP_REQUESTS.inc((scope["method"], route, str(status_code)))
+                HTTP_DURATION.observe(elapsed, (scope["method"], route))
+            logs.access(scope, route, status_code, elapsed)
+            logs.request_id.reset(token)
@@ -0,0 +1,93 @@
+"""Keyset pagination and NDJSON streaming for list endpoints.
+
+Lists are ordered newest first on (created_at, id). The cursor handed to the
+client encodes the sort key of the last row returned, so the next page is a
+range scan on the index instead of a skip over everything already seen.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from pymongo import DESCENDING
+
+from serialization import RowEncoder, dumps
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+
+SORT = [("created_at", DESCENDING), ("id", DESCENDING)]
+
+
+def encode_cursor(doc: Dict[str, Any]) -> str:
+    raw = json.dumps([doc["created_at"].isoformat(), doc["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Raises ValueError if the cursor was not produced by encode_cursor."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, doc_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), str(doc_id)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def apply_cursor(query: Dict[str, Any], cursor: Optional[str]) -> Dict[str, Any]:
+    if not cursor:
+        return query
+    created_at, doc_id = decode_cursor(cursor)
+    after = {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": doc_id}},
+    ]}
+    return {"$and": [query, after]} if query else after
+
+
+async def fetch_page(
+    collection,
+    query: Dict[str, Any],
+    limit: int,
+    cursor: Optional[str] = None,
+    projection: Optional[Dict[str, Any]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Return up to ``limit`` documents and the cursor for the next page (None on the last page)."""
+    docs = await (
+        collection.find(apply_cursor(query, cursor), projection)
+        .sort(SORT)
+        .limit(limit + 1)
+        .to_list(limit + 1)
+    )
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+
+async def stream_ndjson(
+    collection,
+    query: Dict[str, Any],
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    encoder: Optional[RowEncoder] = None,
+    transform: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+) -> AsyncIterator[bytes]:
+    """Yield one JSON document per line as the Motor cursor produces them.
+
+    With an ``encoder``, rows are projected and default-filled exactly as in
+    the JSON pages (see serialization.py).
+    """
+    mongo_cursor = (
+        collection.find(apply_cursor(query, cursor), encoder.projection if encoder else {"_id": 0})
+        .sort(SORT)
+        .batch_size(STREAM_BATCH_SIZE)
+    )
+    if limit:
+        mongo_cursor = mongo_cursor.limit(limit)
+    async for doc in mongo_cursor:
+        doc.pop("_id", None)
+        if transform:
+            doc = transform(doc)
+        if encoder:
+            doc = encoder.row(doc)
+        yield dumps(doc) + b"\n"
@@ -0,0 +1,381 @@
+"""Daily platform summaries computed offline from every merchant's transactions.
+
+The job partitions ``transactions`` by merchant (``to_user_id`` ranges of
+about PLATFORM_PARTITION_ROWS transactions, cut from the to_user_id index)
+and summarizes the partitions in a process pool. Each worker reads its range
+with its own MongoDB client into numpy columns and computes, per UTC day:
+
+- GMV and transaction count per token (amounts are in token units, so PSPAY
+  and USDT are never added together) and the token mix (share of the count);
+- active merchants: merchants with at least one transaction that day;
+- churned merchants: merchants whose last transaction was PLATFORM_CHURN_DAYS
+  days earlier and who have not transacted since.
+
+A merchant's whole history falls in one partition, so partition results
+simply add up. Each finished partition is checkpointed in
+``platform_summary_partials``; an interrupted run started again with the
+same range resumes from the missing partitions. When every partition is
+done the per-day totals replace the documents of ``platform_daily_summaries``
+(``_id`` is the day) and the checkpoints are deleted.
+
+Transactions written while the job runs may or may not be counted; run it
+after the day being summarized has ended.
+
+    python platform_summary.py run [--since YYYY-MM-DD] [--until YYYY-MM-DD] [--workers N] [--restart]
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from pymongo import ASCENDING, ReplaceOne
+
+from reports import DEFAULT_STATUSES
+
+logger = logging.getLogger(__name__)
+
+PLATFORM_WORKERS = int(os.environ.get('PLATFORM_WORKERS', str(os.cpu_count() or 1)))
+PLATFORM_PARTITION_ROWS = int(os.environ.get('PLATFORM_PARTITION_ROWS', '500000'))
+PLATFORM_CHURN_DAYS = int(os.environ.get('PLATFORM_CHURN_DAYS', '30'))
+PLATFORM_BATCH_SIZE = int(os.environ.get('PLATFORM_BATCH_SIZE', '10000'))
+PLATFORM_DAYS = int(os.environ.get('PLATFORM_DAYS', '30'))
+
+RUNS = "platform_summary_runs"
+PARTIALS = "platform_summary_partials"
+SUMMARIES = "platform_daily_summaries"
+
+TOKENS = ("PSPAY", "USDT")
+_PROJECTION = {"_id": 0, "to_user_id": 1, "amount": 1, "token_type": 1, "created_at": 1}
+
+# (lower, upper) to_user_id bounds; None is unbounded
+Partition = Tuple[Optional[str], Optional[str]]
+
+
+def partition_bounds(transactions, rows_per_partition: int = PLATFORM_PARTITION_ROWS) -> List[Partition]:
+    """Contiguous merchant ranges of about ``rows_per_partition`` transactions each.
+
+    The ranges cover every possible to_user_id, so merchants that appear after
+    the bounds were cut still land in a partition.
+    """
+    # Sorting on the index prefix first lets the $group run as a covered index scan
+    pipeline = [
+        {"$sort": {"to_user_id": ASCENDING}},
+        {"$group": {"_id": "$to_user_id", "count": {"$sum": 1}}},
+        {"$sort": {"_id": ASCENDING}},
+    ]
+    lowers: List[Optional[str]] = [None]
+    rows = 0
+    for merchant in transactions.aggregate(pipeline, allowDiskUse=True):
+        if rows >= rows_per_partition:
+            lowers.append(merchant["_id"])
+            rows = 0
+        rows += merchant["count"]
+    return list(zip(lowers, lowers[1:] + [None]))
+
+
+def load_partition(
+    transactions,
+    partition: Partition,
+    start: datetime,
+    end: datetime,
+    statuses: Sequence[str] = DEFAULT_STATUSES,
+    batch_size: int = PLATFORM_BATCH_SIZE,
+) -> pd.DataFrame:
+    """merchant/amount/token_type/created_at of the partition's transactions in [start, end)."""
+    lower, upper = partition
+    merchant_range = {key: value for key, value in (("$gte", lower), ("$lt", upper)) if value is not None}
+    query: Dict[str, Any] = {
+        "status": {"$in": list(statuses)},
+        "created_at": {"$gte": start, "$lt": end},
+    }
+    if merchant_range:
+        query["to_user_id"] = merchant_range
+    columns: Dict[str, List[np.ndarray]] = {"merchant": [], "amount": [], "token_type": [], "created_at": []}
+
+    def flush(batch):
+        columns["merchant"].append(np.array([doc["to_user_id"] for doc in batch], dtype=object))
+        columns["amount"].append(np.fromiter((doc["amount"] for doc in batch), dtype=np.float64, count=len(batch)))
+        columns["token_type"].append(np.array([doc.get("token_type") for doc in batch], dtype=object))
+        columns["created_at"].append(np.array([doc["created_at"] for doc in batch], dtype="datetime64[ms]"))
+
+    batch = []
+    for doc in transactions.find(query, _PROJECTION).batch_size(batch_size):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    empty = {"merchant": object, "amount": np.float64, "token_type": object, "created_at": "datetime64[ms]"}
+    return pd.DataFrame({
+        name: (np.concatenate(parts) if parts else np.empty(0, empty[name])) for name, parts in columns.items()
+    }).astype({"merchant": "category", "token_type": "category"})
+
+
+def summarize_frame(frame: pd.DataFrame, start: datetime, end: datetime, churn_days: int = PLATFORM_CHURN_DAYS) -> pd.DataFrame:
+    """Per-day metrics of one partition, indexed by every day of [start, end).
+
+    ``frame`` must hold the transactions from ``start - churn_days`` on, so
+    churn can be told apart from a merchant that was already gone.
+    """
+    days = pd.date_range(start, end, freq="D", inclusive="left")
+    day = frame["created_at"].dt.floor("D")
+    token = frame["token_type"].astype(object)
+    in_range = (day >= start).to_numpy()
+
+    summary = pd.DataFrame(index=days)
+    totals = (
+        frame.loc[in_range, "amount"]
+        .groupby([day[in_range], token[in_range]])
+        .agg(["sum", "count"])
+        .unstack(fill_value=0)
+    )
+    for name in TOKENS:
+        summary[f"gmv_{name}"] = totals[("sum", name)] if ("sum", name) in totals else 0.0
+        summary[f"count_{name}"] = totals[("count", name)] if ("count", name) in totals else 0
+
+    # One row per (merchant, day with activity), in order
+    activity = (
+        pd.DataFrame({"merchant": frame["merchant"].cat.codes.to_numpy(), "day": day.to_numpy()})
+        .drop_duplicates()
+        .sort_values(["merchant", "day"], ignore_index=True)
+    )
+    summary["active_merchants"] = activity.loc[activity["day"] >= start, "day"].value_counts()
+
+    # Churned on the day ``churn_days`` after an activity day not followed by another within that window
+    following = activity.groupby("merchant")["day"].shift(-1)
+    churn_day = activity["day"] + pd.Timedelta(days=churn_days)
+    churned = (following.isna() | (following > churn_day)) & (churn_day >= start) & (churn_day < end)
+    summary["churned_merchants"] = churn_day[churned].value_counts()
+
+    return summary.fillna(0).astype({
+        **{f"count_{name}": np.int64 for name in TOKENS},
+        "active_merchants": np.int64,
+        "churned_merchants": np.int64,
+    })
+
+
+# Set in each pool process by _init_worker: its own client (MongoClient is not fork-safe)
+_worker_db = None
+
+
+def _init_worker(mongo_url: str, db_name: str):
+    global _worker_db
+    from pymongo import MongoClient
+
+    _worker_db = MongoClient(mongo_url)[db_name]
+
+
+def summarize_partition(
+    partition: Partition,
+    start: datetime,
+    end: datetime,
+    churn_days: int,
+    statuses: Sequence[str],
+    batch_size: int = PLATFORM_BATCH_SIZE,
+) -> Tuple[List[Dict[str, Any]], int]:
+    """Pool task: (per-day records, transactions read) for one partition."""
+    frame = load_partition(
+        _worker_db.transactions, partition, start - timedelta(days=churn_days), end, statuses, batch_size
+    )
+    summary = summarize_frame(frame, start, end, churn_days)
+    records = summary[summary.to_numpy().any(axis=1)].rename_axis("day").reset_index().to_dict("records")
+    for record in records:
+        record["day"] = record["day"].to_pydatetime()
+    return records, len(frame)
+
+
+def combine(partials: List[List[Dict[str, Any]]], start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    """Add the partitions' records up into one summary document per day."""
+    rows = [record for records in partials for record in records]
+    columns = [f"{kind}_{name}" for kind in ("gmv", "count") for name in TOKENS] + [
+        "active_merchants", "churned_merchants",
+    ]
+    totals = (
+        pd.DataFrame(rows, columns=["day"] + columns)
+        .groupby("day")[columns].sum()
+        .reindex(pd.date_range(start, end, freq="D", inclusive="left"), fill_value=0)
+    )
+    summaries = []
+    for day, row in totals.iterrows():
+        counts = {name: int(row[f"count_{name}"]) for name in TOKENS}
+        count = sum(counts.values())
+        summaries.append({
+            "_id": day.to_pydatetime(),
+            "gmv": {name: float(row[f"gmv_{name}"]) for name in TOKENS},
+            "transactions": counts,
+            "transaction_count": count,
+            "token_mix": {name: (counts[name] / count if count else 0.0) for name in TOKENS},
+            "active_merchants": int(row["active_merchants"]),
+            "churned_merchants": int(row["churned_merchants"]),
+        })
+    return summaries
+
+
+def _run_key(start: datetime, end: datetime, churn_days: int, statuses: Sequence[str]) -> str:
+    return f"{start:%Y-%m-%d}/{end:%Y-%m-%d}/{churn_days}/{','.join(sorted(statuses))}"
+
+
+def run(
+    db,
+    executor: Executor,
+    start: datetime,
+    end: datetime,
+    churn_days: int = PLATFORM_CHURN_DAYS,
+    statuses: Sequence[str] = DEFAULT_STATUSES,
+    rows_per_partition: int = PLATFORM_PARTITION_ROWS,
+    restart: bool = False,
+    progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """Summarize [start, end) with ``executor`` (whose workers went through _init_worker).
+
+    Resumes the unfinished run with the same parameters unless ``restart``.
+    Returns the run document.
+    """
+    key = _run_key(start, end, churn_days, statuses)
+    statuses = sorted(statuses)
+    job = None if restart else db[RUNS].find_one({"key": key, "status": "running"})
+    if job is None:
+        db[RUNS].update_many({"key": key, "status": "running"}, {"$set": {"status": "abandoned"}})
+        job = {
+            "_id": uuid.uuid4().hex,
+            "key": key,
+            "status": "running",
+            "start": start,
+            "end": end,
+            "churn_days": churn_days,
+            "statuses": statuses,
+            "partitions": [list(bounds) for bounds in partition_bounds(db.transactions, rows_per_partition)],
+            "started_at": datetime.utcnow(),
+        }
+        db[RUNS].insert_one(job)
+    else:
+        logger.info(f"Resuming platform summary run {job['_id']}")
+
+    done = {doc["index"]: doc for doc in db[PARTIALS].find({"run_id": job["_id"]}, {"index": 1, "rows": 1})}
+    state = {
+        "run_id": job["_id"],
+        "partitions": len(job["partitions"]),
+        "done": len(done),
+        "resumed": len(done),
+        "rows": sum(doc["rows"] for doc in done.values()),
+    }
+    if progress:
+        progress(state)
+
+    futures = {
+        executor.submit(summarize_partition, tuple(bounds), start, end, churn_days, statuses): index
+        for index, bounds in enumerate(job["partitions"])
+        if index not in done
+    }
+    try:
+        for future in as_completed(futures):
+            records, rows = future.result()
+            index = futures[future]
+            db[PARTIALS].replace_one(
+                {"_id": f"{job['_id']}:{index}"},
+                {"run_id": job["_id"], "index": index, "rows": rows, "records": records},
+                upsert=True,
+            )
+            state["done"] += 1
+            state["rows"] += rows
+            if progress:
+                progress(state)
+    except BaseException:
+        # Finished partitions are checkpointed; the next run picks up from there
+        for future in futures:
+            future.cancel()
+        raise
+
+    partials = [doc["records"] for doc in db[PARTIALS].find({"run_id": job["_id"]}, {"records": 1})]
+    computed_at = datetime.utcnow()
+    summaries = combine(partials, start, end)
+    if summaries:
+        db[SUMMARIES].bulk_write([
+            ReplaceOne({"_id": doc["_id"]}, {**doc, "run_id": job["_id"], "computed_at": computed_at}, upsert=True)
+            for doc in summaries
+        ], ordered=False)
+    db[RUNS].update_one({"_id": job["_id"]}, {"$set": {
+        "status": "completed", "rows": state["rows"], "days": len(summaries), "completed_at": computed_at,
+    }})
+    db[PARTIALS].delete_many({"run_id": job["_id"]})
+    return db[RUNS].find_one({"_id": job["_id"]})
+
+
+def create_executor(mongo_url: str, db_name: str, workers: int = PLATFORM_WORKERS) -> ProcessPoolExecutor:
+    # spawn: the parent's MongoClient threads must not be forked into the workers
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(mongo_url, db_name),
+    )
+
+
+class ProgressPrinter:
+    def __init__(self, stream=sys.stderr):
+        self.stream = stream
+        self.began = time.monotonic()
+
+    def __call__(self, state: Dict[str, Any]):
+        elapsed = time.monotonic() - self.began
+        fresh = state["done"] - state["resumed"]
+        remaining = state["partitions"] - state["done"]
+        eta = f"{elapsed / fresh * remaining:.0f}s" if fresh else "?"
+        print(
+            f"\r[{state['done']}/{state['partitions']}] {state['rows']:,} transactions,"
+            f" {elapsed:.0f}s elapsed, eta {eta}",
+            end="\n" if not remaining else "", file=self.stream, flush=True,
+        )
+
+
+def _day(value: str) -> datetime:
+    return datetime.strptime(value, "%Y-%m-%d")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run")
+    run_parser.add_argument("--until", type=_day, help="first day not summarized (default: today, UTC)")
+    run_parser.add_argument("--since", type=_day, help=f"first day summarized (default: {PLATFORM_DAYS} days before --until)")
+    run_parser.add_argument("--workers", type=int, default=PLATFORM_WORKERS)
+    run_parser.add_argument("--churn-days", type=int, default=PLATFORM_CHURN_DAYS)
+    run_parser.add_argument("--restart", action="store_true", help="ignore the checkpoints of an unfinished run")
+    args = parser.parse_args(argv)
+
+    load_dotenv(Path(__file__).parent / '.env')
+    mongo_url, db_name = os.environ['MONGO_URL'], os.environ.get('DB_NAME', 'paycoin_db')
+    until = args.until or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    since = args.since or until - timedelta(days=PLATFORM_DAYS)
+    if since >= until:
+        parser.error("--since must be before --until")
+
+    client = MongoClient(mongo_url)
+    try:
+        with create_executor(mongo_url, db_name, args.workers) as executor:
+            job = run(
+                client[db_name], executor, since, until, args.churn_days,
+                restart=args.restart, progress=ProgressPrinter(),
+            )
+        print(f"Summarized {job['rows']:,} transactions into {job['days']} days (run {job['_id']})")
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""Server-side price quotes for payment QR codes.
+
+The PSPAY/USD price (GeckoTerminal pool) and the USD/BRL rate
+(OpenExchangeRates with OPENEXCHANGERATES_APP_ID, otherwise the keyless ECB
+reference rate from Frankfurter) are fetched here once per TTL and shared by
+every client. Concurrent refreshes of a source are coalesced into a single
+upstream request, and a value past its TTL is still served (while a
+background refresh runs) until it is older than TTL + QUOTE_MAX_STALE.
+
+Quotes are signed with HMAC-SHA256 and carry an expiry, so
+create_transaction can check that the amount a client submits came from a
+quote we issued.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import math
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+PSPAY_TOKEN_ADDRESS = os.environ.get('PSPAY_TOKEN_ADDRESS', '0x275fE1709Dc07112BcAf56A3465ECE683c5Fb04c')
+PSPAY_PRICE_URL = os.environ.get(
+    'PSPAY_PRICE_URL',
+    'https://api.geckoterminal.com/api/v2/networks/bsc/pools/0xc5ff521f620d26508c238f064085f06af360ed1f',
+)
+OPENEXCHANGERATES_APP_ID = os.environ.get('OPENEXCHANGERATES_APP_ID', '')
+# Without a key, fall back to a keyless source (ECB rate, updated on business days)
+KEYLESS_USD_BRL_RATE_URL = 'https://api.frankfurter.app/latest?from=USD&to=BRL'
+USD_BRL_RATE_URL = os.environ.get(
+    'USD_BRL_RATE_URL',
+    f'https://openexchangerates.org/api/latest.json?app_id={OPENEXCHANGERATES_APP_ID}&symbols=BRL'
+    if OPENEXCHANGERATES_APP_ID else KEYLESS_USD_BRL_RATE_URL,
+)
+PSPAY_PRICE_TTL = float(os.environ.get('PSPAY_PRICE_TTL', '30'))
+USD_BRL_RATE_TTL = float(os.environ.get('USD_BRL_RATE_TTL', '300'))
+QUOTE_MAX_STALE = float(os.environ.get('QUOTE_MAX_STALE', '600'))
+QUOTE_VALIDITY_SECONDS = int(os.environ.get('QUOTE_VALIDITY_SECONDS', '120'))
+QUOTE_HTTP_TIMEOUT = float(os.environ.get('QUOTE_HTTP_TIMEOUT', '5'))
+
+SUPPORTED_TOKENS = ("PSPAY", "USDT")
+
+
+class QuoteUnavailable(Exception):
+    """No fresh or acceptably stale value could be obtained for a source."""
+
+
+class InvalidQuote(Exception):
+    pass
+
+
+def _fetch_json(url: str) -> Dict[str, Any]:
+    response = requests.get(url, timeout=QUOTE_HTTP_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+def fetch_pspay_usd(url: str = PSPAY_PRICE_URL) -> float:
+    data = _fetch_json(url)["data"]
+    base_token_id = data["relationships"]["base_token"]["data"]["id"]
+    if PSPAY_TOKEN_ADDRESS.lower() not in base_token_id.lower():
+        raise ValueError("PSPAY is not the base token of the configured pool")
+    return float(data["attributes"]["base_token_price_usd"])
+
+
+def fetch_usd_brl(url: str = USD_BRL_RATE_URL) -> float:
+    # OpenExchangeRates and Frankfurter both answer {"rates": {"BRL": ...}}
+    return float(_fetch_json(url)["rates"]["BRL"])
+
+
+class CachedSource:
+    """One upstream value with TTL, single-flight refresh and stale-while-revalidate."""
+
+    def __init__(
+        self,
+        name: str,
+        fetch: Callable[[], float],
+        ttl: float,
+        max_stale: float = QUOTE_MAX_STALE,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._clock = clock
+        self._value: Optional[float] = None
+        self._fetched_at = 0.0
+        self._inflight: Optional[asyncio.Task] = None
+        self.counters = {"hits": 0, "stale_hits": 0, "upstream_calls": 0, "upstream_errors": 0}
+
+    async def get(self) -> Tuple[float, bool]:
+        """Return (value, is_stale)."""
+        if self._value is not None:
+            age = self._clock() - self._fetched_at
+            if age < self.ttl:
+                self.counters["hits"] += 1
+                return self._value, False
+            if age < self.ttl + self.max_stale:
+                self.counters["stale_hits"] += 1
+                self._start_refresh()
+                return self._value, True
+        try:
+            return await asyncio.shield(self._start_refresh()), False
+        except Exception as e:
+            raise QuoteUnavailable(f"{self.name}: {e}") from e
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.create_task(self._refresh())
+            self._inflight.add_done_callback(self._log_failure)
+        return self._inflight
+
+    async def _refresh(self) -> float:
+        self.counters["upstream_calls"] += 1
+        value = await asyncio.to_thread(self.fetch)
+        if not math.isfinite(value) or value <= 0:
+            raise ValueError(f"implausible value {value!r}")
+        self._value, self._fetched_at = value, self._clock()
+        return value
+
+    def _log_failure(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            self.counters["upstream_errors"] += 1
+            logger.warning(f"Quote source {self.name} refresh failed: {task.exception()}")
+
+    def stats(self) -> Dict[str, Any]:
+        age = self._clock() - self._fetched_at if self._value is not None else None
+        return {"value": self._value, "age_seconds": age, "ttl": self.ttl, **self.counters}
+
+
+def _canonical(payload: Dict[str, Any]) -> bytes:
+    return json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()
+
+
+class QuoteService:
+    def __init__(self, secret_key: str, sources: Optional[Dict[str, CachedSource]] = None):
+        self._secret = secret_key.encode()
+        self.sources = sources or {
+            "pspay_usd": CachedSource("pspay_usd", fetch_pspay_usd, PSPAY_PRICE_TTL),
+            "usd_brl": CachedSource("usd_brl", fetch_usd_brl, USD_BRL_RATE_TTL),
+        }
+
+    def sign(self, payload: Dict[str, Any]) -> str:
+        return hmac.new(self._secret, _canonical(payload), hashlib.sha256).hexdigest()
+
+    async def quote(self, token: str, amount_brl: Optional[float] = None) -> Dict[str, Any]:
+        if token not in SUPPORTED_TOKENS:
+            raise ValueError(f"Unsupported token: {token}")
+
+        brl_per_usd, stale_brl = await self.sources["usd_brl"].get()
+        if token == "USDT":
+            usd_per_token, stale_token = 1.0, False
+        else:
+            usd_per_token, stale_token = await self.sources["pspay_usd"].get()
+
+        issued_at = datetime.utcnow().replace(microsecond=0)
+        payload: Dict[str, Any] = {
+            "quote_id": str(uuid.uuid4()),
+            "token": token,
+            "usd_per_token": usd_per_token,
+            "brl_per_usd": brl_per_usd,
+            "brl_per_token": usd_per_token * brl_per_usd,
+            "issued_at": issued_at.isoformat(),
+            "expires_at": (issued_at + timedelta(seconds=QUOTE_VALIDITY_SECONDS)).isoformat(),
+        }
+        if amount_brl is not None:
+            payload["amount_brl"] = amount_brl
+            payload["amount_token"] = amount_brl / payload["brl_per_token"]
+        return {**payload, "stale": stale_brl or stale_token, "signature": self.sign(payload)}
+
+    def verify(self, quote: Dict[str, Any], now: Optional[datetime] = None) -> Dict[str, Any]:
+        """Check signature and expiry of a quote returned to us; raises InvalidQuote."""
+        if not isinstance(quote, dict) or "signature" not in quote:
+            raise InvalidQuote("Quote is missing its signature")
+        payload = {k: v for k, v in quote.items() if k not in ("signature", "stale")}
+        if not hmac.compare_digest(self.sign(payload), str(quote["signature"])):
+            raise InvalidQuote("Quote signature is invalid")
+        if datetime.fromisoformat(payload["expires_at"]) < (now or datetime.utcnow()):
+            raise InvalidQuote("Quote has expired")
+        return payload
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: source.stats() for name, source in self.sources.items()}
@@ -0,0 +1,201 @@
+"""Token-bucket rate limits per client IP or per user, by route class.
+
+Every route class has its own limit, RATE_LIMIT_<CLASS>=<requests>/<seconds>:
+a bucket of ``requests`` tokens refilled evenly over ``seconds``, one token
+per request. An empty bucket means 429 with Retry-After (seconds until the
+next token). ``off`` disables a class.
+
+- ``auth`` (login, register; by IP): every call runs bcrypt;
+- ``catalog`` (public store/product lists, search, quotes; by IP): pages of
+  up to MAX_PAGE_SIZE documents without authentication;
+- ``write`` (transactions, stores, products, uploads; by user);
+- ``user`` (authenticated reads; by user).
+
+Buckets are stored as GCRA state, the "theoretical arrival time" (tat) at
+which the bucket would be full again, so a check is one comparison and one
+write: a request is allowed while ``tat - now <= period - interval``, and
+moves ``tat`` to ``max(tat, now) + interval``.
+
+Backends (RATE_LIMIT_BACKEND):
+- ``memory``: per process. With N workers a client gets up to N times the limit;
+- ``mongo``: buckets in the ``rate_limits`` collection (TTL index on
+  ``expires_at``), shared by all workers; one conditional update per check.
+
+If the shared backend fails the request is let through (and logged): an
+unreachable MongoDB should not turn every request into a 429.
+"""
+import logging
+import math
+import os
+import time
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from cache import TTLCache
+from metrics import RATE_LIMIT_REJECTIONS
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_CACHE_SIZE = int(os.environ.get('RATE_LIMIT_CACHE_SIZE', '100000'))
+DEFAULT_LIMITS = {
+    "auth": "20/60",
+    "catalog": "120/60",
+    "write": "60/60",
+    "user": "300/60",
+}
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Rate limit exceeded, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Limit:
+    def __init__(self, requests: int, period: float):
+        if requests < 1 or period <= 0:
+            raise ValueError("A limit needs at least one request per positive period")
+        self.requests = requests
+        self.period = period
+        self.interval = period / requests
+        # How far ahead of now tat may be and still have a token left
+        self.tolerance = period - self.interval
+
+    @classmethod
+    def parse(cls, spec: str) -> Optional["Limit"]:
+        """``"20/60"`` -> 20 requests per 60 seconds; ``"off"`` -> None."""
+        if spec.strip().lower() in ("off", "0", ""):
+            return None
+        requests, _, period = spec.partition("/")
+        return cls(int(requests), float(period or 1))
+
+    def __str__(self) -> str:
+        return f"{self.requests}/{self.period:g}"
+
+
+def limits_from_env() -> Dict[str, Optional[Limit]]:
+    return {
+        route_class: Limit.parse(os.environ.get(f"RATE_LIMIT_{route_class.upper()}", default))
+        for route_class, default in DEFAULT_LIMITS.items()
+    }
+
+
+class MemoryBackend:
+    """Buckets of this process only; idle buckets (full again) are dropped."""
+
+    name = "memory"
+
+    def __init__(self, maxsize: int = RATE_LIMIT_CACHE_SIZE):
+        # Evicting a bucket under pressure refills it, which errs on the side of letting requests in
+        self.buckets = TTLCache(maxsize=maxsize, ttl=0)
+
+    async def take(self, key: str, limit: Limit, now: float) -> float:
+        """Take a token; returns 0 when allowed, else the seconds until one is available."""
+        tat = max(self.buckets.get(key, now), now)
+        if tat - now > limit.tolerance:
+            return tat - now - limit.tolerance
+        tat += limit.interval
+        self.buckets.set(key, tat, ttl=tat - now)
+        return 0.0
+
+    def stats(self) -> Dict[str, int]:
+        return {"buckets": len(self.buckets), "evictions": self.buckets.evictions}
+
+
+class MongoBackend:
+    """Buckets shared by every worker, one document per key."""
+
+    name = "mongo"
+
+    def __init__(self, collection, attempts: int = 3):
+        self.collection = collection
+        self.attempts = attempts
+
+    async def take(self, key: str, limit: Limit, now: float) -> float:
+        expires_at = datetime.utcfromtimestamp(now + limit.period)
+        for _ in range(self.attempts):
+            # Bucket partly drained but not empty: take a token
+            result = await self.collection.update_one(
+                {"_id": key, "tat": {"$gt": now, "$lte": now + limit.tolerance}},
+                {"$inc": {"tat": limit.interval}, "$set": {"expires_at": expires_at}},
+            )
+            if result.modified_count:
+                return 0.0
+            # Bucket full (or new): restart it from now
+            try:
+                await self.collection.update_one(
+                    {"_id": key, "tat": {"$lte": now}},
+                    {"$set": {"tat": now + limit.interval, "expires_at": expires_at}},
+                    upsert=True,
+                )
+                return 0.0
+            except DuplicateKeyError:
+                # The document exists with tat > now: either empty, or another
+                # worker took a token between the two updates and we try again
+                doc = await self.collection.find_one({"_id": key}, {"tat": 1})
+                if doc is None:
+                    continue
+                wait = doc["tat"] - now - limit.tolerance
+                if wait > 0:
+                    return wait
+        # Lost every race: the bucket is busy but not empty
+        return 0.0
+
+    def stats(self) -> Dict[str, str]:
+        return {"collection": self.collection.name}
+
+
+def create_backend(db, backend: str = RATE_LIMIT_BACKEND):
+    if backend == "mongo":
+        return MongoBackend(db.rate_limits)
+    if backend != "memory":
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend}")
+    return MemoryBackend()
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        backend,
+        limits: Optional[Dict[str, Optional[Limit]]] = None,
+        enabled: bool = RATE_LIMIT_ENABLED,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.backend = backend
+        self.limits = limits_from_env() if limits is None else limits
+        self.enabled = enabled
+        self._clock = clock
+        self.counters = {"allowed": 0, "rejected": 0, "errors": 0}
+
+    async def check(self, route_class: str, scope: str, identity: str):
+        """Take a token from the ``route_class`` bucket of ``identity``; raises RateLimited if empty.
+
+        ``scope`` says what ``identity`` is ("ip" or "user").
+        """
+        limit = self.limits.get(route_class)
+        if not self.enabled or limit is None:
+            return
+        try:
+            wait = await self.backend.take(f"{route_class}:{scope}:{identity}", limit, self._clock())
+        except PyMongoError as e:
+            self.counters["errors"] += 1
+            logger.warning(f"Rate limit backend unavailable, allowing request: {e!r}")
+            return
+        if wait > 0:
+            self.counters["rejected"] += 1
+            RATE_LIMIT_REJECTIONS.inc((route_class, scope))
+            raise RateLimited(max(1, math.ceil(wait)))
+        self.counters["allowed"] += 1
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "backend": self.backend.name,
+            "limits": {route_class: str(limit) if limit else "off" for route_class, limit in self.limits.items()},
+            **self.counters,
+            **self.backend.stats(),
+        }
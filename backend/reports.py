@@ -0,0 +1,238 @@
+"""Merchant reports computed from the raw transaction history.
+
+The rollups (rollups.py) answer totals and time series cheaply, but not
+amount percentiles, hour-of-day heatmaps or customer rankings, which need
+the individual transactions. ``load_transactions`` reads a merchant's
+transactions in batches of REPORT_BATCH_SIZE straight into numpy columns
+(concatenated once into a DataFrame), and ``build_report`` computes every
+section with vectorized pandas/numpy operations, in a worker thread.
+
+Amounts are in token units, so every figure is split by token (PSPAY and
+USDT are never added together).
+
+Reports are memoized per merchant and parameters for REPORT_CACHE_TTL
+seconds, REPORT_CACHE_SIZE reports in all. A new or settled transaction drops its merchant's reports in the
+worker that handled it; other workers serve theirs until the TTL runs out.
+At most REPORT_MAX_ROWS transactions (the newest) are read; ``truncated``
+says when the range held more.
+"""
+import asyncio
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import numpy as np
+import pandas as pd
+from pymongo import DESCENDING
+
+from cache import TTLCache
+
+REPORT_CACHE_SIZE = int(os.environ.get('REPORT_CACHE_SIZE', '1000'))
+REPORT_CACHE_TTL = float(os.environ.get('REPORT_CACHE_TTL', '300'))
+REPORT_BATCH_SIZE = int(os.environ.get('REPORT_BATCH_SIZE', '10000'))
+REPORT_MAX_ROWS = int(os.environ.get('REPORT_MAX_ROWS', '1000000'))
+
+GRANULARITIES = ("hour", "day", "month")
+DEFAULT_STATUSES = ("pending", "completed")
+PERCENTILES = (50, 90, 95, 99)
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+_FIELDS = {"amount": 1, "token_type": 1, "status": 1, "created_at": 1, "from_user_id": 1}
+
+
+class InvalidReport(ValueError):
+    pass
+
+
+async def load_transactions(
+    collection,
+    merchant_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    statuses: Sequence[str] = DEFAULT_STATUSES,
+    batch_size: int = REPORT_BATCH_SIZE,
+    max_rows: int = REPORT_MAX_ROWS,
+):
+    """(DataFrame of amount/token_type/status/created_at/from_user_id, truncated)."""
+    query: Dict[str, Any] = {"to_user_id": merchant_id, "status": {"$in": list(statuses)}}
+    created_at = {key: value for key, value in (("$gte", start), ("$lt", end)) if value is not None}
+    if created_at:
+        query["created_at"] = created_at
+    cursor = (
+        collection.find(query, {"_id": 0, **_FIELDS})
+        .sort([("created_at", DESCENDING), ("id", DESCENDING)])
+        .limit(max_rows + 1)
+        .batch_size(batch_size)
+    )
+    columns: Dict[str, List[np.ndarray]] = {name: [] for name in _FIELDS}
+    while batch := await cursor.to_list(batch_size):
+        columns["amount"].append(np.fromiter((doc["amount"] for doc in batch), dtype=np.float64, count=len(batch)))
+        columns["created_at"].append(np.array([doc["created_at"] for doc in batch], dtype="datetime64[ms]"))
+        for name in ("token_type", "status", "from_user_id"):
+            columns[name].append(np.array([doc.get(name) for doc in batch], dtype=object))
+
+    frame = pd.DataFrame({
+        "amount": np.concatenate(columns["amount"]) if columns["amount"] else np.empty(0, np.float64),
+        "created_at": (
+            np.concatenate(columns["created_at"]) if columns["created_at"] else np.empty(0, "datetime64[ms]")
+        ),
+        **{
+            name: pd.Categorical(np.concatenate(columns[name]) if columns[name] else np.empty(0, object))
+            for name in ("token_type", "status", "from_user_id")
+        },
+    })
+    truncated = len(frame) > max_rows
+    return (frame.iloc[:max_rows] if truncated else frame), truncated
+
+
+def _bucket(wall: pd.Series, granularity: str) -> pd.Series:
+    if granularity == "hour":
+        return wall.dt.floor("h")
+    if granularity == "day":
+        return wall.dt.floor("D")
+    if granularity == "month":
+        return wall.dt.to_period("M").dt.to_timestamp()
+    raise InvalidReport(f"Unknown granularity: {granularity}")
+
+
+def build_report(frame: pd.DataFrame, granularity: str = "day", timezone: str = "UTC", top: int = 10) -> Dict[str, Any]:
+    """Every report section from a frame returned by ``load_transactions``."""
+    # Stored times are naive UTC; buckets and the heatmap use the merchant's wall clock
+    wall = frame["created_at"].dt.tz_localize("UTC").dt.tz_convert(timezone).dt.tz_localize(None)
+    tokens = sorted(frame["token_type"].dropna().unique().tolist())
+    token = frame["token_type"].astype(object)
+
+    by_token = {}
+    grouped = frame.groupby(token, observed=True)["amount"]
+    stats = grouped.agg(["sum", "count", "mean", "min", "max"])
+    quantiles = grouped.quantile([p / 100 for p in PERCENTILES]).unstack()
+    for name in tokens:
+        row = stats.loc[name]
+        by_token[name] = {
+            "revenue": float(row["sum"]),
+            "count": int(row["count"]),
+            "avg": float(row["mean"]),
+            "min": float(row["min"]),
+            "max": float(row["max"]),
+            "percentiles": {f"p{p}": float(quantiles.loc[name, p / 100]) for p in PERCENTILES},
+        }
+
+    series = []
+    if len(frame):
+        buckets = frame.assign(bucket=_bucket(wall, granularity), token=token)
+        pivot = buckets.pivot_table(
+            index="bucket", columns="token", values="amount", aggfunc=["sum", "count"], fill_value=0
+        ).sort_index()
+        for moment, row in zip(pivot.index.to_pydatetime(), pivot.itertuples(index=False)):
+            values = dict(zip(pivot.columns, row))
+            series.append({
+                "bucket": moment,
+                "count": int(sum(values[("count", name)] for name in tokens)),
+                "by_token": {
+                    name: {"revenue": float(values[("sum", name)]), "count": int(values[("count", name)])}
+                    for name in tokens
+                },
+            })
+
+    # 7 x 24 matrices indexed by (weekday, hour): one bincount each
+    cells = wall.dt.dayofweek.to_numpy() * 24 + wall.dt.hour.to_numpy()
+    amounts = frame["amount"].to_numpy()
+    heatmap = {
+        "weekdays": list(WEEKDAYS),
+        "count": np.bincount(cells, minlength=168).reshape(7, 24).tolist(),
+        "revenue": {
+            name: np.bincount(
+                cells, weights=np.where(token.to_numpy() == name, amounts, 0.0), minlength=168
+            ).reshape(7, 24).tolist()
+            for name in tokens
+        },
+    }
+
+    top_customers = {}
+    if len(frame):
+        customers = frame.groupby([token, frame["from_user_id"].astype(object)])["amount"].agg(["sum", "count"])
+        for name in tokens:
+            ranked = customers.loc[name].nlargest(top, "sum")
+            top_customers[name] = [
+                {"user_id": user_id, "revenue": float(revenue), "count": int(count)}
+                for user_id, revenue, count in zip(ranked.index, ranked["sum"], ranked["count"])
+            ]
+
+    return {
+        "granularity": granularity,
+        "timezone": timezone,
+        "transaction_count": int(len(frame)),
+        "by_token": by_token,
+        "series": series,
+        "heatmap": heatmap,
+        "top_customers": top_customers,
+    }
+
+
+class ReportService:
+    def __init__(
+        self,
+        collection,
+        cache_size: int = REPORT_CACHE_SIZE,
+        ttl: float = REPORT_CACHE_TTL,
+        max_rows: int = REPORT_MAX_ROWS,
+    ):
+        self.collection = collection
+        self.max_rows = max_rows
+        # (merchant_id, parameters) -> report; _keys finds a merchant's entries to invalidate them
+        self.cache = TTLCache(maxsize=cache_size, ttl=ttl)
+        self._keys: Dict[str, Set[Tuple]] = {}
+        self.computed = 0
+
+    async def report(
+        self,
+        merchant_id: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        granularity: str = "day",
+        timezone: str = "UTC",
+        statuses: Optional[Sequence[str]] = None,
+        top: int = 10,
+    ) -> Dict[str, Any]:
+        """Raises InvalidReport for an unknown granularity or timezone."""
+        statuses = sorted(set(statuses or DEFAULT_STATUSES))
+        if granularity not in GRANULARITIES:
+            raise InvalidReport(f"Unknown granularity: {granularity}")
+        try:
+            ZoneInfo(timezone)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise InvalidReport(f"Unknown timezone: {timezone}")
+        key = (merchant_id, start, end, granularity, timezone, tuple(statuses), top)
+        report = self.cache.get(key)
+        if report is not None:
+            return report
+        keys = self._keys.setdefault(merchant_id, set())
+
+        frame, truncated = await load_transactions(
+            self.collection, merchant_id, start, end, statuses, max_rows=self.max_rows
+        )
+        report = await asyncio.to_thread(build_report, frame, granularity, timezone, top)
+        report.update({"start": start, "end": end, "statuses": statuses, "truncated": truncated})
+        self.computed += 1
+        # If the merchant was invalidated meanwhile the report may be stale: it is returned but not cached
+        if self._keys.get(merchant_id) is keys:
+            self.cache.set(key, report)
+            keys.add(key)
+            self._prune(merchant_id)
+        return report
+
+    def _prune(self, merchant_id: str):
+        """Forget evicted and expired keys, so the index stays as small as the cache."""
+        keys = self._keys[merchant_id]
+        keys.difference_update([key for key in keys if key not in self.cache])
+        if len(self._keys) > 2 * self.cache.maxsize:
+            self._keys = {
+                merchant: keys for merchant, keys in self._keys.items() if any(key in self.cache for key in keys)
+            }
+
+    def invalidate(self, merchant_id: str):
+        for key in self._keys.pop(merchant_id, ()):
+            self.cache.pop(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.cache.stats(), "computed": self.computed}
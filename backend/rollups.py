@@ -0,0 +1,219 @@
+"""Pre-aggregated merchant revenue rollups.
+
+Every transaction adds its amount to one hourly and one daily bucket per
+(merchant, token_type, status), so the dashboard reads O(buckets) documents
+instead of scanning the merchant's whole transaction history.
+
+Status changes move the amount from the old status bucket to the new one;
+``min``/``max`` cannot be decremented, so after a status change they are
+bounds rather than exact values until the next rebuild.
+
+    python rollups.py rebuild [merchant_id]
+"""
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "analytics_rollups"
+STORED_GRANULARITIES = ("hour", "day")
+GRANULARITIES = ("hour", "day", "month")
+
+
+def truncate(moment: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "month":
+        return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def _bucket_updates(
+    merchant_id: str, moment: datetime, token_type: str, status: str, amount: float, count: int
+) -> List[UpdateOne]:
+    updates = []
+    for granularity in STORED_GRANULARITIES:
+        key = {
+            "merchant_id": merchant_id,
+            "granularity": granularity,
+            "bucket": truncate(moment, granularity),
+            "token_type": token_type,
+            "status": status,
+        }
+        update: Dict[str, Any] = {"$inc": {"sum": amount * count, "count": count}}
+        if count > 0:
+            update["$min"] = {"min": amount}
+            update["$max"] = {"max": amount}
+        updates.append(UpdateOne(key, update, upsert=True))
+    return updates
+
+
+async def record_transaction(db, transaction: Dict[str, Any]):
+    """Add a newly inserted transaction to its merchant's rollups."""
+    await record_transactions(db, [transaction])
+
+
+async def record_transactions(db, transactions: List[Dict[str, Any]]):
+    updates = []
+    for tx in transactions:
+        updates.extend(_bucket_updates(
+            tx["to_user_id"], tx["created_at"], tx["token_type"], tx["status"], tx["amount"], 1
+        ))
+    if updates:
+        await db[COLLECTION].bulk_write(updates, ordered=False)
+
+
+async def record_status_change(db, transaction: Dict[str, Any], old_status: str, new_status: str):
+    """Move a transaction from its old status bucket to the new one."""
+    if old_status == new_status:
+        return
+    args = (transaction["to_user_id"], transaction["created_at"], transaction["token_type"])
+    updates = _bucket_updates(*args, old_status, transaction["amount"], -1)
+    updates += _bucket_updates(*args, new_status, transaction["amount"], 1)
+    await db[COLLECTION].bulk_write(updates, ordered=False)
+
+
+async def merchant_summary(
+    db,
+    merchant_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    granularity: str = "day",
+) -> Dict[str, Any]:
+    """Totals and a time series for one merchant, read from the rollup collection.
+
+    ``start`` is inclusive and ``end`` exclusive; both are aligned down to the
+    stored bucket size.
+    """
+    stored = "hour" if granularity == "hour" else "day"
+    query: Dict[str, Any] = {"merchant_id": merchant_id, "granularity": stored}
+    bucket_range = {}
+    if start:
+        bucket_range["$gte"] = truncate(start, stored)
+    if end:
+        bucket_range["$lt"] = end
+    if bucket_range:
+        query["bucket"] = bucket_range
+
+    totals = {"total_revenue": 0.0, "transaction_count": 0}
+    by_token: Dict[str, Dict[str, float]] = {}
+    by_status: Dict[str, Dict[str, float]] = {}
+    series: Dict[datetime, Dict[str, Any]] = {}
+
+    async for doc in db[COLLECTION].find(query, {"_id": 0}):
+        if doc["count"] <= 0:
+            continue
+        totals["total_revenue"] += doc["sum"]
+        totals["transaction_count"] += doc["count"]
+        for group, key in ((by_token, doc["token_type"]), (by_status, doc["status"])):
+            entry = group.setdefault(key, {"revenue": 0.0, "count": 0})
+            entry["revenue"] += doc["sum"]
+            entry["count"] += doc["count"]
+
+        bucket = truncate(doc["bucket"], granularity)
+        point = series.setdefault(bucket, {
+            "bucket": bucket, "revenue": 0.0, "count": 0, "min": doc["min"], "max": doc["max"],
+        })
+        point["revenue"] += doc["sum"]
+        point["count"] += doc["count"]
+        point["min"] = min(point["min"], doc["min"])
+        point["max"] = max(point["max"], doc["max"])
+
+    count = totals["transaction_count"]
+    return {
+        **totals,
+        "avg_transaction": totals["total_revenue"] / count if count else 0,
+        "granularity": granularity,
+        "by_token": by_token,
+        "by_status": by_status,
+        "series": [series[bucket] for bucket in sorted(series)],
+    }
+
+
+async def rebuild(db, merchant_id: Optional[str] = None) -> int:
+    """Recompute rollups from the transactions collection; returns the number of buckets written.
+
+    Transactions inserted while a rebuild runs may be counted twice or not at
+    all, so run it when writes for the affected merchants are quiet.
+    """
+    match = {"to_user_id": merchant_id} if merchant_id else {}
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {
+                "merchant_id": "$to_user_id",
+                "token_type": "$token_type",
+                "status": "$status",
+                "year": {"$year": "$created_at"},
+                "month": {"$month": "$created_at"},
+                "day": {"$dayOfMonth": "$created_at"},
+                "hour": {"$hour": "$created_at"},
+            },
+            "sum": {"$sum": "$amount"},
+            "count": {"$sum": 1},
+            "min": {"$min": "$amount"},
+            "max": {"$max": "$amount"},
+        }},
+    ]
+
+    buckets: Dict[tuple, Dict[str, Any]] = {}
+    async for row in db.transactions.aggregate(pipeline, allowDiskUse=True):
+        key = row["_id"]
+        hour = datetime(key["year"], key["month"], key["day"], key["hour"])
+        for granularity in STORED_GRANULARITIES:
+            bucket = truncate(hour, granularity)
+            ident = (key["merchant_id"], granularity, bucket, key["token_type"], key["status"])
+            doc = buckets.get(ident)
+            if doc is None:
+                buckets[ident] = {
+                    "merchant_id": key["merchant_id"],
+                    "granularity": granularity,
+                    "bucket": bucket,
+                    "token_type": key["token_type"],
+                    "status": key["status"],
+                    "sum": row["sum"],
+                    "count": row["count"],
+                    "min": row["min"],
+                    "max": row["max"],
+                }
+            else:
+                doc["sum"] += row["sum"]
+                doc["count"] += row["count"]
+                doc["min"] = min(doc["min"], row["min"])
+                doc["max"] = max(doc["max"], row["max"])
+
+    await db[COLLECTION].delete_many({"merchant_id": merchant_id} if merchant_id else {})
+    if buckets:
+        await db[COLLECTION].insert_many(list(buckets.values()), ordered=False)
+    return len(buckets)
+
+
+async def _main(merchant_id: Optional[str]) -> int:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ.get('DB_NAME', 'paycoin_db')]
+    try:
+        written = await rebuild(db, merchant_id)
+        print(f"Rebuilt {written} rollup buckets")
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3) or sys.argv[1] != "rebuild":
+        print("usage: python rollups.py rebuild [merchant_id]")
+        sys.exit(2)
+    sys.exit(asyncio.run(_main(sys.argv[2] if len(sys.argv) == 3 else None)))
@@ -0,0 +1,47 @@
+"""Production entry point: several uvicorn worker processes behind one socket.
+
+    python run.py                      # WEB_CONCURRENCY workers on HOST:PORT
+
+Each worker builds its own app (server.create_app), so caches, upload slots
+and the local event broker are per worker. Shared state lives in MongoDB:
+idempotency keys, search terms, rollups, the settlement lease and (with
+EVENT_BROKER=mongo) merchant events. Uploads need a directory shared by the
+workers (UPLOAD_DIR on one host) or BLOB_STORE=s3 across hosts.
+
+On SIGTERM the workers stop accepting connections, fail readiness, close
+event streams, finish open requests for up to GRACEFUL_TIMEOUT seconds and
+then run the lifespan shutdown. gunicorn works the same way:
+
+    gunicorn server:app -k uvicorn.workers.UvicornWorker -w 4 --graceful-timeout 30
+"""
+import os
+from pathlib import Path
+
+import uvicorn
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+HOST = os.environ.get('HOST', '0.0.0.0')
+PORT = int(os.environ.get('PORT', '8001'))
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', str(min(os.cpu_count() or 1, 4))))
+GRACEFUL_TIMEOUT = int(os.environ.get('GRACEFUL_TIMEOUT', '30'))
+# Behind a reverse proxy; trust its X-Forwarded-* headers
+FORWARDED_ALLOW_IPS = os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1')
+
+if __name__ == "__main__":
+    # Workers read WEB_CONCURRENCY too (e.g. to warn about a per-process event broker)
+    os.environ['WEB_CONCURRENCY'] = str(WEB_CONCURRENCY)
+    uvicorn.run(
+        "server:create_app",
+        factory=True,
+        app_dir=str(ROOT_DIR),
+        host=HOST,
+        port=PORT,
+        workers=WEB_CONCURRENCY,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        proxy_headers=True,
+        forwarded_allow_ips=FORWARDED_ALLOW_IPS,
+        log_level=os.environ.get('LOG_LEVEL', 'info'),
+    )
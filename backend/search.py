@@ -0,0 +1,236 @@
+"""Prefix search with facets over products and stores.
+
+MongoDB's $text index cannot match prefixes ("cam" -> "camiseta"), so each
+searchable document carries precomputed terms, written with the document:
+
+- ``search_terms``: every prefix (edge n-gram) of every word of the
+  searchable text. It has a multikey index and is used for matching.
+- ``search_name_terms``: the same for the name only. It is used for
+  ranking.
+
+Text is lowercased and stripped of accents, so "Café" matches "cafe". A
+query matches when every query word is a prefix of some document word. Hits
+are ranked by how many query words hit the name, then by newest first.
+
+Results and facet counts (category, currency, price range) come from one
+$facet aggregation over the matches of the query and the selected filters.
+At most SEARCH_SCAN_LIMIT matches are ranked and counted, which bounds the
+cost of very broad queries; ``total_is_estimate`` flags when it was hit.
+
+    python search.py backfill
+"""
+import asyncio
+import os
+import re
+import sys
+import unicodedata
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 15
+MAX_QUERY_WORDS = 8
+SEARCH_SCAN_LIMIT = int(os.environ.get('SEARCH_SCAN_LIMIT', '20000'))
+MAX_SEARCH_OFFSET = 10000
+
+PRICE_BOUNDARIES = [0, 10, 50, 100, 500, 1000]
+
+SEARCH_FIELDS = ("search_terms", "search_name_terms")
+
+# Searchable text per collection: (name field, other text fields)
+SEARCHABLE = {
+    "products": ("name", ("description", "category")),
+    "stores": ("name", ("description", "category")),
+}
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def normalize_words(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    folded = unicodedata.normalize("NFKD", text.lower())
+    ascii_text = "".join(c for c in folded if not unicodedata.combining(c))
+    return [w for w in _WORD.findall(ascii_text) if len(w) >= MIN_TERM_LENGTH]
+
+
+def prefixes(words: Iterable[str]) -> List[str]:
+    terms: Set[str] = set()
+    for word in words:
+        for end in range(MIN_TERM_LENGTH, min(len(word), MAX_TERM_LENGTH) + 1):
+            terms.add(word[:end])
+    return sorted(terms)
+
+
+def search_fields(collection: str, doc: Dict[str, Any]) -> Dict[str, List[str]]:
+    """The search_* fields to store on ``doc``."""
+    name_field, text_fields = SEARCHABLE[collection]
+    name_words = normalize_words(doc.get(name_field))
+    words = list(name_words)
+    for field in text_fields:
+        words += normalize_words(doc.get(field))
+    return {"search_terms": prefixes(words), "search_name_terms": prefixes(name_words)}
+
+
+def query_terms(q: Optional[str]) -> List[str]:
+    """Query words, each cut to the longest indexed prefix."""
+    seen: List[str] = []
+    for word in normalize_words(q):
+        term = word[:MAX_TERM_LENGTH]
+        if term not in seen:
+            seen.append(term)
+    return seen[:MAX_QUERY_WORDS]
+
+
+def _price_filter(min_price: Optional[float], max_price: Optional[float]) -> Dict[str, Any]:
+    price: Dict[str, Any] = {}
+    if min_price is not None:
+        price["$gte"] = min_price
+    if max_price is not None:
+        price["$lte"] = max_price
+    return {"price": price} if price else {}
+
+
+def _count_by(field: str) -> List[Dict[str, Any]]:
+    return [{"$group": {"_id": field, "count": {"$sum": 1}}}, {"$sort": {"count": -1, "_id": 1}}, {"$limit": 50}]
+
+
+def build_pipeline(
+    collection: str,
+    terms: List[str],
+    filters: Dict[str, Any],
+    offset: int,
+    limit: int,
+    scan_limit: int = SEARCH_SCAN_LIMIT,
+) -> List[Dict[str, Any]]:
+    match: Dict[str, Any] = {"is_active": True, **filters}
+    if terms:
+        match["search_terms"] = {"$all": terms}
+        # Rank the first scan_limit matches (index order)
+        head = [{"$match": match}, {"$limit": scan_limit}]
+        ordered = [
+            # Number of query words that are a prefix of a word of the name
+            {"$addFields": {"score": {"$size": {"$filter": {
+                "input": terms,
+                "cond": {"$in": ["$$this", "$search_name_terms"]},
+            }}}}},
+            {"$sort": {"score": -1, "created_at": -1, "id": -1}},
+        ]
+    else:
+        # Browsing: newest first, served by the is_active/created_at index
+        head = [{"$match": match}, {"$sort": {"created_at": -1, "id": -1}}, {"$limit": scan_limit}]
+        ordered = []
+
+    facets: Dict[str, List[Dict[str, Any]]] = {
+        "results": ordered + [
+            {"$skip": offset},
+            {"$limit": limit + 1},
+            {"$project": {"_id": 0, **{field: 0 for field in SEARCH_FIELDS}}},
+        ],
+        "total": [{"$count": "count"}],
+        "category": _count_by("$category"),
+    }
+    if collection == "products":
+        facets["currency"] = _count_by("$currency")
+        facets["price"] = [{"$bucket": {
+            "groupBy": "$price",
+            "boundaries": PRICE_BOUNDARIES,
+            "default": "other",
+            "output": {"count": {"$sum": 1}},
+        }}]
+    return head + [{"$facet": facets}]
+
+
+def _counts(buckets: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [{"value": b["_id"], "count": b["count"]} for b in buckets if b["_id"] is not None]
+
+
+def _price_counts(buckets: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    ranges = []
+    for bucket in buckets:
+        if bucket["_id"] == "other":
+            ranges.append({"min": PRICE_BOUNDARIES[-1], "max": None, "count": bucket["count"]})
+        else:
+            upper = PRICE_BOUNDARIES[PRICE_BOUNDARIES.index(bucket["_id"]) + 1]
+            ranges.append({"min": bucket["_id"], "max": upper, "count": bucket["count"]})
+    return ranges
+
+
+async def search_collection(
+    db,
+    collection: str,
+    q: Optional[str] = None,
+    category: Optional[str] = None,
+    currency: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    offset: int = 0,
+    limit: int = 20,
+    scan_limit: int = SEARCH_SCAN_LIMIT,
+) -> Dict[str, Any]:
+    """One page of ranked hits plus facet counts for ``products`` or ``stores``."""
+    filters: Dict[str, Any] = {}
+    if category:
+        filters["category"] = category
+    if collection == "products":
+        if currency:
+            filters["currency"] = currency
+        filters.update(_price_filter(min_price, max_price))
+
+    terms = query_terms(q)
+    pipeline = build_pipeline(collection, terms, filters, offset, limit, scan_limit)
+    (result,) = await db[collection].aggregate(pipeline).to_list(1)
+
+    items = result["results"]
+    total = result["total"][0]["count"] if result["total"] else 0
+    has_more = len(items) > limit and offset + limit < MAX_SEARCH_OFFSET
+    facets: Dict[str, Any] = {"category": _counts(result["category"])}
+    if collection == "products":
+        facets["currency"] = _counts(result["currency"])
+        facets["price"] = _price_counts(result["price"])
+    return {
+        "results": items[:limit],
+        "total": total,
+        "total_is_estimate": total >= scan_limit,
+        "facets": facets,
+        "next_offset": offset + limit if has_more else None,
+    }
+
+
+async def backfill(db, batch_size: int = 1000) -> int:
+    """Compute the search fields for documents stored before they existed."""
+    updated = 0
+    for collection, (name_field, text_fields) in SEARCHABLE.items():
+        projection = {"_id": 0, "id": 1, name_field: 1, **{f: 1 for f in text_fields}}
+        batch = []
+        async for doc in db[collection].find({"search_terms": {"$exists": False}}, projection):
+            batch.append(UpdateOne({"id": doc["id"]}, {"$set": search_fields(collection, doc)}))
+            if len(batch) >= batch_size:
+                updated += (await db[collection].bulk_write(batch, ordered=False)).modified_count
+                batch = []
+        if batch:
+            updated += (await db[collection].bulk_write(batch, ordered=False)).modified_count
+    return updated
+
+
+async def _main() -> int:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ.get('DB_NAME', 'paycoin_db')]
+    try:
+        print(f"Indexed {await backfill(db)} products and stores for search")
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] != "backfill":
+        print("usage: python search.py backfill")
+        sys.exit(2)
+    sys.exit(asyncio.run(_main()))
@@ -0,0 +1,68 @@
+"""JSON encoding for list responses without per-row pydantic work.
+
+List rows come from MongoDB projected to the response model's fields, and
+were validated by the same model when they were written. Building a model
+per row and having FastAPI validate it again against ``response_model``
+costs far more than the query for large pages, so list handlers return
+``RowEncoder(model).response(docs)`` instead:
+
+- rows missing fields (older documents) get the model's defaults, in field
+  order (what ``model_construct`` does, on plain dicts); complete rows are
+  passed through;
+- the page is encoded once with orjson (datetimes as ISO 8601, as before).
+
+VALIDATE_LIST_RESPONSES=true validates each page with one TypeAdapter call
+instead, for when stored documents cannot be trusted (e.g. after manual
+edits). ``response_model`` stays on the routes for the OpenAPI schema.
+"""
+import os
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Mapping, Optional
+
+import orjson
+from pydantic import TypeAdapter
+from pydantic_core import PydanticUndefined
+from starlette.responses import Response
+
+VALIDATE_LIST_RESPONSES = os.environ.get('VALIDATE_LIST_RESPONSES', 'false').lower() == 'true'
+
+
+def dumps(value: Any) -> bytes:
+    """orjson with str() for types it does not know (Decimal128, ObjectId...)."""
+    return orjson.dumps(value, default=str)
+
+
+class RowEncoder:
+    def __init__(self, model, validate: bool = VALIDATE_LIST_RESPONSES):
+        self.model = model
+        self.validate = validate
+        self.projection = {"_id": 0, **{name: 1 for name in model.model_fields}}
+        self._fields = [
+            (name, None if field.default is PydanticUndefined else field.default)
+            for name, field in model.model_fields.items()
+        ]
+        self._adapter = TypeAdapter(List[model]) if validate else None
+
+    def rows(self, docs: Iterable[Mapping[str, Any]]) -> List[Dict[str, Any]]:
+        if self._adapter is not None:
+            return self._adapter.dump_python(self._adapter.validate_python(list(docs)))
+        fields, count = self._fields, len(self._fields)
+        # Projected documents holding every field (the usual case) are used as they are
+        return [
+            doc if len(doc) == count else {name: doc.get(name, default) for name, default in fields}
+            for doc in docs
+        ]
+
+    def row(self, doc: Mapping[str, Any]) -> Dict[str, Any]:
+        return self.rows((doc,))[0]
+
+    def encode(self, docs: Iterable[Mapping[str, Any]]) -> bytes:
+        return dumps(self.rows(docs))
+
+    def response(self, docs: Iterable[Mapping[str, Any]], headers: Optional[Dict[str, str]] = None) -> Response:
+        return Response(content=self.encode(docs), media_type="application/json", headers=headers)
+
+
+@lru_cache(maxsize=None)
+def row_encoder(model) -> RowEncoder:
+    return RowEncoder(model)
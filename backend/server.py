@@ -1,51 +1,140 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Form
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Form, Query, Request, Response, Header, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from motor.motor_asyncio import AsyncIOMotorClient
-from pydantic import BaseModel, Field, EmailStr
+from starlette.requests import HTTPConnection
+from pydantic import BaseModel, Field, EmailStr, ValidationError
 from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
-from passlib.context import CryptContext
-from jose import JWTError, jwt
+from datetime import datetime
+from contextlib import asynccontextmanager
 import os
 import uuid
 import logging
+import asyncio
 from pathlib import Path
 from dotenv import load_dotenv
-import base64
 import shutil
 import mimetypes
+import math
+import hmac
+from pymongo.errors import DuplicateKeyError
+
+from cache import TTLCache
+from hashing import password_hasher, HashPoolSaturated
+from indexes import ensure_indexes
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, fetch_page, stream_ndjson
+import rollups
+from storage import UPLOAD_DIR, create_blob_store, create_export_store
+from uploads import UploadGuardMiddleware, UploadRejected, stage_upload
+from images import ImageVariantProcessor, select_variant
+from http_cache import ResponseCache
+import geo
+import search
+from quotes import QuoteService, QuoteUnavailable, InvalidQuote
+from settlement import SETTLEMENT_ENABLED, SettlementWatcher
+from ingest import BatchRejected, duplicate_of, insert_batch, read_items
+from idempotency import IdempotencyConflict, IdempotencyStore, fingerprint
+from events import EVENT_BROKER, create_broker, format_sse, merchant_channel
+from database import create_client, ping
+from lifecycle import Lifecycle
+import logs
+from metrics import CONTENT_TYPE, METRICS_ENABLED, REGISTRY, InstrumentationMiddleware
+from serialization import row_encoder
+from auth_tokens import AuthTokens, InvalidToken, signing_keys_from_env
+from exports import FORMATS as EXPORT_FORMATS, ExportJobs, ExportWriter, parquet_available, stream_export
+from reports import InvalidReport, ReportService
+from ratelimit import RateLimited, RateLimiter, create_backend as create_rate_limit_backend
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ.get('DB_NAME', 'paycoin_db')]
+# MongoDB database name (pool settings in database.py; the client connects on first use)
+DB_NAME = os.environ.get('DB_NAME', 'paycoin_db')
 
 # JWT Configuration
 SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-here')
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Authenticated-user cache for tokens without a user_type claim (slim principals only)
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '60'))
+
+EVENTS_HEARTBEAT = float(os.environ.get('EVENTS_HEARTBEAT', '25'))
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', '1'))
+
+# Shared token for /api/internal/stats (X-Internal-Token header); unset disables the endpoint
+INTERNAL_STATS_TOKEN = os.environ.get('INTERNAL_STATS_TOKEN', '')
+
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
-# Create the main app
-app = FastAPI(title="Paycoin API", version="1.0.0")
-api_router = APIRouter(prefix="/api")
+class Services:
+    """The database and the per-process services of one app (see create_app).
+
+    Built from a Motor client so that tests and benchmarks can run an app
+    against their own (e.g. mongomock-motor) client; handlers get it with
+    ``Depends(get_services)``. ``lifespan`` starts and stops it.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.db = client[DB_NAME]
+        # Access tokens carry sub + user_type; refresh tokens rotate (see auth_tokens.py)
+        self.auth_tokens = AuthTokens(self.db, signing_keys_from_env(SECRET_KEY))
+        self.user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+        # Uploaded images (content-addressed, local disk or S3-compatible)
+        self.blob_store = create_blob_store()
+        self.image_processor = ImageVariantProcessor(self.blob_store)
+        # Background transaction exports, in a private store (downloaded through the API)
+        self.export_jobs = ExportJobs(self.db.export_jobs, create_export_store())
+        # Public catalog responses (GET /stores, GET /products)
+        self.catalog_cache = ResponseCache()
+        # Signed PSPAY/USDT -> BRL quotes backed by cached upstream prices
+        self.quote_service = QuoteService(SECRET_KEY)
+        # Responses of POST /transactions by Idempotency-Key
+        self.idempotency_store = IdempotencyStore()
+        # Real-time merchant notifications (WebSocket / SSE)
+        self.event_broker = create_broker(self.db)
+        # Token buckets per client IP or user, by route class (RATE_LIMIT_* in ratelimit.py)
+        self.rate_limiter = RateLimiter(create_rate_limit_backend(self.db))
+        # Percentiles, heatmaps and top customers per merchant, memoized (REPORT_* in reports.py)
+        self.report_service = ReportService(self.db.transactions)
+        # Moves pending transactions to completed/failed from their on-chain receipts
+        self.settlement_watcher = SettlementWatcher(self.db, notify=self.notify_settled)
+        # Readiness and drain state of this worker process
+        self.lifecycle = Lifecycle()
 
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+    async def notify_merchant(self, event_type: str, transaction: Dict[str, Any]):
+        """Push a transaction event to the receiving merchant; never fails the caller."""
+        await self.notify_merchants(event_type, [transaction])
+
+    async def notify_merchants(self, event_type: str, transactions: List[Dict[str, Any]]):
+        """Push one event per transaction to its merchant, published together (batch ingestion)."""
+        # New and settled transactions both pass here: the merchants' cached reports are stale
+        for merchant_id in {transaction["to_user_id"] for transaction in transactions}:
+            self.report_service.invalidate(merchant_id)
+        try:
+            await self.event_broker.publish_many([
+                (
+                    merchant_channel(transaction["to_user_id"]),
+                    {"type": event_type, "transaction": jsonable_encoder(transaction)},
+                )
+                for transaction in transactions
+            ])
+        except Exception as e:
+            logger.error(f"Could not publish {event_type} for {len(transactions)} transaction(s): {e}")
+
+    async def notify_settled(self, transaction: Dict[str, Any]):
+        await self.notify_merchant("payment_status", transaction)
+
+    def invalidate_user(self, user_id: str):
+        self.user_cache.pop(user_id)
+
+def get_services(connection: HTTPConnection) -> Services:
+    return connection.app.state.services
+
+api_router = APIRouter(prefix="/api")
 
 # Models
 class UserType(str):
@@ -96,12 +185,29 @@ class User(UserBase):
     wallet_address: Optional[str] = None
     profile_image_url: Optional[str] = None
     banner_image_url: Optional[str] = None
+    # Resized copies of the images above, {longest side in px: url}
+    profile_picture_variants: Optional[Dict[str, str]] = None
+    profile_image_variants: Optional[Dict[str, str]] = None
+    banner_image_variants: Optional[Dict[str, str]] = None
+
+class Principal(BaseModel):
+    """What authenticated endpoints need to know about the caller."""
+    id: str
+    user_type: str
+    is_active: bool = True
+
+PRINCIPAL_PROJECTION = {"_id": 0, "id": 1, "user_type": 1, "is_active": 1}
 
 class TokenResponse(BaseModel):
     access_token: str
     token_type: str
     user_type: str
     user_id: str
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None  # seconds the access token is valid
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 class Transaction(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -111,8 +217,13 @@ class Transaction(BaseModel):
     token_type: str  # "PSPAY" or "USDT"
     transaction_hash: Optional[str] = None
     status: str = "pending"  # pending, completed, failed
+    confirmations: Optional[int] = None  # filled in by the settlement watcher
+    block_number: Optional[int] = None
+    settled_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     description: Optional[str] = None
+    quote_id: Optional[str] = None  # set when created from a signed /quotes quote
+    idempotency_key: Optional[str] = None  # client key, unique per from_user_id (batch ingestion)
 
 class Store(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -124,9 +235,16 @@ class Store(BaseModel):
     phone: Optional[str] = None
     business_hours: Optional[Dict[str, str]] = None
     images: Optional[List[str]] = None
+    # Resized copies of each image, in the same order ({longest side in px: url}, None until rendered)
+    image_variants: Optional[List[Optional[Dict[str, str]]]] = None
+    # GeoJSON point derived from address latitude/longitude (2dsphere indexed)
+    location: Optional[Dict[str, Any]] = None
     is_active: bool = True
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class StoreWithDistance(Store):
+    distance: float  # meters from the search point
+
 class Product(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     merchant_id: str
@@ -136,51 +254,234 @@ class Product(BaseModel):
     currency: str = "BRL"
     category: Optional[str] = None
     image: Optional[str] = None
+    image_variants: Optional[Dict[str, str]] = None
     is_active: bool = True
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 # Helper functions
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    """Returns (valid, new_hash); new_hash is set when the bcrypt cost changed."""
+    try:
+        return await password_hasher.verify_and_update(plain_password, hashed_password)
+    except HashPoolSaturated:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Server busy, please retry",
+            headers={"Retry-After": "1"},
+        )
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    try:
+        return await password_hasher.hash(password)
+    except HashPoolSaturated:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Server busy, please retry",
+            headers={"Retry-After": "1"},
+        )
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+async def token_response(
+    services: Services, user_id: str, user_type: str, family: Optional[str] = None
+) -> TokenResponse:
+    tokens = await services.auth_tokens.issue(user_id, user_type, family)
+    return TokenResponse(token_type="bearer", user_type=user_type, user_id=user_id, **tokens)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    services: Services = Depends(get_services),
+):
+    return await principal_from_token(services, credentials.credentials)
+
+async def principal_from_token(services: Services, token: str) -> Principal:
+    claims = await claims_from_token(services, token)
+    return Principal(id=claims["sub"], user_type=claims["user_type"])
+
+async def claims_from_token(services: Services, token: str) -> Dict[str, Any]:
+    """Verified claims of an access token, always with ``user_type``."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-    except JWTError:
+        claims = await services.auth_tokens.verify(token)
+    except InvalidToken:
         raise credentials_exception
-    
-    user = await db.users.find_one({"id": user_id})
-    if user is None:
+    user_id = claims["sub"]
+    if "user_type" in claims:
+        # No database read: deactivation revokes the user's tokens
+        return claims
+
+    # Tokens issued before user_type was a claim
+    principal = services.user_cache.get(user_id)
+    if principal is None:
+        user = await services.db.users.find_one({"id": user_id}, PRINCIPAL_PROJECTION)
+        if user is None:
+            raise credentials_exception
+        principal = Principal(**user)
+        services.user_cache.set(user_id, principal)
+    if not principal.is_active:
         raise credentials_exception
-    return User(**user)
+    return {**claims, "user_type": principal.user_type}
+
+def client_ip(request: Request) -> str:
+    # Behind a proxy, uvicorn's --proxy-headers (FORWARDED_ALLOW_IPS) has already applied X-Forwarded-For
+    return request.client.host if request.client else "unknown"
+
+async def enforce_rate_limit(services: Services, route_class: str, scope: str, identity: str):
+    try:
+        await services.rate_limiter.check(route_class, scope, identity)
+    except RateLimited as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+def limit_by_ip(route_class: str):
+    async def dependency(request: Request, services: Services = Depends(get_services)):
+        await enforce_rate_limit(services, route_class, "ip", client_ip(request))
+    return dependency
+
+def limit_by_user(route_class: str):
+    # Shares the request's get_current_user result with the handler
+    async def dependency(
+        current_user: Principal = Depends(get_current_user),
+        services: Services = Depends(get_services),
+    ):
+        await enforce_rate_limit(services, route_class, "user", current_user.id)
+    return dependency
+
+AUTH_RATE_LIMIT = [Depends(limit_by_ip("auth"))]
+CATALOG_RATE_LIMIT = [Depends(limit_by_ip("catalog"))]
+WRITE_RATE_LIMIT = [Depends(limit_by_user("write"))]
+USER_RATE_LIMIT = [Depends(limit_by_user("user"))]
+
+async def store_uploaded_image(services: Services, file: UploadFile) -> str:
+    """Stream an uploaded image into the blob store and return its URL."""
+    try:
+        staged = await stage_upload(file, services.blob_store.staging_dir)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return await services.blob_store.put_file(staged.path, staged.sha256, staged.content_type)
+
+def generate_image_variants(
+    services: Services,
+    collection,
+    doc_id: str,
+    field: str,
+    image_url: str,
+    variants_field: str,
+    cache_namespace: Optional[str] = None,
+):
+    """Render resized copies in the background and record them on the document.
+
+    The update is guarded on the image URL so a newer upload is never
+    given the variants of the one it replaced.
+    """
+    async def record(variants: Dict[str, str]):
+        await collection.update_one(
+            {"id": doc_id, field: image_url},
+            {"$set": {variants_field: variants}}
+        )
+        if cache_namespace:
+            services.catalog_cache.invalidate(cache_namespace)
+    services.image_processor.submit(image_url, record)
+
+async def paginated_list(
+    collection,
+    query: Dict[str, Any],
+    model,
+    limit: Optional[int],
+    cursor: Optional[str],
+    stream: bool,
+    transform=None,
+) -> Response:
+    """Serve a list endpoint as one keyset page, or as NDJSON when stream=true.
+
+    Pages are newest first; the cursor for the next page is returned in the
+    X-Next-Cursor header. Streaming returns every remaining row unless a
+    limit is given. Rows are encoded without building ``model`` instances
+    (see serialization.py).
+    """
+    # Only read the model's fields (not search terms or settlement bookkeeping)
+    encoder = row_encoder(model)
+    try:
+        if stream:
+            return StreamingResponse(
+                stream_ndjson(collection, query, cursor, limit, encoder, transform),
+                media_type="application/x-ndjson",
+            )
+        docs, next_cursor = await fetch_page(
+            collection, query, limit or DEFAULT_PAGE_SIZE, cursor, encoder.projection
+        )
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    if transform:
+        docs = [transform(doc) for doc in docs]
+    return encoder.response(docs, {"X-Next-Cursor": next_cursor} if next_cursor else None)
+
+async def cached_list(
+    services: Services,
+    request: Request,
+    namespace: str,
+    collection,
+    query: Dict[str, Any],
+    model,
+    limit: Optional[int],
+    cursor: Optional[str],
+    transform=None,
+):
+    """Serve a public list page from the catalog cache, with ETag/304 support."""
+    async def produce():
+        page = await paginated_list(collection, query, model, limit, cursor, False, transform)
+        headers = {"X-Next-Cursor": page.headers["x-next-cursor"]} if "x-next-cursor" in page.headers else {}
+        return page.body, headers
+    return await services.catalog_cache.respond(request, namespace, produce)
+
+def product_image_for(image_size: Optional[int]):
+    """Row transform that swaps Product.image for its smallest adequate variant."""
+    if not image_size:
+        return None
+    def transform(doc):
+        doc["image"] = select_variant(doc.get("image"), doc.get("image_variants"), image_size)
+        return doc
+    return transform
+
+def store_images_for(image_size: Optional[int]):
+    """Row transform that swaps each of Store.images for its smallest adequate variant."""
+    if not image_size:
+        return None
+    def transform(doc):
+        if doc.get("images"):
+            variants = doc.get("image_variants") or []
+            doc["images"] = [
+                select_variant(image, variants[i] if i < len(variants) else None, image_size)
+                for i, image in enumerate(doc["images"])
+            ]
+        return doc
+    return transform
+
+def user_images_for(doc: Dict[str, Any], image_size: Optional[int]) -> Dict[str, Any]:
+    """Swap the profile picture, profile image and banner of a user for their smallest adequate variants."""
+    if not image_size:
+        return doc
+    for field, variants_field in (
+        ("profile_image_url", "profile_image_variants"),
+        ("banner_image_url", "banner_image_variants"),
+    ):
+        doc[field] = select_variant(doc.get(field), doc.get(variants_field), image_size)
+    if doc.get("profile"):
+        doc["profile"]["profile_picture"] = select_variant(
+            doc["profile"].get("profile_picture"), doc.get("profile_picture_variants"), image_size
+        )
+    return doc
 
 # Authentication routes
-@api_router.post("/auth/register", response_model=TokenResponse)
-async def register(user: UserCreate):
+@api_router.post("/auth/register", response_model=TokenResponse, dependencies=AUTH_RATE_LIMIT)
+async def register(user: UserCreate, services: Services = Depends(get_services)):
     # Check if user already exists
-    existing_user = await db.users.find_one({"email": user.email})
+    existing_user = await services.db.users.find_one({"email": user.email})
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -188,87 +489,125 @@ async def register(user: UserCreate):
         )
     
     # Create new user
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     user_dict = user.dict()
     del user_dict["password"]
     user_dict["hashed_password"] = hashed_password
     user_obj = User(**user_dict)
     
-    await db.users.insert_one(user_obj.dict())
+    await services.db.users.insert_one(user_obj.dict())
     
-    # Create access token
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user_obj.id}, expires_delta=access_token_expires
-    )
-    
-    return TokenResponse(
-        access_token=access_token,
-        token_type="bearer",
-        user_type=user_obj.user_type,
-        user_id=user_obj.id
-    )
+    return await token_response(services, user_obj.id, user_obj.user_type)
 
-@api_router.post("/auth/login", response_model=TokenResponse)
-async def login(user_credentials: UserLogin):
-    user = await db.users.find_one({"email": user_credentials.email})
-    if not user or not verify_password(user_credentials.password, user["hashed_password"]):
+@api_router.post("/auth/login", response_model=TokenResponse, dependencies=AUTH_RATE_LIMIT)
+async def login(user_credentials: UserLogin, services: Services = Depends(get_services)):
+    user = await services.db.users.find_one({"email": user_credentials.email})
+    valid, new_hash = (False, None)
+    if user:
+        valid, new_hash = await verify_password(user_credentials.password, user["hashed_password"])
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user["id"]}, expires_delta=access_token_expires
-    )
+    if not user.get("is_active", True):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Account is deactivated")
+    
+    # Transparently upgrade hashes created with a different cost factor
+    if new_hash:
+        await services.db.users.update_one({"id": user["id"]}, {"$set": {"hashed_password": new_hash}})
     
-    return TokenResponse(
-        access_token=access_token,
-        token_type="bearer",
-        user_type=user["user_type"],
-        user_id=user["id"]
+    return await token_response(services, user["id"], user["user_type"])
+
+@api_router.post("/auth/refresh", response_model=TokenResponse, dependencies=AUTH_RATE_LIMIT)
+async def refresh_session(body: RefreshRequest, services: Services = Depends(get_services)):
+    """New access and refresh tokens for a refresh token, which stops working."""
+    invalid = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
     )
+    try:
+        session = await services.auth_tokens.rotate(body.refresh_token)
+    except InvalidToken:
+        raise invalid
+    user = await services.db.users.find_one({"id": session["user_id"]}, PRINCIPAL_PROJECTION)
+    if user is None or not user.get("is_active", True):
+        raise invalid
+    return await token_response(services, user["id"], user["user_type"], family=session["family"])
+
+@api_router.post("/auth/logout", dependencies=AUTH_RATE_LIMIT)
+async def logout(body: RefreshRequest, services: Services = Depends(get_services)):
+    """End the session of a refresh token (its access token runs until it expires)."""
+    await services.auth_tokens.revoke_family(body.refresh_token)
+    return {"message": "Logged out"}
 
 # User profile routes
-@api_router.get("/user/profile")
-async def get_profile(current_user: User = Depends(get_current_user)):
-    return current_user
+@api_router.get("/user/profile", dependencies=USER_RATE_LIMIT)
+async def get_profile(
+    image_size: Optional[int] = Query(None, ge=1),
+    current_user: Principal = Depends(get_current_user),
+    services: Services = Depends(get_services)
+):
+    """The caller's user; with image_size, image URLs point at the smallest variant at least that large."""
+    user = await services.db.users.find_one({"id": current_user.id})
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    return User(**user_images_for(user, image_size))
 
-@api_router.put("/user/profile")
+@api_router.put("/user/profile", dependencies=WRITE_RATE_LIMIT)
 async def update_profile(
     profile: UserProfile,
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user),
+    services: Services = Depends(get_services)
 ):
-    await db.users.update_one(
+    await services.db.users.update_one(
         {"id": current_user.id},
         {"$set": {"profile": profile.dict()}}
     )
+    services.invalidate_user(current_user.id)
     return {"message": "Profile updated successfully"}
 
-@api_router.post("/user/upload-image")
+@api_router.post("/user/deactivate", dependencies=WRITE_RATE_LIMIT)
+async def deactivate_account(
+    current_user: Principal = Depends(get_current_user),
+    services: Services = Depends(get_services)
+):
+    await services.db.users.update_one(
+        {"id": current_user.id},
+        {"$set": {"is_active": False, "updated_at": datetime.utcnow()}}
+    )
+    services.invalidate_user(current_user.id)
+    await services.auth_tokens.revoke_user(current_user.id)
+    return {"message": "Account deactivated"}
+
+@api_router.post("/user/upload-image", dependencies=WRITE_RATE_LIMIT)
 async def upload_profile_image(
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user),
+    services: Services = Depends(get_services)
 ):
-    # Simple base64 encoding for image storage (in production, use cloud storage)
-    content = await file.read()
-    encoded_image = base64.b64encode(content).decode('utf-8')
-    image_data = f"data:{file.content_type};base64,{encoded_image}"
+    image_url = await store_uploaded_image(services, file)
     
-    await db.users.update_one(
+    await services.db.users.update_one(
         {"id": current_user.id},
-        {"$set": {"profile.profile_picture": image_data}}
+        {"$set": {"profile.profile_picture": image_url}, "$unset": {"profile_picture_variants": ""}}
+    )
+    services.invalidate_user(current_user.id)
+    generate_image_variants(
+        services, services.db.users, current_user.id, "profile.profile_picture", image_url, "profile_picture_variants"
     )
     
-    return {"message": "Image uploaded successfully", "image_url": image_data}
+    return {"message": "Image uploaded successfully", "image_url": image_url}
 
 # Store management routes
-@api_router.post("/stores")
+@api_router.post("/stores", dependencies=WRITE_RATE_LIMIT)
 async def create_store(
     store_data: Dict[str, Any],
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user),
+    services: Services = Depends(get_services)
 ):
     if current_user.user_type != UserType.MERCHANT:
         raise HTTPException(
@@ -277,30 +616,105 @@ async def create_store(
         )
     
     store = Store(merchant_id=current_user.id, **store_data)
-    await db.stores.insert_one(store.dict())
+    store.location = geo.location_for_address(store.address.dict())
+    # One slot per image, so each variant set is written at its image's index
+    store.image_variants = [None] * len(store.images) if store.images else None
+    doc = store.dict()
+    await services.db.stores.insert_one({**doc, **search.search_fields("stores", doc)})
+    services.catalog_cache.invalidate("stores")
+    for index, image_url in enumerate(store.images or []):
+        generate_image_variants(
+            services, services.db.stores, store.id, f"images.{index}", image_url, f"image_variants.{index}",
+            cache_namespace="stores",
+        )
     return store
 
-@api_router.get("/stores", response_model=List[Store])
-async def get_stores():
-    stores = await db.stores.find({"is_active": True}).to_list(1000)
-    return [Store(**store) for store in stores]
+@api_router.get("/stores", response_model=List[Store], dependencies=CATALOG_RATE_LIMIT)
+async def get_stores(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    image_size: Optional[int] = Query(None, ge=1),
+    services: Services = Depends(get_services),
+):
+    query = {"is_active": True}
+    transform = store_images_for(image_size)
+    if stream:
+        return await paginated_list(services.db.stores, query, Store, limit, cursor, stream, transform)
+    return await cached_list(
+        services, request, "stores", services.db.stores, query, Store, limit, cursor, transform
+    )
+
+@api_router.get("/stores/nearby", response_model=List[StoreWithDistance], dependencies=CATALOG_RATE_LIMIT)
+async def get_nearby_stores(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius: float = Query(geo.DEFAULT_RADIUS_METERS, gt=0, le=geo.MAX_RADIUS_METERS),
+    category: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    image_size: Optional[int] = Query(None, ge=1),
+    services: Services = Depends(get_services),
+):
+    """Active stores within `radius` meters of (lat, lng), nearest first."""
+    try:
+        stores, next_cursor = await geo.nearby_stores(
+            services.db, lat, lng, radius, limit, category, cursor, row_encoder(StoreWithDistance).projection
+        )
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    transform = store_images_for(image_size)
+    if transform:
+        stores = [transform(store) for store in stores]
+    return row_encoder(StoreWithDistance).response(stores, {"X-Next-Cursor": next_cursor} if next_cursor else None)
 
-@api_router.get("/my-stores", response_model=List[Store])
-async def get_my_stores(current_user: User = Depends(get_current_user)):
+@api_router.get("/stores/within", response_model=List[Store], dependencies=CATALOG_RATE_LIMIT)
+async def get_stores_within(
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lng: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lng: float = Query(..., ge=-180, le=180),
+    category: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    image_size: Optional[int] = Query(None, ge=1),
+    services: Services = Depends(get_services),
+):
+    """Active stores inside a map viewport."""
+    try:
+        box = geo.box_polygon(min_lat, min_lng, max_lat, max_lng)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    query = {"is_active": True, "location": {"$geoWithin": {"$geometry": box}}}
+    if category:
+        query["category"] = category
+    return await paginated_list(services.db.stores, query, Store, limit, cursor, False, store_images_for(image_size))
+
+@api_router.get("/my-stores", response_model=List[Store], dependencies=USER_RATE_LIMIT)
+async def get_my_stores(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    current_user: Principal = Depends(get_current_user),
+    services: Services = Depends(get_services)
+):
     if current_user.user_type != UserType.MERCHANT:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Only merchants can access this endpoint"
         )
     
-    stores = await db.stores.find({"merchant_id": current_user.id}).to_list(1000)
-    return [Store(**store) for store in stores]
+    return await paginated_list(
+        services.db.stores, {"merchant_id": current_user.id}, Store, limit, cursor, stream
+    )
 
 # Product management routes
-@api_router.post("/products")
+@api_router.post("/products", dependencies=WRITE_RATE_LIMIT)
 async def create_product(
     product_data: Dict[str, Any],
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user),
+    services: Services = Depends(get_services)
 ):
     if current_user.user_type != UserType.MERCHANT:
         raise HTTPException(
@@ -309,153 +723,609 @@ async def create_product(
         )
     
     product = Product(merchant_id=current_user.id, **product_data)
-    await db.products.insert_one(product.dict())
+    doc = product.dict()
+    await services.db.products.insert_one({**doc, **search.search_fields("products", doc)})
+    services.catalog_cache.invalidate("products")
+    if product.image:
+        generate_image_variants(
+            services, services.db.products, product.id, "image", product.image, "image_variants", cache_namespace="products"
+        )
     return product
 
-@api_router.get("/products", response_model=List[Product])
-async def get_products(merchant_id: Optional[str] = None):
+@api_router.get("/products", response_model=List[Product], dependencies=CATALOG_RATE_LIMIT)
+async def get_products(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    merchant_id: Optional[str] = None,
+    image_size: Optional[int] = Query(None, ge=1),
+    services: Services = Depends(get_services),
+):
     query = {"is_active": True}
     if merchant_id:
         query["merchant_id"] = merchant_id
     
-    products = await db.products.find(query).to_list(1000)
-    return [Product(**product) for product in products]
+    transform = product_image_for(image_size)
+    if stream:
+        return await paginated_list(services.db.products, query, Product, limit, cursor, stream, transform)
+    return await cached_list(services, request, "products", services.db.products, query, Product, limit, cursor, transform)
 
-@api_router.get("/my-products", response_model=List[Product])
-async def get_my_products(current_user: User = Depends(get_current_user)):
+@api_router.get("/my-products", response_model=List[Product], dependencies=USER_RATE_LIMIT)
+async def get_my_products(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    image_size: Optional[int] = Query(None, ge=1),
+    current_user: Principal = Depends(get_current_user),
+    services: Services = Depends(get_services)
+):
     if current_user.user_type != UserType.MERCHANT:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Only merchants can access this endpoint"
         )
     
-    products = await db.products.find({"merchant_id": current_user.id}).to_list(1000)
-    return [Product(**product) for product in products]
+    return await paginated_list(
+        services.db.products, {"merchant_id": current_user.id}, Product, limit, cursor, stream,
+        product_image_for(image_size)
+    )
+
+# Quotes
+@api_router.get("/quotes", dependencies=CATALOG_RATE_LIMIT)
+async def get_quote(
+    token: str = Query("PSPAY", pattern="^(PSPAY|USDT)$"),
+    amount_brl: Optional[float] = Query(None, gt=0),
+    services: Services = Depends(get_services),
+):
+    """Signed BRL quote for a token, optionally converting amount_brl."""
+    try:
+        return await services.quote_service.quote(token, amount_brl)
+    except QuoteUnavailable as e:
+        logger.error(f"Quote unavailable: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Price sources unavailable",
+            headers={"Retry-After": "5"},
+        )
+
+def check_quote(services: Services, quote: Dict[str, Any], transaction_data: Dict[str, Any]) -> str:
+    """Validate a signed quote against the transaction; returns its quote_id."""
+    try:
+        payload = services.quote_service.verify(quote)
+    except (InvalidQuote, KeyError, ValueError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid quote: {e}")
+    amount = transaction_data.get("amount")
+    if payload["token"] != transaction_data.get("token_type") or (
+        "amount_token" in payload
+        and not (isinstance(amount, (int, float)) and math.isclose(amount, payload["amount_token"], rel_tol=1e-6))
+    ):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Transaction does not match quote")
+    return payload["quote_id"]
+
+# Set by the server (quote check, settlement watcher), never taken from the request body
+SERVER_TRANSACTION_FIELDS = ("quote_id", "status", "confirmations", "block_number", "settled_at")
+
+def build_transaction(services: Services, transaction_data: Dict[str, Any], from_user_id: str) -> Transaction:
+    transaction_data = {
+        field: value for field, value in transaction_data.items() if field not in SERVER_TRANSACTION_FIELDS
+    }
+    quote = transaction_data.pop("quote", None)
+    if quote is not None:
+        transaction_data["quote_id"] = check_quote(services, quote, transaction_data)
+    transaction_data["from_user_id"] = from_user_id
+    return Transaction(**transaction_data)
+
+async def existing_transaction(services: Services, transaction: Transaction) -> Transaction:
+    """The transaction stored earlier under the same idempotency_key (a retried request)."""
+    doc = await services.db.transactions.find_one(
+        {"from_user_id": transaction.from_user_id, "idempotency_key": transaction.idempotency_key},
+        {"_id": 0},
+    )
+    if doc is None or any(
+        doc.get(field) != getattr(transaction, field) for field in ("to_user_id", "amount", "token_type")
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Duplicate idempotency key: it was used for a different transaction",
+        )
+    return Transaction(**doc)
+
+async def insert_transaction(services: Services, transaction_data: Dict[str, Any], from_user_id: str) -> Transaction:
+    transaction = build_transaction(services, transaction_data, from_user_id)
+    try:
+        await services.db.transactions.insert_one(transaction.dict())
+    except DuplicateKeyError as e:
+        error = e.details or {"code": e.code, "errmsg": str(e)}
+        if duplicate_of(error, "idempotency_key"):
+            return await existing_transaction(services, transaction)
+        if duplicate_of(error, "quote_id"):
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Quote already used")
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Transaction already exists")
+    try:
+        await rollups.record_transaction(services.db, transaction.dict())
+    except Exception as e:
+        # The transaction is stored; `python rollups.py rebuild` repairs the rollups
+        logger.error(f"Rollup update failed for transaction {transaction.id}: {e}")
+    await services.notify_merchant("payment_received", transaction.dict())
+    return transaction
+
+# Search
+@api_router.get("/search", dependencies=CATALOG_RATE_LIMIT)
+async def search_catalog(
+    q: Optional[str] = Query(None, max_length=200),
+    type: str = Query("all", pattern="^(all|products|stores)$"),
+    category: Optional[str] = None,
+    currency: Optional[str] = None,
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    offset: int = Query(0, ge=0, le=search.MAX_SEARCH_OFFSET),
+    limit: int = Query(20, ge=1, le=100),
+    services: Services = Depends(get_services),
+):
+    """Prefix search over active products and stores, with facet counts."""
+    collections = ["products", "stores"] if type == "all" else [type]
+    results = await asyncio.gather(*(
+        search.search_collection(
+            services.db, collection, q, category, currency, min_price, max_price, offset, limit
+        )
+        for collection in collections
+    ))
+    return dict(zip(collections, results))
 
 # Transaction routes
-@api_router.post("/transactions")
+@api_router.post("/transactions", dependencies=WRITE_RATE_LIMIT)
 async def create_transaction(
     transaction_data: Dict[str, Any],
-    current_user: User = Depends(get_current_user)
+    response: Response,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: Principal = Depends(get_current_user),
+    services: Services = Depends(get_services)
 ):
-    transaction = Transaction(from_user_id=current_user.id, **transaction_data)
-    await db.transactions.insert_one(transaction.dict())
-    return transaction
+    """Record a transaction. Retries that repeat the Idempotency-Key header get
+    the original response back (with Idempotent-Replayed: true)."""
+    if idempotency_key is None:
+        return await insert_transaction(services, transaction_data, current_user.id)
+
+    async def produce():
+        return jsonable_encoder(await insert_transaction(services, transaction_data, current_user.id))
+
+    try:
+        body, replayed = await services.idempotency_store.run(
+            services.db.idempotency_keys,
+            f"transactions:{current_user.id}",
+            idempotency_key,
+            fingerprint(transaction_data),
+            produce,
+        )
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return body
+
+@api_router.post("/transactions/batch", dependencies=WRITE_RATE_LIMIT)
+async def create_transactions_batch(
+    request: Request,
+    ordered: bool = False,
+    current_user: Principal = Depends(get_current_user),
+    services: Services = Depends(get_services)
+):
+    """Create many transactions from a JSON array or an NDJSON body.
+
+    Every item gets a result: "created", "duplicate" (its idempotency_key was
+    already used; the original id is returned), "error" or, with
+    ``ordered=true``, "skipped" for the items after the first failure.
+    """
+    try:
+        items = await read_items(request)
+    except BatchRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("Item must be a JSON object")
+            valid.append((index, build_transaction(services, item, current_user.id)))
+        except HTTPException as e:
+            results[index] = {"index": index, "status": "error", "error": e.detail}
+        except ValidationError as e:
+            detail = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            results[index] = {"index": index, "status": "error", "error": detail}
+        except (ValueError, TypeError) as e:
+            results[index] = {"index": index, "status": "error", "error": str(e)}
+        if ordered and results[index] is not None:
+            break
+
+    docs = [transaction.dict() for _, transaction in valid]
+    errors = await insert_batch(services.db.transactions, docs, ordered=ordered)
+    inserted, duplicates = [], {}
+    for position, (index, transaction) in enumerate(valid):
+        error = errors.get(position)
+        if error is None:
+            inserted.append(docs[position])
+            results[index] = {"index": index, "status": "created", "id": transaction.id}
+        elif error["code"] is None:
+            results[index] = {"index": index, "status": "skipped"}
+        elif duplicate_of(error, "idempotency_key"):
+            duplicates[index] = transaction.idempotency_key
+        elif duplicate_of(error, "quote_id"):
+            results[index] = {"index": index, "status": "error", "error": "Quote already used"}
+        else:
+            results[index] = {"index": index, "status": "error", "error": "Could not store transaction"}
+
+    if duplicates:
+        originals = {
+            doc["idempotency_key"]: doc["id"]
+            async for doc in services.db.transactions.find(
+                {"from_user_id": current_user.id, "idempotency_key": {"$in": list(set(duplicates.values()))}},
+                {"_id": 0, "id": 1, "idempotency_key": 1},
+            )
+        }
+        for index, key in duplicates.items():
+            results[index] = {"index": index, "status": "duplicate", "id": originals.get(key)}
+    for index in range(len(results)):
+        if results[index] is None:
+            results[index] = {"index": index, "status": "skipped"}
+
+    if inserted:
+        try:
+            await rollups.record_transactions(services.db, inserted)
+        except Exception as e:
+            logger.error(f"Rollup update failed for a batch of {len(inserted)} transactions: {e}")
+        await services.notify_merchants(
+            "payment_received", [{k: v for k, v in doc.items() if k != "_id"} for doc in inserted]
+        )
+    counts = {"created": 0, "duplicate": 0, "error": 0, "skipped": 0}
+    for result in results:
+        counts[result["status"]] += 1
+    return {**counts, "results": results}
 
-@api_router.get("/transactions", response_model=List[Transaction])
-async def get_user_transactions(current_user: User = Depends(get_current_user)):
-    transactions = await db.transactions.find({
+@api_router.get("/transactions", response_model=List[Transaction], dependencies=USER_RATE_LIMIT)
+async def get_user_transactions(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    current_user: Principal = Depends(get_current_user),
+    services: Services = Depends(get_services)
+):
+    query = {
         "$or": [
             {"from_user_id": current_user.id},
             {"to_user_id": current_user.id}
         ]
-    }).to_list(1000)
-    return [Transaction(**transaction) for transaction in transactions]
+    }
+    return await paginated_list(services.db.transactions, query, Transaction, limit, cursor, stream)
+
+@api_router.get("/transactions/export", dependencies=WRITE_RATE_LIMIT)
+async def export_transactions(
+    format: str = Query("csv", pattern="^(csv|parquet)$"),
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+    background: bool = False,
+    current_user: Principal = Depends(get_current_user),
+    services: Services = Depends(get_services)
+):
+    """Full transaction history (sent and received, oldest first) as CSV or Parquet,
+    created_at in [from, to). Streams by default; with background=true the file is
+    written to the export store and a job is returned (poll /transactions/export/{id})."""
+    if format == "parquet" and not parquet_available():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Parquet export is not available")
+    query: Dict[str, Any] = {
+        "$or": [
+            {"from_user_id": current_user.id},
+            {"to_user_id": current_user.id}
+        ]
+    }
+    created_at = {key: value for key, value in (("$gte", from_), ("$lt", to)) if value is not None}
+    if created_at:
+        query["created_at"] = created_at
+    writer = ExportWriter(Transaction, format)
+
+    if background:
+        job = await services.export_jobs.start(current_user.id, services.db.transactions, query, writer)
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=jsonable_encoder(job))
+    filename = f"transactions-{datetime.utcnow():%Y%m%d}{writer.extension}"
+    return StreamingResponse(
+        stream_export(services.db.transactions, query, writer),
+        media_type=writer.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@api_router.get("/transactions/export/{job_id}", dependencies=USER_RATE_LIMIT)
+async def get_export_job(
+    job_id: str,
+    current_user: Principal = Depends(get_current_user),
+    services: Services = Depends(get_services)
+):
+    job = await services.export_jobs.get(job_id, current_user.id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Export not found")
+    if job["status"] == "completed":
+        job["download_url"] = f"/api/transactions/export/{job_id}/download"
+    return job
+
+@api_router.get("/transactions/export/{job_id}/download", dependencies=USER_RATE_LIMIT)
+async def download_export(
+    job_id: str,
+    current_user: Principal = Depends(get_current_user),
+    services: Services = Depends(get_services)
+):
+    """The file of a completed background export; only its owner can download it."""
+    found = await services.export_jobs.download(job_id, current_user.id)
+    if found is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Export not found")
+    job, chunks = found
+    media_type, extension = EXPORT_FORMATS[job["format"]]
+    filename = f"transactions-{job['created_at']:%Y%m%d}{extension}"
+    return StreamingResponse(chunks, media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Cache-Control": "private, no-store",
+    })
+
+# Real-time payment notifications for merchants
+def require_merchant(claims: Dict[str, Any]):
+    if claims["user_type"] != UserType.MERCHANT:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only merchants can subscribe to payment events"
+        )
+
+async def merchant_from_ticket(services: Services, ticket: Optional[str]) -> Dict[str, Any]:
+    if not ticket:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    try:
+        claims = await services.auth_tokens.redeem_ticket(ticket)
+    except InvalidToken:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired ticket")
+    require_merchant(claims)
+    return claims
+
+async def next_event(services: Services, subscription, claims: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The next event, or None after EVENTS_HEARTBEAT seconds (or when the session expires)."""
+    timeout = EVENTS_HEARTBEAT
+    expires_in = services.auth_tokens.expires_in(claims)
+    if expires_in is not None:
+        timeout = max(min(timeout, expires_in), 0)
+    return await subscription.get(timeout)
+
+@api_router.post("/events/ticket", dependencies=USER_RATE_LIMIT)
+async def create_events_ticket(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    services: Services = Depends(get_services)
+):
+    """Single-use ticket for /ws/merchant and /events/merchant (?ticket=), valid for EVENT_TICKET_TTL seconds.
+
+    Browsers cannot send the Authorization header on those connections and an
+    access token in the URL would end up in access logs.
+    """
+    claims = await claims_from_token(services, credentials.credentials)
+    require_merchant(claims)
+    return await services.auth_tokens.issue_ticket(claims)
+
+async def wait_disconnect(websocket: WebSocket):
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
+
+@api_router.websocket("/ws/merchant")
+async def merchant_websocket(
+    websocket: WebSocket, ticket: Optional[str] = None, services: Services = Depends(get_services)
+):
+    """Push payment events as JSON messages; {"type": "ping"} every EVENTS_HEARTBEAT seconds.
+
+    Closes with 1008 once the access token behind the ticket expires or is
+    revoked: the client reconnects with a new ticket.
+    """
+    try:
+        claims = await merchant_from_ticket(services, ticket)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    closed = asyncio.create_task(wait_disconnect(websocket))
+    draining = asyncio.create_task(services.lifecycle.wait_draining())
+    try:
+        with services.event_broker.subscribe(merchant_channel(claims["sub"])) as subscription:
+            while True:
+                event = asyncio.create_task(next_event(services, subscription, claims))
+                await asyncio.wait({event, closed, draining}, return_when=asyncio.FIRST_COMPLETED)
+                if closed.done():
+                    event.cancel()
+                    break
+                if draining.done():
+                    # Worker shutting down: the client reconnects to another one
+                    event.cancel()
+                    await websocket.close(code=status.WS_1012_SERVICE_RESTART)
+                    break
+                try:
+                    await services.auth_tokens.check(claims)
+                except InvalidToken:
+                    await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Session expired")
+                    break
+                await websocket.send_json(event.result() or {"type": "ping"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        closed.cancel()
+        draining.cancel()
+
+@api_router.get("/events/merchant")
+async def merchant_events(
+    request: Request,
+    ticket: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+    services: Services = Depends(get_services),
+):
+    """Server-Sent Events fallback for /ws/merchant.
+
+    EventSource cannot send headers, so browsers use ?ticket=; other clients
+    may send the access token as a Bearer header. The stream ends when that
+    token expires or is revoked (the client reconnects with a new ticket).
+    """
+    if credentials:
+        claims = await claims_from_token(services, credentials.credentials)
+        require_merchant(claims)
+    else:
+        claims = await merchant_from_ticket(services, ticket)
+
+    async def stream():
+        draining = asyncio.create_task(services.lifecycle.wait_draining())
+        try:
+            with services.event_broker.subscribe(merchant_channel(claims["sub"])) as subscription:
+                yield b"retry: 3000\n\n"
+                while not await request.is_disconnected():
+                    event = asyncio.create_task(next_event(services, subscription, claims))
+                    await asyncio.wait({event, draining}, return_when=asyncio.FIRST_COMPLETED)
+                    if draining.done():
+                        # Ending the stream makes the client reconnect (to another worker)
+                        event.cancel()
+                        break
+                    try:
+                        await services.auth_tokens.check(claims)
+                    except InvalidToken:
+                        break
+                    yield format_sse(event.result()) if event.result() else b": ping\n\n"
+        finally:
+            draining.cancel()
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # Dashboard analytics for merchants
-@api_router.get("/analytics/dashboard")
-async def get_dashboard_analytics(current_user: User = Depends(get_current_user)):
+@api_router.get("/analytics/dashboard", dependencies=USER_RATE_LIMIT)
+async def get_dashboard_analytics(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    granularity: str = Query("day", pattern="^(hour|day|month)$"),
+    current_user: Principal = Depends(get_current_user),
+    services: Services = Depends(get_services)
+):
     if current_user.user_type != UserType.MERCHANT:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Only merchants can access analytics"
         )
     
-    # Get transaction analytics
-    pipeline = [
-        {"$match": {"to_user_id": current_user.id}},
-        {"$group": {
-            "_id": None,
-            "total_revenue": {"$sum": "$amount"},
-            "transaction_count": {"$sum": 1},
-            "avg_transaction": {"$avg": "$amount"}
-        }}
-    ]
-    
-    result = await db.transactions.aggregate(pipeline).to_list(1)
-    analytics = result[0] if result else {
-        "total_revenue": 0,
-        "transaction_count": 0,
-        "avg_transaction": 0
-    }
-    
-    return analytics
+    # Read the pre-aggregated rollups instead of scanning every transaction
+    return await rollups.merchant_summary(services.db, current_user.id, start, end, granularity)
+
+@api_router.get("/analytics/report", dependencies=USER_RATE_LIMIT)
+async def get_merchant_report(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    granularity: str = Query("day", pattern="^(hour|day|month)$"),
+    timezone: str = "UTC",
+    statuses: Optional[str] = Query(None, description="Comma-separated, default pending,completed"),
+    top: int = Query(10, ge=1, le=100),
+    current_user: Principal = Depends(get_current_user),
+    services: Services = Depends(get_services)
+):
+    if current_user.user_type != UserType.MERCHANT:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only merchants can access analytics"
+        )
+
+    selected = [part.strip() for part in statuses.split(",") if part.strip()] if statuses else None
+    try:
+        return await services.report_service.report(
+            current_user.id, start, end, granularity, timezone, selected, top
+        )
+    except InvalidReport as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-# Health check
+# Health checks: liveness never touches dependencies, readiness pings Mongo
+@api_router.get("/health/live")
+async def liveness():
+    return {"status": "alive", "timestamp": datetime.utcnow()}
+
+@api_router.get("/health/ready")
 @api_router.get("/health")
-async def health_check():
-    return {"status": "healthy", "timestamp": datetime.utcnow()}
+async def readiness(services: Services = Depends(get_services)):
+    """200 when this worker should receive traffic; 503 while starting, draining or without Mongo."""
+    if not services.lifecycle.ready:
+        state = "draining" if services.lifecycle.draining else "starting"
+        return JSONResponse(status_code=503, content={"status": state, "timestamp": datetime.utcnow().isoformat()})
+    try:
+        latency = await ping(services.db)
+    except Exception as e:
+        logger.warning(f"Readiness ping failed: {e!r}")
+        return JSONResponse(
+            status_code=503,
+            content={"status": "unhealthy", "mongo": "unreachable", "timestamp": datetime.utcnow().isoformat()},
+        )
+    return {"status": "healthy", "mongo": {"latency_ms": latency}, "timestamp": datetime.utcnow()}
 
-# Include the router in the main app
-app.include_router(api_router)
+def require_internal_token(x_internal_token: Optional[str] = Header(None)):
+    if not INTERNAL_STATS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if x_internal_token is None or not hmac.compare_digest(x_internal_token, INTERNAL_STATS_TOKEN):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid internal token")
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+@api_router.get("/internal/stats", dependencies=[Depends(require_internal_token)])
+async def internal_stats(services: Services = Depends(get_services)):
+    return {
+        "password_hashing": password_hasher.stats(),
+        "user_cache": services.user_cache.stats(),
+        "auth_tokens": services.auth_tokens.stats(),
+        "catalog_cache": services.catalog_cache.stats(),
+        "quotes": services.quote_service.stats(),
+        "settlement": services.settlement_watcher.stats(),
+        "idempotency": services.idempotency_store.stats(),
+        "events": services.event_broker.stats(),
+        "exports": services.export_jobs.stats(),
+        "reports": services.report_service.stats(),
+        "rate_limits": services.rate_limiter.stats(),
+        "process": {"pid": os.getpid(), "ready": services.lifecycle.ready, "draining": services.lifecycle.draining},
+    }
+
+# Configure logging (LOG_FORMAT=text|json, see logs.py)
+logs.configure()
 logger = logging.getLogger(__name__)
 
 # Upload endpoints
-@app.post("/api/upload/image")
+@api_router.post("/upload/image", dependencies=WRITE_RATE_LIMIT)
 async def upload_image(
     file: UploadFile = File(...),
     image_type: str = Form(...),
-    current_user: dict = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user),
+    services: Services = Depends(get_services)
 ):
     """Upload profile image or banner for user"""
     try:
-        # Validate file type
-        allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/webp"]
-        if file.content_type not in allowed_types:
-            raise HTTPException(
-                status_code=400,
-                detail="Formato de arquivo não suportado. Use JPEG, PNG ou WebP."
-            )
-        
-        # Validate file size (5MB max)
-        file_size = 0
-        content = await file.read()
-        file_size = len(content)
-        
-        if file_size > 5 * 1024 * 1024:  # 5MB
-            raise HTTPException(
-                status_code=400,
-                detail="Arquivo muito grande. Tamanho máximo: 5MB."
-            )
-        
-        # Create uploads directory if it doesn't exist
-        upload_dir = Path("uploads")
-        upload_dir.mkdir(exist_ok=True)
-        
-        # Generate unique filename
-        file_extension = Path(file.filename).suffix
-        unique_filename = f"{current_user['id']}_{image_type}_{uuid.uuid4()}{file_extension}"
-        file_path = upload_dir / unique_filename
-        
-        # Save file
-        with open(file_path, "wb") as buffer:
-            buffer.write(content)
+        # Type is sniffed from the file's magic bytes and size is checked
+        # while streaming; identical files are stored once
+        image_url = await store_uploaded_image(services, file)
         
         # Update user record with image URL
-        image_url = f"/uploads/{unique_filename}"
         field_name = "profile_image_url" if image_type == "profile" else "banner_image_url"
+        variants_field = "profile_image_variants" if image_type == "profile" else "banner_image_variants"
         
-        await db.users.update_one(
-            {"id": current_user['id']},
-            {"$set": {field_name: image_url, "updated_at": datetime.utcnow()}}
+        await services.db.users.update_one(
+            {"id": current_user.id},
+            {"$set": {field_name: image_url, "updated_at": datetime.utcnow()}, "$unset": {variants_field: ""}}
         )
+        services.invalidate_user(current_user.id)
+        generate_image_variants(services, services.db.users, current_user.id, field_name, image_url, variants_field)
         
         return {"image_url": image_url, "message": "Upload realizado com sucesso"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Upload error: {str(e)}")
         raise HTTPException(status_code=500, detail="Erro interno do servidor")
 
-@app.delete("/api/upload/image/{image_type}")
+@api_router.delete("/upload/image/{image_type}", dependencies=WRITE_RATE_LIMIT)
 async def remove_image(
     image_type: str,
-    current_user: dict = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user),
+    services: Services = Depends(get_services)
 ):
     """Remove profile image or banner for user"""
     try:
@@ -463,33 +1333,92 @@ async def remove_image(
             raise HTTPException(status_code=400, detail="Tipo de imagem inválido")
         
         field_name = "profile_image_url" if image_type == "profile" else "banner_image_url"
+        variants_field = "profile_image_variants" if image_type == "profile" else "banner_image_variants"
         
-        # Get current image URL to delete file
-        user = await db.users.find_one({"id": current_user['id']})
-        if user and user.get(field_name):
-            # Remove file from filesystem
-            try:
-                file_path = Path(".") / user[field_name].lstrip("/")
-                if file_path.exists():
-                    file_path.unlink()
-            except Exception as e:
-                logger.warning(f"Could not delete file: {e}")
-        
-        # Update user record
-        await db.users.update_one(
-            {"id": current_user['id']},
-            {"$unset": {field_name: ""}, "$set": {"updated_at": datetime.utcnow()}}
+        # Only the reference is removed: blobs are content-addressed and may
+        # be shared with other users who uploaded the same file
+        await services.db.users.update_one(
+            {"id": current_user.id},
+            {"$unset": {field_name: "", variants_field: ""}, "$set": {"updated_at": datetime.utcnow()}}
         )
+        services.invalidate_user(current_user.id)
         
         return {"message": "Imagem removida com sucesso"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Remove image error: {str(e)}")
         raise HTTPException(status_code=500, detail="Erro interno do servidor")
 
-# Serve uploaded files
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    services: Services = app.state.services
+    services.lifecycle.install_signal_handlers()
+    await ensure_indexes(services.db)
+    await services.event_broker.start()
+    services.export_jobs.start_sweeper()
+    if SETTLEMENT_ENABLED:
+        services.settlement_watcher.start()
+    if WEB_CONCURRENCY > 1 and EVENT_BROKER == "local":
+        logger.warning("EVENT_BROKER=local with several workers: merchants only get events from their own worker")
+    services.lifecycle.started = True
+    try:
+        yield
+    finally:
+        # Event streams have already ended; stop background work, then release resources
+        services.lifecycle.begin_drain()
+        await services.settlement_watcher.stop()
+        await services.event_broker.stop()
+        await services.image_processor.drain()
+        await services.export_jobs.drain()
+        services.client.close()
+        password_hasher.shutdown()
+        services.lifecycle.restore_signal_handlers()
+
+async def metrics_endpoint():
+    """Prometheus scrape target (values of this worker process)."""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+def create_app(client=None) -> FastAPI:
+    """Build the ASGI app and its services; ``lifespan`` starts and closes them.
+
+    ``client`` defaults to a Motor client for MONGO_URL; tests pass their own.
+    """
+    application = FastAPI(
+        title="Paycoin API", version="1.0.0", lifespan=lifespan, default_response_class=ORJSONResponse
+    )
+    application.state.services = Services(client if client is not None else create_client(os.environ['MONGO_URL']))
+
+    # Upload concurrency and body-size limits (added first so CORS wraps its errors)
+    application.add_middleware(UploadGuardMiddleware, paths=["/api/user/upload-image", "/api/upload/image"])
+
+    # CORS middleware
+    application.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "ETag", "Idempotent-Replayed", "X-Request-ID"],
+    )
+
+    # Outermost: request id, access log and per-route metrics
+    application.add_middleware(InstrumentationMiddleware)
+
+    application.include_router(api_router)
+    if METRICS_ENABLED:
+        application.add_api_route("/metrics", metrics_endpoint, include_in_schema=False)
+
+    # Serve uploaded files
+    application.mount("/uploads", StaticFiles(directory=UPLOAD_DIR, check_dir=False), name="uploads")
+    return application
+
+def __getattr__(name: str):
+    # ``server:app`` for uvicorn/gunicorn: built on first access, not at import
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
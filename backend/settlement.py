@@ -0,0 +1,303 @@
+"""Resolve pending transactions against the chain.
+
+SettlementWatcher periodically picks pending transactions that carry a
+``transaction_hash``, looks their receipts up in batched JSON-RPC requests
+(a few batches in flight at once) and writes the outcome back in bulk:
+
+- receipt with enough confirmations -> "completed" (status 0x1) or "failed"
+- receipt still shallow             -> confirmations/block_number updated
+- no receipt yet                    -> checked again after an exponential backoff
+- no receipt after SETTLEMENT_TIMEOUT hours -> "failed" (dropped)
+
+Run it inside the API process (SETTLEMENT_ENABLED=true) or as a separate
+process. Every pass, ``once`` included, takes a lease in the ``leases``
+collection and renews it before each batch, so with several API workers only
+one of them runs passes at a time; a watcher that loses the lease mid-pass
+stops. Final statuses are written with a ``status: "pending"`` guard and
+rollups/notifications only follow the writes that matched.
+
+    python settlement.py run|once
+"""
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import requests
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+import rollups
+from leases import Lease
+
+logger = logging.getLogger(__name__)
+
+BSC_RPC_URL = os.environ.get('BSC_RPC_URL', 'https://bsc-dataseed.binance.org/')
+SETTLEMENT_ENABLED = os.environ.get('SETTLEMENT_ENABLED', 'false').lower() == 'true'
+SETTLEMENT_INTERVAL = float(os.environ.get('SETTLEMENT_INTERVAL', '15'))
+SETTLEMENT_BATCH_SIZE = int(os.environ.get('SETTLEMENT_BATCH_SIZE', '50'))
+SETTLEMENT_CONCURRENCY = int(os.environ.get('SETTLEMENT_CONCURRENCY', '4'))
+SETTLEMENT_CONFIRMATIONS = int(os.environ.get('SETTLEMENT_CONFIRMATIONS', '12'))
+SETTLEMENT_MAX_BACKOFF = float(os.environ.get('SETTLEMENT_MAX_BACKOFF', '600'))
+SETTLEMENT_TIMEOUT = float(os.environ.get('SETTLEMENT_TIMEOUT', '24'))  # hours
+RPC_TIMEOUT = float(os.environ.get('RPC_TIMEOUT', '10'))
+
+MAX_PER_PASS = 5000
+
+PENDING_PROJECTION = {"_id": 0, "id": 1, "transaction_hash": 1, "created_at": 1, "settlement_attempts": 1,
+                      "to_user_id": 1, "amount": 1, "token_type": 1, "status": 1}
+
+
+class RpcError(Exception):
+    pass
+
+
+class JsonRpcClient:
+    """Minimal JSON-RPC client that sends batched requests.
+
+    web3 6.x has no batch support, so the batch is posted directly; requests
+    that fail as a whole (network errors, 429, 5xx) are retried with
+    exponential backoff.
+    """
+
+    def __init__(self, url: str = BSC_RPC_URL, timeout: float = RPC_TIMEOUT, retries: int = 4, backoff: float = 0.5):
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._session = requests.Session()
+
+    def _post(self, payload: Any) -> Any:
+        response = self._session.post(self.url, json=payload, timeout=self.timeout)
+        if response.status_code == 429 or response.status_code >= 500:
+            raise RpcError(f"RPC returned HTTP {response.status_code}")
+        response.raise_for_status()
+        return response.json()
+
+    async def batch(self, calls: Sequence[Tuple[str, list]]) -> List[Any]:
+        """Run ``calls`` in one request; each result is the value or an RpcError."""
+        payload = [{"jsonrpc": "2.0", "id": i, "method": method, "params": params}
+                   for i, (method, params) in enumerate(calls)]
+        for attempt in range(self.retries + 1):
+            try:
+                replies = await asyncio.to_thread(self._post, payload)
+                break
+            except (requests.RequestException, RpcError) as e:
+                if attempt == self.retries:
+                    raise RpcError(str(e)) from e
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+        if isinstance(replies, dict):
+            # Some nodes answer a rejected batch with a single error object
+            raise RpcError(str(replies.get("error", replies)))
+        results: List[Any] = [RpcError("missing reply")] * len(calls)
+        for reply in replies:
+            error = reply.get("error")
+            results[reply["id"]] = RpcError(str(error)) if error else reply.get("result")
+        return results
+
+    async def block_number(self) -> int:
+        (result,) = await self.batch([("eth_blockNumber", [])])
+        if isinstance(result, Exception):
+            raise result
+        return int(result, 16)
+
+    def close(self):
+        self._session.close()
+
+
+def next_check_delay(attempts: int, base: float = SETTLEMENT_INTERVAL, cap: float = SETTLEMENT_MAX_BACKOFF) -> float:
+    return min(base * 2 ** attempts, cap)
+
+
+class SettlementWatcher:
+    def __init__(
+        self,
+        db,
+        rpc=None,
+        confirmations: int = SETTLEMENT_CONFIRMATIONS,
+        batch_size: int = SETTLEMENT_BATCH_SIZE,
+        concurrency: int = SETTLEMENT_CONCURRENCY,
+        interval: float = SETTLEMENT_INTERVAL,
+        timeout: timedelta = timedelta(hours=SETTLEMENT_TIMEOUT),
+        notify: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+        lease: Optional[Lease] = None,
+    ):
+        self.db = db
+        self.lease = lease or Lease(db.leases, "settlement", timedelta(seconds=max(interval * 4, 60)))
+        self.notify = notify
+        self.rpc = rpc or JsonRpcClient()
+        self.confirmations = confirmations
+        self.batch_size = batch_size
+        self.interval = interval
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._task: Optional[asyncio.Task] = None
+        self.leader = False
+        self.counters = {"passes": 0, "checked": 0, "completed": 0, "failed": 0, "rpc_errors": 0, "lease_lost": 0}
+
+    async def _pending(self, now: datetime) -> List[Dict[str, Any]]:
+        query = {
+            "status": "pending",
+            "transaction_hash": {"$type": "string"},
+            "settlement_next_check_at": {"$not": {"$gt": now}},
+        }
+        return await (
+            self.db.transactions.find(query, PENDING_PROJECTION)
+            .sort("created_at", 1)
+            .limit(MAX_PER_PASS)
+            .to_list(MAX_PER_PASS)
+        )
+
+    def _resolve(self, tx: Dict[str, Any], receipt: Any, head: int, now: datetime) -> Tuple[Dict[str, Any], Optional[str]]:
+        """Return the $set for one transaction and its final status, if any."""
+        if receipt:
+            block = int(receipt["blockNumber"], 16)
+            confirmations = max(head - block + 1, 0)
+            update = {"block_number": block, "confirmations": confirmations,
+                      "settlement_next_check_at": now + timedelta(seconds=self.interval)}
+            if confirmations >= self.confirmations:
+                final = "completed" if int(receipt.get("status", "0x0"), 16) == 1 else "failed"
+                return {**update, "status": final, "settled_at": now}, final
+            return update, None
+
+        if now - tx["created_at"] > self.timeout:
+            return {"status": "failed", "settled_at": now}, "failed"
+        attempts = tx.get("settlement_attempts", 0) + 1
+        return {
+            "settlement_attempts": attempts,
+            "settlement_next_check_at": now + timedelta(seconds=next_check_delay(attempts, self.interval)),
+        }, None
+
+    async def _check_batch(self, batch: List[Dict[str, Any]], head: int, now: datetime):
+        async with self._semaphore:
+            # A pass can outlast the lease TTL: renew it before each batch and stop once it is lost
+            if not self.leader:
+                return
+            if not await self.lease.acquire():
+                self.leader = False
+                self.counters["lease_lost"] += 1
+                logger.warning("Settlement lease taken over by another watcher; stopping this pass")
+                return
+            try:
+                receipts = await self.rpc.batch(
+                    [("eth_getTransactionReceipt", [tx["transaction_hash"]]) for tx in batch]
+                )
+            except RpcError as e:
+                self.counters["rpc_errors"] += 1
+                logger.warning(f"Receipt lookup failed for {len(batch)} transactions: {e}")
+                return
+
+        updates, settled = [], []
+        for tx, receipt in zip(batch, receipts):
+            if isinstance(receipt, Exception):
+                self.counters["rpc_errors"] += 1
+                continue
+            self.counters["checked"] += 1
+            fields, final = self._resolve(tx, receipt, head, now)
+            if final:
+                settled.append((tx, fields, final))
+            else:
+                updates.append(UpdateOne({"id": tx["id"], "status": "pending"}, {"$set": fields}))
+        if updates:
+            await self.db.transactions.bulk_write(updates, ordered=False)
+        for tx, fields, final in settled:
+            # Another writer (an earlier watcher, a manual fix) may have settled it already:
+            # only the write that moves it out of pending records and announces it
+            previous = await self.db.transactions.find_one_and_update(
+                {"id": tx["id"], "status": "pending"}, {"$set": fields}, projection={"_id": 1}
+            )
+            if previous is None:
+                continue
+            self.counters[final] += 1
+            try:
+                await rollups.record_status_change(self.db, tx, "pending", final)
+            except Exception as e:
+                logger.error(f"Rollup update failed for transaction {tx['id']}: {e}")
+            if self.notify is not None:
+                await self.notify({**tx, "status": final})
+
+    async def run_once(self, now: Optional[datetime] = None) -> int:
+        """Check every due pending transaction once; returns how many were looked up.
+
+        Does nothing (returns 0) while another watcher holds the lease.
+        """
+        self.leader = await self.lease.acquire()
+        if not self.leader:
+            return 0
+        now = now or datetime.utcnow()
+        pending = await self._pending(now)
+        if not pending:
+            return 0
+        head = await self.rpc.block_number()
+        batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+        await asyncio.gather(*(self._check_batch(batch, head, now) for batch in batches))
+        self.counters["passes"] += 1
+        return len(pending)
+
+    async def run(self):
+        failures = 0
+        while True:
+            try:
+                await self.run_once()
+                failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                self.counters["rpc_errors"] += 1
+                logger.warning(f"Settlement pass failed: {e}")
+            await asyncio.sleep(next_check_delay(failures, self.interval) if failures else self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.leader:
+            await self.lease.release()
+            self.leader = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"running": self._task is not None, "leader": self.leader, **self.counters}
+
+
+async def _main(command: str) -> int:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ.get('DB_NAME', 'paycoin_db')]
+    watcher = SettlementWatcher(db, JsonRpcClient(os.environ.get('BSC_RPC_URL', BSC_RPC_URL)))
+    try:
+        if command == "once":
+            checked = await watcher.run_once()
+            if not watcher.leader and not watcher.counters["lease_lost"]:
+                print("Another watcher holds the settlement lease; nothing checked")
+                return 1
+            print(f"Checked {checked} pending transactions: {watcher.stats()}")
+        else:
+            await watcher.run()
+        return 0
+    finally:
+        if watcher.leader:
+            await watcher.lease.release()
+        watcher.rpc.close()
+        client.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in ("run", "once"):
+        print("usage: python settlement.py run|once")
+        sys.exit(2)
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_main(sys.argv[1])))
@@ -0,0 +1,347 @@
+"""Content-addressed blob storage for uploaded images and exports.
+
+Blobs are keyed by the SHA-256 of their content, so identical uploads are
+stored once and a key never changes meaning. The backend is chosen with
+BLOB_STORE: "local" (default, served from the /uploads mount) or "s3" for
+any S3-compatible service through boto3.
+
+Transaction exports go to a second, private store (``create_export_store``):
+EXPORT_DIR on disk, which nothing serves, or EXPORT_S3_PREFIX in the bucket,
+which must not be publicly readable. They are keyed by job, not content, and
+only reach users through the authenticated download endpoint.
+
+    python storage.py migrate-profile-pictures
+"""
+import asyncio
+import base64
+import binascii
+import hashlib
+import logging
+import mimetypes
+import os
+import sys
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+from dotenv import load_dotenv
+
+from uploads import ALLOWED_IMAGE_TYPES, sniff_image_type
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+BLOB_STORE = os.environ.get('BLOB_STORE', 'local')
+# Relative paths are resolved against backend/, not the working directory of the process
+UPLOAD_DIR = (ROOT_DIR / os.environ.get('UPLOAD_DIR', 'uploads')).resolve()
+UPLOAD_URL_PREFIX = '/uploads'
+S3_BUCKET = os.environ.get('S3_BUCKET')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')  # e.g. MinIO; unset for AWS
+S3_PUBLIC_URL = os.environ.get('S3_PUBLIC_URL')  # base URL clients download from
+S3_PREFIX = os.environ.get('S3_PREFIX', 'uploads/')
+EXPORT_DIR = (ROOT_DIR / os.environ.get('EXPORT_DIR', 'exports')).resolve()
+EXPORT_S3_PREFIX = os.environ.get('EXPORT_S3_PREFIX', 'exports/')
+BLOB_CHUNK_SIZE = 1024 * 1024
+
+_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+    # Transaction exports (exports.py)
+    "text/csv": ".csv",
+    "application/vnd.apache.parquet": ".parquet",
+}
+
+
+def key_for_digest(digest: str, content_type: str) -> str:
+    extension = _EXTENSIONS.get(content_type) or mimetypes.guess_extension(content_type or "") or ""
+    return f"{digest[:2]}/{digest}{extension}"
+
+
+def blob_key(data: bytes, content_type: str) -> str:
+    return key_for_digest(hashlib.sha256(data).hexdigest(), content_type)
+
+
+class BlobStore:
+    # Where uploads are spooled before being committed with put_file()
+    staging_dir: Path = Path(tempfile.gettempdir())
+
+    async def put(self, data: bytes, content_type: str) -> str:
+        """Store ``data`` (if not already present) and return its public URL."""
+        key = blob_key(data, content_type)
+        if not await self.exists(key):
+            await self.write(key, data, content_type)
+        return self.url_for(key)
+
+    async def put_file(self, path: Path, digest: str, content_type: str) -> str:
+        """Commit a staged file whose SHA-256 is ``digest``; the file is consumed."""
+        key = key_for_digest(digest, content_type)
+        try:
+            if not await self.exists(key):
+                await self.commit(path, key, content_type)
+        finally:
+            await asyncio.to_thread(Path(path).unlink, missing_ok=True)
+        return self.url_for(key)
+
+    def key_for_url(self, url: Optional[str]) -> Optional[str]:
+        """Return the key of a URL produced by this store, or None for any other URL."""
+        prefix = self.url_for("")
+        if url and url.startswith(prefix) and len(url) > len(prefix):
+            return url[len(prefix):]
+        return None
+
+    async def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def read(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    def iter_chunks(self, key: str, chunk_size: int = BLOB_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        raise NotImplementedError
+
+    async def delete_older_than(self, cutoff: datetime) -> int:
+        """Delete the blobs last written before ``cutoff`` (naive UTC); returns how many."""
+        raise NotImplementedError
+
+    async def write(self, key: str, data: bytes, content_type: str):
+        raise NotImplementedError
+
+    async def commit(self, path: Path, key: str, content_type: str):
+        raise NotImplementedError
+
+    def url_for(self, key: str) -> str:
+        raise NotImplementedError
+
+
+class LocalBlobStore(BlobStore):
+    def __init__(self, root: Path = UPLOAD_DIR, url_prefix: str = UPLOAD_URL_PREFIX):
+        self.root = Path(root)
+        self.url_prefix = url_prefix.rstrip("/")
+        # Same filesystem as the root (so commit is an atomic rename) but
+        # outside the served directory
+        self.staging_dir = self.root.with_name(f".{self.root.name}-staging")
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+
+    def path_for(self, key: str) -> Path:
+        return self.root / key
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(self.path_for(key).exists)
+
+    async def read(self, key: str) -> bytes:
+        return await asyncio.to_thread(self.path_for(key).read_bytes)
+
+    async def iter_chunks(self, key: str, chunk_size: int = BLOB_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        f = await asyncio.to_thread(open, self.path_for(key), "rb")
+        try:
+            while chunk := await asyncio.to_thread(f.read, chunk_size):
+                yield chunk
+        finally:
+            await asyncio.to_thread(f.close)
+
+    async def delete_older_than(self, cutoff: datetime) -> int:
+        return await asyncio.to_thread(self._delete_older_than, cutoff.replace(tzinfo=timezone.utc).timestamp())
+
+    def _delete_older_than(self, cutoff: float) -> int:
+        deleted = 0
+        for path in self.root.rglob("*"):
+            if path.is_file() and path.stat().st_mtime < cutoff:
+                path.unlink(missing_ok=True)
+                deleted += 1
+        return deleted
+
+    async def write(self, key: str, data: bytes, content_type: str):
+        await asyncio.to_thread(self._write, key, data)
+
+    def _write(self, key: str, data: bytes):
+        path = self.path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    async def commit(self, path: Path, key: str, content_type: str):
+        await asyncio.to_thread(self._commit, path, key)
+
+    def _commit(self, path: Path, key: str):
+        target = self.path_for(key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, target)
+
+    def url_for(self, key: str) -> str:
+        return f"{self.url_prefix}/{key}"
+
+
+class S3BlobStore(BlobStore):
+    def __init__(
+        self,
+        bucket: str,
+        client=None,
+        public_url: Optional[str] = S3_PUBLIC_URL,
+        prefix: str = S3_PREFIX,
+        endpoint_url: Optional[str] = S3_ENDPOINT_URL,
+        cache_control: str = "public, max-age=31536000, immutable",
+    ):
+        if client is None:
+            import boto3
+
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.cache_control = cache_control
+        self.public_url = (public_url or f"{endpoint_url or 'https://s3.amazonaws.com'}/{bucket}").rstrip("/")
+
+    async def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=self.prefix + key)
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    async def read(self, key: str) -> bytes:
+        def _read():
+            return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)["Body"].read()
+
+        return await asyncio.to_thread(_read)
+
+    async def iter_chunks(self, key: str, chunk_size: int = BLOB_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        response = await asyncio.to_thread(self.client.get_object, Bucket=self.bucket, Key=self.prefix + key)
+        body = response["Body"]
+        try:
+            while chunk := await asyncio.to_thread(body.read, chunk_size):
+                yield chunk
+        finally:
+            await asyncio.to_thread(body.close)
+
+    async def delete_older_than(self, cutoff: datetime) -> int:
+        def _delete():
+            cutoff_utc = cutoff.replace(tzinfo=timezone.utc)
+            deleted = 0
+            pages = self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=self.prefix)
+            for page in pages:
+                # At most 1000 keys per page, the delete_objects limit
+                stale = [{"Key": item["Key"]} for item in page.get("Contents", []) if item["LastModified"] < cutoff_utc]
+                if stale:
+                    self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": stale, "Quiet": True})
+                    deleted += len(stale)
+            return deleted
+
+        return await asyncio.to_thread(_delete)
+
+    async def write(self, key: str, data: bytes, content_type: str):
+        await asyncio.to_thread(
+            self.client.put_object,
+            Bucket=self.bucket,
+            Key=self.prefix + key,
+            Body=data,
+            ContentType=content_type,
+            CacheControl=self.cache_control,
+        )
+
+    async def commit(self, path: Path, key: str, content_type: str):
+        await asyncio.to_thread(
+            self.client.upload_file,
+            str(path),
+            self.bucket,
+            self.prefix + key,
+            ExtraArgs={"ContentType": content_type, "CacheControl": self.cache_control},
+        )
+
+    def url_for(self, key: str) -> str:
+        return f"{self.public_url}/{self.prefix}{key}"
+
+
+def create_blob_store() -> BlobStore:
+    if BLOB_STORE == "s3":
+        if not S3_BUCKET:
+            raise RuntimeError("BLOB_STORE=s3 requires S3_BUCKET")
+        return S3BlobStore(S3_BUCKET)
+    return LocalBlobStore()
+
+
+def create_export_store() -> BlobStore:
+    """The private store of transaction exports (see the module docstring)."""
+    if BLOB_STORE == "s3":
+        if not S3_BUCKET:
+            raise RuntimeError("BLOB_STORE=s3 requires S3_BUCKET")
+        return S3BlobStore(S3_BUCKET, prefix=EXPORT_S3_PREFIX, cache_control="private, no-store")
+    return LocalBlobStore(EXPORT_DIR)
+
+
+def parse_data_uri(value: str) -> bytes:
+    """Decode the payload of a ``data:<type>;base64,<payload>`` URI.
+
+    The declared type is not returned: it is whatever the client sent, so
+    callers sniff the bytes instead.
+    """
+    header, _, payload = value.partition(",")
+    if not header.startswith("data:") or not header.endswith(";base64"):
+        raise ValueError("Not a base64 data URI")
+    try:
+        return base64.b64decode(payload, validate=True)
+    except binascii.Error as e:
+        raise ValueError("Invalid base64 payload") from e
+
+
+async def migrate_profile_pictures(db, store: BlobStore, batch_size: int = 100) -> int:
+    """Move base64 ``profile.profile_picture`` values out of user documents into ``store``.
+
+    Blobs are stored under the type sniffed from their bytes; anything that
+    is not an allowed image (e.g. ``data:text/html`` or SVG, which would be
+    served as a page from /uploads) is left in place and logged. Safe to
+    re-run: only values that are still data URIs are touched.
+    """
+    migrated = 0
+    cursor = db.users.find(
+        {"profile.profile_picture": {"$regex": "^data:"}},
+        {"_id": 0, "id": 1, "profile.profile_picture": 1},
+    ).batch_size(batch_size)
+    async for user in cursor:
+        data_uri = user["profile"]["profile_picture"]
+        try:
+            data = parse_data_uri(data_uri)
+        except ValueError as e:
+            logger.warning(f"Skipping profile picture of user {user['id']}: {e}")
+            continue
+        content_type = sniff_image_type(data)
+        if content_type not in ALLOWED_IMAGE_TYPES:
+            logger.warning(f"Skipping profile picture of user {user['id']}: not a JPEG, PNG or WebP image")
+            continue
+        url = await store.put(data, content_type)
+        # Guard on the old value so a concurrent re-upload is not overwritten
+        result = await db.users.update_one(
+            {"id": user["id"], "profile.profile_picture": data_uri},
+            {"$set": {"profile.profile_picture": url}},
+        )
+        migrated += result.modified_count
+    return migrated
+
+
+async def _main() -> int:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ.get('DB_NAME', 'paycoin_db')]
+    try:
+        migrated = await migrate_profile_pictures(db, create_blob_store())
+        print(f"Migrated {migrated} profile pictures")
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] != "migrate-profile-pictures":
+        print("usage: python storage.py migrate-profile-pictures")
+        sys.exit(2)
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_main()))
@@ -0,0 +1,178 @@
+"""Streaming, size-capped image upload pipeline.
+
+UploadGuardMiddleware bounds how many uploads are processed at once and
+rejects request bodies over the cap while they are still arriving.
+stage_upload() then copies the (already spooled) file in chunks to a staging
+file off the event loop, hashing it and checking its magic bytes on the way,
+so the handler never holds the whole image in memory.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Optional
+
+from fastapi import UploadFile
+
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(5 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MAX_CONCURRENT_UPLOADS = int(os.environ.get('MAX_CONCURRENT_UPLOADS', '4'))
+UPLOAD_SLOT_TIMEOUT = float(os.environ.get('UPLOAD_SLOT_TIMEOUT', '10'))
+# Room for multipart boundaries and the other form fields
+MULTIPART_OVERHEAD = 64 * 1024
+
+ALLOWED_IMAGE_TYPES = ("image/jpeg", "image/png", "image/webp")
+
+TOO_LARGE_DETAIL = f"Arquivo muito grande. Tamanho máximo: {MAX_UPLOAD_BYTES // (1024 * 1024)}MB."
+UNSUPPORTED_DETAIL = "Formato de arquivo não suportado. Use JPEG, PNG ou WebP."
+BUSY_DETAIL = "Muitos uploads simultâneos. Tente novamente em instantes."
+
+
+class UploadRejected(Exception):
+    def __init__(self, detail: str, status_code: int = 400):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Detect the image format from its leading bytes, ignoring what the client claims."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if len(head) >= 12 and head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return None
+
+
+@dataclass
+class StagedUpload:
+    path: Path
+    size: int
+    sha256: str
+    content_type: str
+
+
+async def stage_upload(
+    file: UploadFile,
+    staging_dir: Path,
+    max_bytes: int = MAX_UPLOAD_BYTES,
+    allowed_types: Iterable[str] = ALLOWED_IMAGE_TYPES,
+) -> StagedUpload:
+    """Copy ``file`` to a staging file in chunks; raises UploadRejected on size or type."""
+    staging_dir.mkdir(parents=True, exist_ok=True)
+    path = staging_dir / f"{uuid.uuid4()}.part"
+    digest = hashlib.sha256()
+    size = 0
+    content_type = None
+    out = await asyncio.to_thread(open, path, "wb")
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if content_type is None:
+                content_type = sniff_image_type(chunk)
+                if content_type not in allowed_types:
+                    raise UploadRejected(UNSUPPORTED_DETAIL)
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadRejected(TOO_LARGE_DETAIL, status_code=413)
+            digest.update(chunk)
+            await asyncio.to_thread(out.write, chunk)
+        if content_type is None:
+            raise UploadRejected(UNSUPPORTED_DETAIL)
+    except BaseException:
+        await asyncio.to_thread(out.close)
+        await asyncio.to_thread(path.unlink, missing_ok=True)
+        raise
+    await asyncio.to_thread(out.close)
+    return StagedUpload(path=path, size=size, sha256=digest.hexdigest(), content_type=content_type)
+
+
+class UploadGuardMiddleware:
+    """Limit concurrent uploads and cut off oversized bodies on ``paths``.
+
+    Requests wait up to ``slot_timeout`` seconds for a free slot and get 503
+    otherwise. Bodies larger than ``max_body`` are refused from the
+    Content-Length header, or as soon as the streamed bytes cross the limit.
+    """
+
+    def __init__(
+        self,
+        app,
+        paths: Iterable[str],
+        max_body: int = MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD,
+        max_concurrent: int = MAX_CONCURRENT_UPLOADS,
+        slot_timeout: float = UPLOAD_SLOT_TIMEOUT,
+    ):
+        self.app = app
+        self.paths = set(paths)
+        self.max_body = max_body
+        self.slot_timeout = slot_timeout
+        self._slots = asyncio.Semaphore(max_concurrent)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_body:
+            await _reject(send, 413, TOO_LARGE_DETAIL)
+            return
+
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.slot_timeout)
+        except asyncio.TimeoutError:
+            await _reject(send, 503, BUSY_DETAIL, {"Retry-After": "1"})
+            return
+
+        received = 0
+        too_large = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, too_large
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body:
+                    too_large = True
+                    # Makes the app stop reading; its error response is replaced below
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if too_large:
+                if message["type"] == "http.response.start" and not response_started:
+                    response_started = True
+                    await _reject(send, 413, TOO_LARGE_DETAIL)
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        finally:
+            self._slots.release()
+
+
+async def _reject(send, status_code: int, detail: str, headers: Optional[dict] = None):
+    body = json.dumps({"detail": detail}).encode()
+    raw_headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+    ]
+    raw_headers += [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    await send({"type": "http.response.start", "status": status_code, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,337 @@
+"""Throughput and latency of the API hot paths.
+
+Seeds BENCH_DB_NAME with synthetic clients, merchants, stores, products and
+transactions (plus their analytics rollups), then drives each scenario with
+--concurrency asyncio workers and reports throughput and p50/p95/p99:
+
+    login, profile, stores, products, search, transactions,
+    create_transaction, analytics
+
+Requests go to an app from server.create_app() inside this process through httpx's ASGI transport
+(no sockets, so the numbers are the app and the database), or to a running
+server with --base-url. --mock replaces MongoDB with mongomock_motor and
+seeds a small dataset in memory: good for checking that the suite works,
+meaningless for comparing numbers.
+
+Each run writes a JSON file (default results/<commit>.json next to this
+script); ``compare`` diffs two of them and fails on p95 regressions.
+
+    python benchmarks/api_bench.py seed [--clients 1000] [--merchants 100] [--transactions 100000]
+    python benchmarks/api_bench.py run [--requests 1000] [--concurrency 32] [--scenarios login,profile] [--mock]
+    python benchmarks/api_bench.py compare results/BASE.json results/HEAD.json [--max-regression 10]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+
+from common import BACKEND_DIR, BENCH_DB_NAME, MONGO_URL, latency_summary
+
+# server.py reads these at import time
+os.environ.setdefault("MONGO_URL", MONGO_URL)
+os.environ["DB_NAME"] = BENCH_DB_NAME
+# Every request comes from one IP and a few users; measure the handlers, not the 429s
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+PASSWORD = "bench-password"
+SCENARIOS = ("login", "profile", "stores", "products", "search", "transactions", "create_transaction", "analytics")
+CATEGORIES = ["Restaurante", "Mercado", "Farmácia", "Roupas", "Eletrônicos", "Café", "Padaria"]
+WORDS = "cafe pao bolo suco camiseta tenis caneca livro fone cabo mochila relogio vinho queijo".split()
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# Seeding (writes straight to the database, in the shape the handlers write)
+
+def _batches(docs: List[Dict[str, Any]], size: int = 5000):
+    for start in range(0, len(docs), size):
+        yield docs[start:start + size]
+
+
+async def seed(db, clients: int, merchants: int, stores_per_merchant: int, products_per_store: int,
+               transactions: int, create_indexes: bool = True) -> Dict[str, int]:
+    import rollups
+    import search
+    import server
+    from indexes import ensure_indexes
+
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    for name in ("users", "stores", "products", "transactions", "analytics_rollups", "idempotency_keys"):
+        await db[name].drop()
+    if create_indexes:
+        await ensure_indexes(db)
+
+    # One bcrypt hash shared by every user: hashing is what login measures, not seeding
+    hashed = await server.password_hasher.hash(PASSWORD)
+    users = [
+        server.User(email=f"client{n}@paycoin-bench.com", name=f"Cliente {n}", user_type="client",
+                    hashed_password=hashed).dict()
+        for n in range(clients)
+    ] + [
+        server.User(email=f"merchant{n}@paycoin-bench.com", name=f"Loja {n}", user_type="merchant",
+                    hashed_password=hashed).dict()
+        for n in range(merchants)
+    ]
+    for batch in _batches(users):
+        await db.users.insert_many(batch)
+    client_ids = [u["id"] for u in users if u["user_type"] == "client"]
+    merchant_ids = [u["id"] for u in users if u["user_type"] == "merchant"]
+
+    stores, products = [], []
+    for merchant_id in merchant_ids:
+        for s in range(stores_per_merchant):
+            address = {
+                "street": "Rua Bench", "number": str(s), "neighborhood": "Centro", "city": "São Paulo",
+                "state": "SP", "zip_code": "01000-000",
+                "latitude": -23.55 + rng.uniform(-0.2, 0.2), "longitude": -46.63 + rng.uniform(-0.2, 0.2),
+            }
+            store = server.Store(
+                merchant_id=merchant_id, name=f"{rng.choice(WORDS).title()} {rng.choice(CATEGORIES)}",
+                category=rng.choice(CATEGORIES), address=address,
+                created_at=now - timedelta(minutes=rng.randint(0, 500000)),
+            )
+            store.location = server.geo.location_for_address(address)
+            doc = store.dict()
+            stores.append({**doc, **search.search_fields("stores", doc)})
+            for _ in range(products_per_store):
+                product = server.Product(
+                    merchant_id=merchant_id, name=f"{rng.choice(WORDS).title()} {rng.choice(WORDS)}",
+                    price=round(rng.uniform(1, 500), 2), category=rng.choice(CATEGORIES),
+                    created_at=now - timedelta(minutes=rng.randint(0, 500000)),
+                ).dict()
+                products.append({**product, **search.search_fields("products", product)})
+    for batch in _batches(stores):
+        await db.stores.insert_many(batch)
+    for batch in _batches(products):
+        await db.products.insert_many(batch)
+
+    docs = [
+        server.Transaction(
+            from_user_id=rng.choice(client_ids), to_user_id=rng.choice(merchant_ids),
+            amount=round(rng.uniform(1, 300), 2), token_type=rng.choice(["PSPAY", "USDT"]),
+            status=rng.choices(["completed", "pending", "failed"], [85, 10, 5])[0],
+            created_at=now - timedelta(minutes=rng.randint(0, 90 * 24 * 60)),
+        ).dict()
+        for _ in range(transactions)
+    ]
+    for batch in _batches(docs):
+        await db.transactions.insert_many(batch)
+    await rollups.rebuild(db)
+    return {"users": len(users), "stores": len(stores), "products": len(products), "transactions": len(docs)}
+
+
+# Load driver
+
+class Context:
+    """Tokens and ids the scenarios draw from."""
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.clients: List[Dict[str, str]] = []    # {"email", "id", "token"}
+        self.merchants: List[Dict[str, str]] = []
+
+    def headers(self, user: Dict[str, str]) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {user['token']}"}
+
+
+async def _login(http, email: str) -> Dict[str, str]:
+    r = await http.post("/api/auth/login", json={"email": email, "password": PASSWORD})
+    r.raise_for_status()
+    body = r.json()
+    return {"email": email, "id": body["user_id"], "token": body["access_token"]}
+
+
+async def prepare(http, db, sessions: int) -> Context:
+    """Log a sample of the seeded users in; the scenarios reuse their tokens."""
+    ctx = Context(random.Random(7))
+    for user_type, target in (("client", ctx.clients), ("merchant", ctx.merchants)):
+        emails = [u["email"] async for u in db.users.find({"user_type": user_type}, {"_id": 0, "email": 1}).limit(sessions)]
+        if not emails:
+            raise SystemExit(f"No {user_type} users in {BENCH_DB_NAME}; run `seed` first")
+        target.extend(await asyncio.gather(*(_login(http, email) for email in emails)))
+    return ctx
+
+
+def scenario_requests(ctx: Context) -> Dict[str, Callable[[Any], Awaitable[Any]]]:
+    rng = ctx.rng
+
+    def login(http):
+        return http.post("/api/auth/login", json={"email": rng.choice(ctx.clients)["email"], "password": PASSWORD})
+
+    def profile(http):
+        return http.get("/api/user/profile", headers=ctx.headers(rng.choice(ctx.clients)))
+
+    def stores(http):
+        return http.get("/api/stores", params={"limit": 20})
+
+    def products(http):
+        return http.get("/api/products", params={"limit": 20})
+
+    def search(http):
+        return http.get("/api/search", params={"q": rng.choice(WORDS)[:rng.randint(2, 4)], "limit": 20})
+
+    def transactions(http):
+        return http.get("/api/transactions", params={"limit": 20}, headers=ctx.headers(rng.choice(ctx.clients)))
+
+    def create_transaction(http):
+        body = {"to_user_id": rng.choice(ctx.merchants)["id"], "amount": round(rng.uniform(1, 300), 2),
+                "token_type": rng.choice(["PSPAY", "USDT"]), "description": "bench"}
+        return http.post("/api/transactions", json=body, headers=ctx.headers(rng.choice(ctx.clients)))
+
+    def analytics(http):
+        return http.get("/api/analytics/dashboard", headers=ctx.headers(rng.choice(ctx.merchants)))
+
+    return {name: fn for name, fn in locals().items() if name in SCENARIOS}
+
+
+async def measure(http, request: Callable[[Any], Awaitable[Any]], requests: int, concurrency: int) -> Dict[str, Any]:
+    samples: List[float] = []
+    errors: Dict[str, int] = {}
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            began = time.perf_counter()
+            try:
+                r = await request(http)
+                failed = None if r.status_code < 400 else str(r.status_code)
+            except Exception as e:
+                failed = type(e).__name__
+            if failed:
+                errors[failed] = errors.get(failed, 0) + 1
+            else:
+                samples.append((time.perf_counter() - began) * 1000)
+
+    began = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - began
+    return {"throughput_rps": round(len(samples) / elapsed, 1), "errors": errors, **latency_summary(samples)}
+
+
+async def run(args, app) -> Dict[str, Any]:
+    import httpx
+
+    names = args.scenarios.split(",") if args.scenarios else list(SCENARIOS)
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    db = app.state.services.db
+    if args.mock:
+        # mongomock ignores partial filters, so the unique partial indexes would reject the seed
+        await seed(db, clients=200, merchants=20, stores_per_merchant=2, products_per_store=10,
+                   transactions=2000, create_indexes=False)
+    if args.base_url:
+        http = httpx.AsyncClient(base_url=args.base_url, timeout=30)
+    else:
+        http = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=30)
+
+    try:
+        ctx = await prepare(http, db, args.sessions)
+        requests = scenario_requests(ctx)
+        results = {}
+        for name in names:
+            # Warm caches and connection pools, then measure
+            await measure(http, requests[name], min(args.concurrency * 2, args.requests), args.concurrency)
+            results[name] = await measure(http, requests[name], args.requests, args.concurrency)
+            print(f"{name:20} {results[name]['throughput_rps']:>9} req/s  p50 {results[name]['p50_ms']:>8}ms  "
+                  f"p95 {results[name]['p95_ms']:>8}ms  p99 {results[name]['p99_ms']:>8}ms", file=sys.stderr)
+    finally:
+        await http.aclose()
+    return {
+        "benchmark": "api",
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+        "target": args.base_url or ("in-process (mongomock)" if args.mock else "in-process"),
+        "config": {"requests": args.requests, "concurrency": args.concurrency, "sessions": args.sessions,
+                   "bcrypt_rounds": int(os.environ.get("BCRYPT_ROUNDS", "12"))},
+        "scenarios": results,
+    }
+
+
+def compare(base: Dict[str, Any], head: Dict[str, Any], max_regression: float) -> int:
+    """Print the p95/throughput change per scenario; 1 if a p95 grew by more than max_regression %."""
+    regressed = []
+    print(f"{'scenario':20} {'p95 base':>10} {'p95 head':>10} {'change':>8} {'rps base':>10} {'rps head':>10}")
+    for name, new in head["scenarios"].items():
+        old = base["scenarios"].get(name)
+        if old is None:
+            continue
+        change = (new["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100 if old["p95_ms"] else 0.0
+        print(f"{name:20} {old['p95_ms']:>10} {new['p95_ms']:>10} {change:>+7.1f}% "
+              f"{old['throughput_rps']:>10} {new['throughput_rps']:>10}")
+        if change > max_regression:
+            regressed.append(name)
+    if regressed:
+        print(f"p95 regressed by more than {max_regression}%: {', '.join(regressed)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+async def main(args) -> int:
+    if args.command == "compare":
+        base, head = (json.loads(Path(path).read_text()) for path in (args.base, args.head))
+        return compare(base, head, args.max_regression)
+
+    import server
+    client = None
+    if getattr(args, "mock", False):
+        from mongomock_motor import AsyncMongoMockClient
+
+        client = AsyncMongoMockClient()
+    app = server.create_app(client)
+    try:
+        if args.command == "seed":
+            counts = await seed(app.state.services.db, args.clients, args.merchants, args.stores_per_merchant,
+                                args.products_per_store, args.transactions)
+            print(f"Seeded {BENCH_DB_NAME}: {counts}")
+            return 0
+        result = await run(args, app)
+        output = Path(args.output) if args.output else RESULTS_DIR / f"{result['commit']}.json"
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(result, indent=2) + "\n")
+        print(f"Results written to {output}")
+        return 0
+    finally:
+        app.state.services.client.close()
+        server.password_hasher.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    seed_parser = sub.add_parser("seed")
+    seed_parser.add_argument("--clients", type=int, default=1000)
+    seed_parser.add_argument("--merchants", type=int, default=100)
+    seed_parser.add_argument("--stores-per-merchant", type=int, default=2)
+    seed_parser.add_argument("--products-per-store", type=int, default=20)
+    seed_parser.add_argument("--transactions", type=int, default=100_000)
+    run_parser = sub.add_parser("run")
+    run_parser.add_argument("--requests", type=int, default=1000, help="per scenario")
+    run_parser.add_argument("--concurrency", type=int, default=32)
+    run_parser.add_argument("--sessions", type=int, default=50, help="logged-in users of each type")
+    run_parser.add_argument("--scenarios", help=f"comma separated, default: {','.join(SCENARIOS)}")
+    run_parser.add_argument("--base-url", help="benchmark a running server instead of an in-process app")
+    run_parser.add_argument("--mock", action="store_true", help="mongomock_motor instead of MongoDB (smoke test)")
+    run_parser.add_argument("--output", help="default: results/<commit>.json")
+    compare_parser = sub.add_parser("compare")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("head")
+    compare_parser.add_argument("--max-regression", type=float, default=10, help="allowed p95 growth in %%")
+    sys.exit(asyncio.run(main(parser.parse_args())))
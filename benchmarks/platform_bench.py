@@ -0,0 +1,151 @@
+"""Platform summary job over a synthetic transaction history.
+
+``seed`` fills BENCH_DB_NAME with synthetic transactions (10M over a year
+from 20k merchants by default) and ``run`` times platform_summary.run with
+each worker count; both need a real MongoDB at MONGO_URL. ``compute`` needs
+no database: it times only the per-partition pandas work (summarize_frame)
+over the same volume, serially and in the process pool, which is the part
+the extra workers speed up.
+
+    python benchmarks/platform_bench.py seed [--transactions 10000000] [--merchants 20000]
+    python benchmarks/platform_bench.py run [--workers 1,4] [--days 30]
+    python benchmarks/platform_bench.py compute [--transactions 10000000] [--partitions 20] [--workers 1,4]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from common import BENCH_DB_NAME, MONGO_URL
+
+import platform_summary
+from indexes import INDEXES
+
+START = datetime(2024, 1, 1)
+DAYS = 365
+
+
+def synthetic_columns(seed: int, rows: int, merchants: range) -> dict:
+    """Columns of ``rows`` transactions to ``merchants``; a few merchants take most of the volume."""
+    rng = np.random.default_rng(seed)
+    weights = rng.pareto(1.2, len(merchants)) + 1
+    merchant = rng.choice(len(merchants), rows, p=weights / weights.sum()) + merchants.start
+    seconds = rng.integers(0, DAYS * 86400, rows)
+    return {
+        "merchant": np.char.add("merchant-", np.char.zfill(merchant.astype(str), 6)),
+        "amount": np.round(rng.lognormal(3.5, 1.2, rows), 2),
+        "token_type": np.where(rng.random(rows) < 0.3, "PSPAY", "USDT"),
+        "status": np.where(rng.random(rows) < 0.03, "failed", "completed"),
+        "created_at": np.datetime64(START, "ms") + seconds.astype("timedelta64[s]"),
+    }
+
+
+def seed(db, transactions: int, merchants: int, batch_size: int = 50_000):
+    db.transactions.drop()
+    db.transactions.create_indexes(INDEXES["transactions"])
+    began = time.perf_counter()
+    for offset in range(0, transactions, batch_size):
+        rows = min(batch_size, transactions - offset)
+        columns = synthetic_columns(offset, rows, range(merchants))
+        frame = pd.DataFrame({
+            "id": [f"bench-{n}" for n in range(offset, offset + rows)],
+            "from_user_id": [f"client-{n % 100_000}" for n in range(offset, offset + rows)],
+            "to_user_id": columns["merchant"],
+            **{name: columns[name] for name in ("amount", "token_type", "status")},
+            "created_at": pd.to_datetime(columns["created_at"]),
+        })
+        db.transactions.insert_many(frame.to_dict("records"), ordered=False)
+        print(f"\rseeded {offset + rows}/{transactions}", end="", flush=True)
+    print(f"\nseeded {transactions} transactions in {time.perf_counter() - began:.0f}s")
+
+
+def run(db, workers: list, days: int) -> list:
+    end = START + timedelta(days=DAYS)
+    start = end - timedelta(days=days)
+    results = []
+    for count in workers:
+        began = time.perf_counter()
+        with platform_summary.create_executor(MONGO_URL, BENCH_DB_NAME, count) as executor:
+            job = platform_summary.run(db, executor, start, end, restart=True)
+        elapsed = time.perf_counter() - began
+        results.append({
+            "benchmark": "platform_summary",
+            "workers": count,
+            "partitions": len(job["partitions"]),
+            "transactions_read": job["rows"],
+            "seconds": round(elapsed, 2),
+            "rows_per_second": round(job["rows"] / elapsed),
+        })
+    return results
+
+
+def _compute_partition(index: int, rows: int, merchants: range) -> int:
+    columns = synthetic_columns(index, rows, merchants)
+    keep = columns.pop("status") != "failed"
+    frame = pd.DataFrame({name: values[keep] for name, values in columns.items()}).astype(
+        {"merchant": "category", "token_type": "category"}
+    )
+    end = START + timedelta(days=DAYS)
+    platform_summary.summarize_frame(frame, START + timedelta(days=platform_summary.PLATFORM_CHURN_DAYS), end)
+    return len(frame)
+
+
+def compute(transactions: int, partitions: int, merchants: int, workers: list) -> list:
+    rows, per_partition = transactions // partitions, merchants // partitions
+    tasks = [(index, rows, range(index * per_partition, (index + 1) * per_partition)) for index in range(partitions)]
+    results = []
+    for count in workers:
+        began = time.perf_counter()
+        if count == 1:
+            summarized = sum(_compute_partition(*task) for task in tasks)
+        else:
+            with ProcessPoolExecutor(count, mp_context=multiprocessing.get_context("spawn")) as executor:
+                summarized = sum(executor.map(_compute_partition, *zip(*tasks)))
+        elapsed = time.perf_counter() - began
+        results.append({
+            "benchmark": "platform_summary_compute",
+            "workers": count,
+            "partitions": partitions,
+            "transactions": summarized,
+            "seconds": round(elapsed, 2),
+            "rows_per_second": round(summarized / elapsed),
+        })
+    return results
+
+
+def main(args) -> int:
+    workers = [int(count) for count in args.workers.split(",")]
+    if args.command == "compute":
+        results = compute(args.transactions, args.partitions, args.merchants, workers)
+    else:
+        from pymongo import MongoClient
+
+        client = MongoClient(MONGO_URL)
+        try:
+            db = client[BENCH_DB_NAME]
+            if args.command == "seed":
+                seed(db, args.transactions, args.merchants)
+                return 0
+            results = run(db, workers, args.days)
+        finally:
+            client.close()
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["seed", "run", "compute"])
+    parser.add_argument("--transactions", type=int, default=10_000_000)
+    parser.add_argument("--merchants", type=int, default=20_000)
+    parser.add_argument("--partitions", type=int, default=20)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--workers", default=f"1,{os.cpu_count() or 1}")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,144 @@
+"""GET /api/search latency over a synthetic catalog.
+
+Seeds BENCH_DB_NAME with a generated catalog (1M products by default) and
+times search.search_collection for a mix of prefix, multi-word and filtered
+queries at a given concurrency. Needs a real MongoDB at MONGO_URL.
+
+    python benchmarks/search_bench.py seed [--products 1000000]
+    python benchmarks/search_bench.py run [--queries 2000] [--concurrency 16] [--p95-ms 150]
+
+``run`` exits with status 1 when the p95 latency is above --p95-ms.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from common import BENCH_DB_NAME, MONGO_URL, latency_summary
+
+import search
+from indexes import ensure_indexes
+
+WORDS = (
+    "camiseta calca bermuda vestido saia blusa jaqueta casaco tenis sapato sandalia bota meia bone "
+    "bolsa mochila carteira relogio oculos colar anel brinco pulseira caneca copo prato panela "
+    "talher toalha lencol travesseiro almofada tapete cortina luminaria abajur vela sabonete shampoo "
+    "perfume creme batom esmalte cafe cha chocolate biscoito bolo pao queijo vinho cerveja suco "
+    "agua refrigerante arroz feijao azeite tempero livro caderno caneta lapis mouse teclado monitor "
+    "fone carregador cabo capinha bicicleta bola raquete skate patins boneca carrinho quebra cabeca"
+).split()
+ADJECTIVES = (
+    "azul vermelho preto branco verde amarelo rosa cinza dourado prata grande pequeno medio leve "
+    "premium classico moderno vintage artesanal organico importado nacional infantil adulto esportivo"
+).split()
+CATEGORIES = ["Roupas", "Calcados", "Acessorios", "Casa", "Beleza", "Alimentos", "Bebidas",
+              "Papelaria", "Eletronicos", "Esportes", "Brinquedos"]
+CURRENCIES = ["BRL", "BRL", "BRL", "PSPAY", "USDT"]
+
+
+def synthetic_product(rng: random.Random, n: int, start: datetime) -> dict:
+    name = " ".join([rng.choice(WORDS), rng.choice(ADJECTIVES)] + ([rng.choice(ADJECTIVES)] if rng.random() < 0.3 else []))
+    description = " ".join(rng.choice(WORDS + ADJECTIVES) for _ in range(rng.randint(4, 12)))
+    doc = {
+        "id": f"bench-{n}",
+        "merchant_id": f"merchant-{n % 5000}",
+        "name": name.capitalize(),
+        "description": description,
+        "price": round(rng.lognormvariate(3.5, 1.2), 2),
+        "currency": rng.choice(CURRENCIES),
+        "category": rng.choice(CATEGORIES),
+        "image": None,
+        "is_active": rng.random() < 0.95,
+        "created_at": start + timedelta(seconds=n),
+    }
+    return {**doc, **search.search_fields("products", doc)}
+
+
+async def seed(db, products: int, batch_size: int = 5000):
+    rng = random.Random(42)
+    start = datetime(2024, 1, 1)
+    await db.products.drop()
+    await ensure_indexes(db)
+    began = time.perf_counter()
+    for offset in range(0, products, batch_size):
+        batch = [synthetic_product(rng, n, start) for n in range(offset, min(offset + batch_size, products))]
+        await db.products.insert_many(batch, ordered=False)
+        print(f"\rseeded {offset + len(batch)}/{products}", end="", flush=True)
+    print(f"\nseeded {products} products in {time.perf_counter() - began:.0f}s")
+
+
+def query_mix(rng: random.Random, count: int) -> list:
+    queries = []
+    for _ in range(count):
+        word = rng.choice(WORDS)
+        roll = rng.random()
+        if roll < 0.5:
+            queries.append({"q": word[:rng.randint(3, len(word))]})
+        elif roll < 0.75:
+            queries.append({"q": f"{word} {rng.choice(ADJECTIVES)[:4]}"})
+        elif roll < 0.9:
+            queries.append({"q": word[:4], "category": rng.choice(CATEGORIES)})
+        else:
+            low = rng.choice([0, 10, 50, 100])
+            queries.append({"q": word[:5], "min_price": low, "max_price": low * 5 + 50, "currency": "BRL"})
+    return queries
+
+
+async def run(db, queries: int, concurrency: int) -> dict:
+    rng = random.Random(7)
+    mix = query_mix(rng, queries)
+    samples, semaphore = [], asyncio.Semaphore(concurrency)
+
+    async def one(params):
+        async with semaphore:
+            began = time.perf_counter()
+            await search.search_collection(db, "products", **params)
+            samples.append((time.perf_counter() - began) * 1000)
+
+    # Warm the index into the cache before measuring
+    await asyncio.gather(*(one(params) for params in mix[:min(100, queries)]))
+    samples.clear()
+    began = time.perf_counter()
+    await asyncio.gather(*(one(params) for params in mix))
+    elapsed = time.perf_counter() - began
+    return {
+        "benchmark": "search",
+        "products": await db.products.estimated_document_count(),
+        "concurrency": concurrency,
+        "throughput_rps": round(len(samples) / elapsed, 1),
+        **latency_summary(samples),
+    }
+
+
+async def main(args) -> int:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(MONGO_URL)
+    db = client[BENCH_DB_NAME]
+    try:
+        if args.command == "seed":
+            await seed(db, args.products)
+            return 0
+        result = await run(db, args.queries, args.concurrency)
+        print(json.dumps(result, indent=2))
+        if result["p95_ms"] > args.p95_ms:
+            print(f"p95 {result['p95_ms']}ms is above the {args.p95_ms}ms target", file=sys.stderr)
+            return 1
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    seed_parser = sub.add_parser("seed")
+    seed_parser.add_argument("--products", type=int, default=1_000_000)
+    run_parser = sub.add_parser("run")
+    run_parser.add_argument("--queries", type=int, default=2000)
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument("--p95-ms", type=float, default=150)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,101 @@
+"""CPU cost of encoding a list page, before and after serialization.py.
+
+Encodes the same page of synthetic rows three ways and reports the CPU
+time per response (process time, so waiting is not counted):
+
+- ``models``: Model(**doc) per row, FastAPI's response_model validation and
+  jsonable_encoder, then JSONResponse (the old list path);
+- ``validated``: one TypeAdapter validation per page + orjson
+  (VALIDATE_LIST_RESPONSES=true);
+- ``fast``: RowEncoder defaults fill + orjson (the default).
+
+No database is needed.
+
+    python benchmarks/serialization_bench.py [--rows 1000] [--iterations 200]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from common import BENCH_DB_NAME, MONGO_URL
+
+# server.py reads these at import time (nothing connects)
+os.environ.setdefault("MONGO_URL", MONGO_URL)
+os.environ["DB_NAME"] = BENCH_DB_NAME
+
+
+def synthetic_transactions(rows: int) -> List[dict]:
+    start = datetime(2024, 1, 1)
+    return [
+        {
+            "id": f"bench-{n}", "from_user_id": f"client-{n % 97}", "to_user_id": f"merchant-{n % 13}",
+            "amount": round(10 + n * 0.37, 2), "token_type": "USDT" if n % 2 else "PSPAY",
+            "transaction_hash": f"0x{n:064x}", "status": "completed", "confirmations": 12,
+            "block_number": 40_000_000 + n, "settled_at": start + timedelta(seconds=n + 30),
+            "created_at": start + timedelta(seconds=n), "description": "bench", "quote_id": None,
+            "idempotency_key": None,
+        }
+        for n in range(rows)
+    ]
+
+
+def cpu_ms_per_call(fn, iterations: int) -> float:
+    fn()
+    began = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return round((time.process_time() - began) / iterations * 1000, 3)
+
+
+def main(args) -> int:
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+
+    import server
+    from serialization import RowEncoder
+
+    route = next(r for r in server.api_router.routes if getattr(r, "path", "") == "/api/transactions" and "GET" in r.methods)
+    docs = synthetic_transactions(args.rows)
+    loop = asyncio.new_event_loop()
+
+    def models():
+        items = [server.Transaction(**doc) for doc in docs]
+        content = loop.run_until_complete(
+            serialize_response(field=route.response_field, response_content=items, is_coroutine=True)
+        )
+        return JSONResponse(content).body
+
+    fast_encoder = RowEncoder(server.Transaction, validate=False)
+    validated_encoder = RowEncoder(server.Transaction, validate=True)
+    outputs = {"models": models(), "validated": validated_encoder.encode(docs), "fast": fast_encoder.encode(docs)}
+    if len({json.dumps(json.loads(body), sort_keys=True) for body in outputs.values()}) != 1:
+        print("The encodings differ", file=sys.stderr)
+        return 1
+
+    results = {
+        "models": cpu_ms_per_call(models, args.iterations),
+        "validated": cpu_ms_per_call(lambda: validated_encoder.encode(docs), args.iterations),
+        "fast": cpu_ms_per_call(lambda: fast_encoder.encode(docs), args.iterations),
+    }
+    loop.close()
+    print(json.dumps({
+        "benchmark": "serialization",
+        "rows": args.rows,
+        "bytes": len(outputs["fast"]),
+        "cpu_ms_per_response": results,
+        "speedup_fast": round(results["models"] / results["fast"], 1),
+        "speedup_validated": round(results["models"] / results["validated"], 1),
+    }, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=200)
+    sys.exit(main(parser.parse_args()))
@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { useAuth } from '../contexts/AuthContext';
 import { Plus, Package, Edit, Trash2, Eye, EyeOff, Search, Filter, X } from 'lucide-react';
 import axios from 'axios';
+import { fetchAllPages } from '../lib/pagination';
 import { toast } from 'sonner';
 
 const ProductManagement = () => {
@@ -29,8 +30,7 @@ const ProductManagement = () => {
 
   const fetchProducts = async () => {
     try {
-      const response = await axios.get('/my-products');
-      setProducts(response.data);
+      setProducts(await fetchAllPages('/my-products'));
     } catch (error) {
       console.error('Error fetching products:', error);
       // Mock data for demonstration
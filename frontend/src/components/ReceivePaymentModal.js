@@ -3,6 +3,7 @@ import { useWeb3 } from '../contexts/Web3Context';
 import { X, QrCode, Download, Copy, Wallet } from 'lucide-react';
 import { toast } from 'sonner';
 import QRCode from 'qrcode';
+import { usePaymentEvents } from '../hooks/use-payment-events';
 
 const ReceivePaymentModal = ({ isOpen, onClose }) => {
   const { account, generatePaymentQR, tokens } = useWeb3();
@@ -15,6 +16,16 @@ const ReceivePaymentModal = ({ isOpen, onClose }) => {
   const [qrCodeUrl, setQrCodeUrl] = useState('');
   const canvasRef = useRef(null);
 
+  // Avisa o caixa assim que o pagamento chega, sem ficar consultando /api/transactions
+  usePaymentEvents((event) => {
+    const { amount, token_type: tokenType } = event.transaction;
+    if (event.type === 'payment_received') {
+      toast.success(`Pagamento recebido: ${amount} ${tokenType}`);
+    } else if (event.type === 'payment_status' && event.transaction.status === 'completed') {
+      toast.success(`Pagamento confirmado na blockchain: ${amount} ${tokenType}`);
+    }
+  }, isOpen);
+
   if (!isOpen) return null;
 
   const handleChange = (e) => {
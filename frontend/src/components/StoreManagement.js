@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { useAuth } from '../contexts/AuthContext';
 import { Plus, Store, Edit, MapPin, Phone, Clock, Eye, EyeOff, X } from 'lucide-react';
 import axios from 'axios';
+import { fetchAllPages } from '../lib/pagination';
 import { toast } from 'sonner';
 
 const StoreManagement = () => {
@@ -42,8 +43,7 @@ const StoreManagement = () => {
 
   const fetchStores = async () => {
     try {
-      const response = await axios.get('/my-stores');
-      setStores(response.data);
+      setStores(await fetchAllPages('/my-stores'));
     } catch (error) {
       console.error('Error fetching stores:', error);
       // Mock data for demonstration
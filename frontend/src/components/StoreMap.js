@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { MapContainer, TileLayer, Marker, Popup } from 'react-leaflet';
 import { MapPin, Phone, Clock, Star, Navigation, Search } from 'lucide-react';
 import axios from 'axios';
+import { fetchAllPages } from '../lib/pagination';
 import { toast } from 'sonner';
 import L from 'leaflet';
 import 'leaflet/dist/leaflet.css';
@@ -39,6 +40,7 @@ const StoreMap = () => {
           const { latitude, longitude } = position.coords;
           setUserLocation([latitude, longitude]);
           setMapCenter([latitude, longitude]);
+          fetchStores([latitude, longitude]);
         },
         (error) => {
           console.error('Error getting user location:', error);
@@ -58,11 +60,16 @@ const StoreMap = () => {
     }
   };
 
-  const fetchStores = async () => {
+  const fetchStores = async (location = null) => {
     try {
       const backendUrl = process.env.REACT_APP_BACKEND_URL || '';
-      const response = await axios.get(`${backendUrl}/api/stores`);
-      setStores(response.data);
+      // Com a localização do usuário, busca apenas as lojas próximas (ordenadas por distância)
+      const stores = location
+        ? (await axios.get(`${backendUrl}/api/stores/nearby`, {
+            params: { lat: location[0], lng: location[1], radius: 20000 }
+          })).data
+        : await fetchAllPages(`${backendUrl}/api/stores`);
+      setStores(stores);
     } catch (error) {
       console.error('Error fetching stores:', error);
       // Mock data for demonstration
@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { useAuth } from '../contexts/AuthContext';
 import { History, ArrowUpRight, ArrowDownLeft, Search, Filter } from 'lucide-react';
-import axios from 'axios';
+import { fetchAllPages } from '../lib/pagination';
 import { toast } from 'sonner';
 
 const TransactionHistory = () => {
@@ -17,8 +17,7 @@ const TransactionHistory = () => {
 
   const fetchTransactions = async () => {
     try {
-      const response = await axios.get('/transactions');
-      setTransactions(response.data);
+      setTransactions(await fetchAllPages('/transactions'));
     } catch (error) {
       console.error('Error fetching transactions:', error);
       // Mock data for demonstration
@@ -1,4 +1,4 @@
-import React, { createContext, useContext, useState, useEffect } from 'react';
+import React, { createContext, useContext, useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 
 const AuthContext = createContext();
@@ -20,6 +20,16 @@ export const AuthProvider = ({ children }) => {
   const [user, setUser] = useState(null);
   const [token, setToken] = useState(localStorage.getItem('token'));
   const [loading, setLoading] = useState(true);
+  const refreshing = useRef(null);
+
+  const saveSession = ({ access_token, refresh_token }) => {
+    setToken(access_token);
+    localStorage.setItem('token', access_token);
+    if (refresh_token) {
+      localStorage.setItem('refreshToken', refresh_token);
+    }
+    axios.defaults.headers.common['Authorization'] = `Bearer ${access_token}`;
+  };
 
   // Set up axios interceptor for authentication
   useEffect(() => {
@@ -30,6 +40,47 @@ export const AuthProvider = ({ children }) => {
     }
   }, [token]);
 
+  // Access tokens are short-lived: on a 401, trade the refresh token for a new
+  // pair once (concurrent failures share the same refresh) and retry
+  useEffect(() => {
+    const interceptor = axios.interceptors.response.use(
+      (response) => response,
+      async (error) => {
+        const original = error.config;
+        const refreshToken = localStorage.getItem('refreshToken');
+        if (
+          error.response?.status !== 401 ||
+          !refreshToken ||
+          !original ||
+          original._retried ||
+          original.url?.startsWith('/auth/')
+        ) {
+          return Promise.reject(error);
+        }
+        original._retried = true;
+        try {
+          if (!refreshing.current) {
+            refreshing.current = axios
+              .post('/auth/refresh', { refresh_token: refreshToken })
+              .then((response) => saveSession(response.data))
+              .finally(() => {
+                refreshing.current = null;
+              });
+          }
+          await refreshing.current;
+        } catch (refreshError) {
+          return Promise.reject(error);
+        }
+        original.headers = {
+          ...original.headers,
+          Authorization: axios.defaults.headers.common['Authorization'],
+        };
+        return axios(original);
+      }
+    );
+    return () => axios.interceptors.response.eject(interceptor);
+  }, []);
+
   // Load user profile on app start
   useEffect(() => {
     const loadUser = async () => {
@@ -58,10 +109,9 @@ export const AuthProvider = ({ children }) => {
         password,
       });
 
-      const { access_token, user_type, user_id } = response.data;
+      const { access_token } = response.data;
       
-      setToken(access_token);
-      localStorage.setItem('token', access_token);
+      saveSession(response.data);
       
       // Load user profile after login
       const profileResponse = await axios.get('/user/profile', {
@@ -84,10 +134,9 @@ export const AuthProvider = ({ children }) => {
     try {
       const response = await axios.post('/auth/register', userData);
       
-      const { access_token, user_type, user_id } = response.data;
+      const { access_token } = response.data;
       
-      setToken(access_token);
-      localStorage.setItem('token', access_token);
+      saveSession(response.data);
       
       // Load user profile after registration
       const profileResponse = await axios.get('/user/profile', {
@@ -107,9 +156,15 @@ export const AuthProvider = ({ children }) => {
   };
 
   const logout = () => {
+    const refreshToken = localStorage.getItem('refreshToken');
+    if (refreshToken) {
+      // Best effort: the session ends locally either way
+      axios.post('/auth/logout', { refresh_token: refreshToken }).catch(() => {});
+    }
     setUser(null);
     setToken(null);
     localStorage.removeItem('token');
+    localStorage.removeItem('refreshToken');
     delete axios.defaults.headers.common['Authorization'];
   };
 
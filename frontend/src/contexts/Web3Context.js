@@ -386,53 +386,35 @@ export const Web3Provider = ({ children }) => {
   };
 
   // =====================================================================
-  //  FUNÇÃO DE BUSCA DE PREÇO CORRIGIDA
+  //  COTAÇÕES: buscadas no backend (/api/quotes), que mantém em cache o
+  //  preço do PSPAY (GeckoTerminal) e o câmbio USD/BRL compartilhados
   // =====================================================================
+  const fetchQuote = async (tokenSymbol, amountBRL = null) => {
+    const backendUrl = process.env.REACT_APP_BACKEND_URL || '';
+    const params = new URLSearchParams({ token: tokenSymbol });
+    if (amountBRL !== null) {
+      params.set('amount_brl', amountBRL);
+    }
+    const response = await fetch(`${backendUrl}/api/quotes?${params}`);
+    if (!response.ok) {
+      throw new Error(`Erro ao obter cotação: ${response.statusText}`);
+    }
+    return await response.json();
+  };
+
   const fetchPriceFromGeckoTerminal = async (tokenSymbol) => {
-    // Para USDT, o preço é sempre ~1 USD
-    if (tokenSymbol === 'USDT') {
-      return 1.0;
+    if (!TOKENS[tokenSymbol]) {
+      // Retorna 0 para qualquer outro token não configurado
+      return 0;
     }
-  
-    // Para PSPAY, buscamos na API da pool específica
-    if (tokenSymbol === 'PSPAY') {
-      try {
-        const poolAddress = "0xc5ff521f620d26508c238f064085f06af360ed1f";
-        const url = `https://api.geckoterminal.com/api/v2/networks/bsc/pools/${poolAddress}`;
-        
-        const response = await fetch(url); // Requisição GET (padrão)
-        if (!response.ok) {
-          throw new Error(`Erro na API GeckoTerminal: ${response.statusText}`);
-        }
-        const apiData = await response.json();
-  
-        // Pega o ID do token base na resposta da API
-        const baseTokenId = apiData.data.relationships.base_token.data.id;
-        
-        // Pega o endereço do nosso token PSPAY para verificação
-        const pspayAddress = TOKENS.PSPAY.address;
-  
-        // Confirma que o 'base_token' da API é realmente o nosso PSPAY
-        if (baseTokenId.toLowerCase().includes(pspayAddress.toLowerCase())) {
-          // Se for, pegamos o preço exato dele em USD
-          const priceUSD = parseFloat(apiData.data.attributes.base_token_price_usd);
-          
-          console.log(`Preço do PSPAY (GeckoTerminal): $${priceUSD}`);
-          return priceUSD;
-        } else {
-          // Esta mensagem de erro aparecerá se a estrutura da pool mudar no futuro
-          throw new Error("O token PSPAY não foi encontrado como o 'base_token' na pool.");
-        }
-  
-      } catch (error) {
-        console.error("Erro ao buscar preço no GeckoTerminal:", error);
-        // Mantemos um preço de fallback em caso de falha total da API
-        return 0.10; 
-      }
+    try {
+      const quote = await fetchQuote(tokenSymbol);
+      return quote.usd_per_token;
+    } catch (error) {
+      console.error("Erro ao buscar preço do token:", error);
+      // Mantemos um preço de fallback em caso de falha total da API
+      return tokenSymbol === 'USDT' ? 1.0 : 0.10;
     }
-  
-    // Retorna 0 para qualquer outro token não configurado
-    return 0;
   };
 
   const generatePaymentQR = async (amountBRL, tokenSymbol = 'PSPAY') => {
@@ -446,16 +428,14 @@ export const Web3Provider = ({ children }) => {
       const taxa = 0.02; // 2%
       const finalAmountBRL = amountBRL * (1 + taxa); // Adiciona a taxa ao valor
 
-      const usdRate = await fetchExchangeRate();
-      const tokenRate = await fetchPriceFromGeckoTerminal(tokenSymbol);
-
-      if (!usdRate || !tokenRate || tokenRate === 0) {
+      // Cotação assinada pelo backend; enviada junto com a transação
+      const quote = await fetchQuote(tokenSymbol, finalAmountBRL);
+      if (!quote || !quote.amount_token) {
         throw new Error('Não foi possível obter as taxas de câmbio necessárias.');
       }
       
-      // A partir daqui, usamos o novo valor "finalAmountBRL" para os cálculos
-      const amountUSD = finalAmountBRL / usdRate;
-      const amountToken = amountUSD / tokenRate;
+      const amountUSD = finalAmountBRL / quote.brl_per_usd;
+      const amountToken = quote.amount_token;
       const amountInWei = ethers.parseUnits(amountToken.toString(), tokenConfig.decimals);
 
       const uri = `ethereum:${tokenConfig.address}@56/transfer?address=${account}&uint256=${amountInWei}`;
@@ -464,7 +444,8 @@ export const Web3Provider = ({ children }) => {
         uri,
         amountToken,
         amountUSD,
-        amountBRL // Retorna o valor original para exibição na tela do comerciante
+        amountBRL, // Retorna o valor original para exibição na tela do comerciante
+        quote
       };
     } catch (error) {
       console.error('Erro ao gerar QR de pagamento:', error);
@@ -475,9 +456,8 @@ export const Web3Provider = ({ children }) => {
 
   const fetchExchangeRate = async () => {
     try {
-      const response = await fetch('https://openexchangerates.org/api/latest.json?app_id=b72524c6a1204affb3aac6c0c657aca5');
-      const data = await response.json();
-      return data.rates.BRL; 
+      const quote = await fetchQuote('USDT');
+      return quote.brl_per_usd;
     } catch (error) {
       console.error('Erro ao buscar taxa de câmbio:', error);
       return 5.0; // Fallback BRL rate
@@ -0,0 +1,93 @@
+import { useEffect, useRef } from "react";
+import axios from "axios";
+
+const RECONNECT_DELAY = 3000;
+
+// Recebe eventos de pagamento do comerciante em tempo real:
+// WebSocket em /api/ws/merchant, com SSE (/api/events/merchant) como alternativa.
+// Cada conexão usa um ticket de uso único (POST /api/events/ticket) em vez do
+// token na URL; o ticket é pedido pelo axios, que renova o token se ele expirou.
+export function usePaymentEvents(onEvent, enabled = true) {
+  const handlerRef = useRef(onEvent);
+  handlerRef.current = onEvent;
+
+  useEffect(() => {
+    if (!enabled) return undefined;
+
+    const backendUrl = process.env.REACT_APP_BACKEND_URL || window.location.origin;
+    let socket = null;
+    let source = null;
+    let retryTimer = null;
+    let closed = false;
+    let useSSE = typeof WebSocket === "undefined";
+
+    const dispatch = (event) => {
+      if (event && event.type !== "ping") handlerRef.current(event);
+    };
+
+    const reconnect = () => {
+      if (!closed) retryTimer = setTimeout(connect, RECONNECT_DELAY);
+    };
+
+    const openSSE = (query) => {
+      source = new EventSource(`${backendUrl}/api/events/merchant?${query}`);
+      ["payment_received", "payment_status"].forEach((type) => {
+        source.addEventListener(type, (message) => dispatch(JSON.parse(message.data)));
+      });
+      // O ticket já foi usado: em vez da reconexão automática do EventSource, pede outro
+      source.onerror = () => {
+        source.close();
+        reconnect();
+      };
+    };
+
+    const openWebSocket = (query) => {
+      const wsUrl = backendUrl.replace(/^http/, "ws");
+      let opened = false;
+      socket = new WebSocket(`${wsUrl}/api/ws/merchant?${query}`);
+      socket.onopen = () => {
+        opened = true;
+      };
+      socket.onmessage = (message) => dispatch(JSON.parse(message.data));
+      socket.onclose = (event) => {
+        if (closed) return;
+        if (!opened && event.code !== 1008) {
+          // WebSocket bloqueado (proxy, rede corporativa): usa SSE
+          useSSE = true;
+          connect();
+        } else {
+          // Sessão expirada (1008) ou worker reiniciando (1012): novo ticket
+          reconnect();
+        }
+      };
+    };
+
+    async function connect() {
+      let ticket;
+      try {
+        ticket = (await axios.post("/events/ticket")).data.ticket;
+      } catch (error) {
+        // Sem sessão válida (o refresh também falhou): não tenta de novo
+        if (error.response?.status === 401 || error.response?.status === 403) return;
+        reconnect();
+        return;
+      }
+      if (closed) return;
+      const query = `ticket=${encodeURIComponent(ticket)}`;
+      if (useSSE) {
+        openSSE(query);
+      } else {
+        openWebSocket(query);
+      }
+    }
+
+    connect();
+
+    return () => {
+      closed = true;
+      clearTimeout(retryTimer);
+      if (socket) socket.close();
+      if (source) source.close();
+    };
+  }, [enabled]);
+}
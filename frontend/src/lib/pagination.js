@@ -0,0 +1,20 @@
+import axios from 'axios';
+
+// Largest page the API serves (MAX_PAGE_SIZE in backend/pagination.py)
+const PAGE_SIZE = 1000;
+
+// List endpoints answer one page at a time, newest first; the X-Next-Cursor
+// header points at the next page and is absent on the last one
+export async function fetchAllPages(url, config = {}) {
+  const items = [];
+  let cursor;
+  do {
+    const response = await axios.get(url, {
+      ...config,
+      params: { ...config.params, limit: PAGE_SIZE, cursor },
+    });
+    items.push(...response.data);
+    cursor = response.headers['x-next-cursor'];
+  } while (cursor);
+  return items;
+}
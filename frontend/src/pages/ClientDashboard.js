@@ -1,4 +1,5 @@
 import React, { useState, useEffect } from 'react';
+import { fetchAllPages } from '../lib/pagination';
 import { Link } from 'react-router-dom';
 import { useAuth } from '../contexts/AuthContext';
 import { useWeb3 } from '../contexts/Web3Context';
@@ -62,16 +63,8 @@ const ClientDashboard = () => {
       
       setIsLoadingHistory(true);
       try {
-        const headers = { 'Authorization': `Bearer ${token}` };
-        // Seu backend já retorna as transações do usuário logado neste endpoint
-        const response = await fetch('/api/transactions', { headers });
-        const data = await response.json();
-
-        if (response.ok) {
-          setUserTransactions(data);
-        } else {
-          throw new Error(data.detail || "Erro ao buscar histórico");
-        }
+        // Instância compartilhada do axios (via fetchAllPages): envia o token atual e o renova quando expira
+        setUserTransactions(await fetchAllPages('/transactions'));
       } catch (error) {
         console.error("Erro ao carregar histórico:", error);
         toast.error("Não foi possível carregar seu histórico.");
@@ -0,0 +1,137 @@
+import asyncio
+import time
+
+import pytest
+
+from auth_tokens import AuthTokens, InvalidToken
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+class Clock:
+    def __init__(self):
+        # jose checks exp against the real time
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+def test_refresh_tokens_rotate_and_a_reused_one_revokes_the_family():
+    tokens = AuthTokens(mongomock_motor.AsyncMongoMockClient()["paycoin_test"], {"k1": "secret"})
+
+    async def run():
+        first = await tokens.issue("u1", "client")
+        session = await tokens.rotate(first["refresh_token"])
+        second = await tokens.issue(session["user_id"], "client", session["family"])
+        other = await tokens.issue("u1", "client")  # another device
+        with pytest.raises(InvalidToken):
+            await tokens.rotate(first["refresh_token"])  # replayed
+        with pytest.raises(InvalidToken):
+            await tokens.rotate(second["refresh_token"])
+        return session, await tokens.rotate(other["refresh_token"])
+
+    session, other_session = asyncio.run(run())
+    assert session["user_id"] == "u1"
+    assert other_session["family"] != session["family"]
+    assert tokens.stats()["reused"] == 1
+
+
+def test_revocation_reaches_other_workers_after_the_refresh_interval():
+    db = mongomock_motor.AsyncMongoMockClient()["paycoin_test"]
+    clock = Clock()
+    worker_a = AuthTokens(db, {"k1": "secret"}, clock=clock)
+    worker_b = AuthTokens(db, {"k1": "secret"}, clock=clock)
+
+    async def run():
+        token = worker_a.access_token("u1", "merchant")
+        claims = await worker_b.verify(token)
+        clock.now += 1
+        await worker_a.revoke_user("u1")
+        with pytest.raises(InvalidToken):
+            await worker_a.verify(token)
+        still_cached = await worker_b.verify(token)
+        clock.now += worker_b.revocations.refresh_interval
+        with pytest.raises(InvalidToken):
+            await worker_b.verify(token)
+        clock.now += 1
+        await worker_b.verify(worker_b.access_token("u2", "client"))
+        return claims, still_cached
+
+    claims, still_cached = asyncio.run(run())
+    assert claims["user_type"] == "merchant" and still_cached["sub"] == "u1"
+
+
+def test_tokens_signed_with_a_retired_key_stop_verifying():
+    db = mongomock_motor.AsyncMongoMockClient()["paycoin_test"]
+    old = AuthTokens(db, {"2024": "old-secret"})
+    rotated = AuthTokens(db, {"2025": "new-secret", "2024": "old-secret"})
+    retired = AuthTokens(db, {"2025": "new-secret"})
+
+    async def run():
+        token = old.access_token("u1", "client")
+        assert (await rotated.verify(token))["sub"] == "u1"
+        assert (await retired.verify(rotated.access_token("u1", "client")))["sub"] == "u1"
+        with pytest.raises(InvalidToken):
+            await retired.verify(token)
+
+    asyncio.run(run())
+
+
+def test_event_tickets_work_once_and_carry_the_token_lifetime():
+    clock = Clock()
+    tokens = AuthTokens(mongomock_motor.AsyncMongoMockClient()["paycoin_test"], {"k1": "secret"},
+                        access_ttl=60, ticket_ttl=30, clock=clock)
+
+    async def run():
+        claims = await tokens.verify(tokens.access_token("m1", "merchant"))
+        ticket = (await tokens.issue_ticket(claims))["ticket"]
+        redeemed = await tokens.redeem_ticket(ticket)
+        with pytest.raises(InvalidToken):
+            await tokens.redeem_ticket(ticket)  # single use
+
+        stale = (await tokens.issue_ticket(claims))["ticket"]
+        clock.now += 31
+        with pytest.raises(InvalidToken):
+            await tokens.redeem_ticket(stale)
+
+        await tokens.check(redeemed)
+        clock.now += 30  # the access token behind the ticket expires
+        with pytest.raises(InvalidToken):
+            await tokens.check(redeemed)
+        return redeemed
+
+    redeemed = asyncio.run(run())
+    assert redeemed["sub"] == "m1" and redeemed["user_type"] == "merchant"
+    assert tokens.stats()["tickets"] == 2
+
+
+def test_revoking_the_user_ends_ticket_sessions():
+    tokens = AuthTokens(mongomock_motor.AsyncMongoMockClient()["paycoin_test"], {"k1": "secret"})
+
+    async def run():
+        claims = await tokens.verify(tokens.access_token("m1", "merchant"))
+        redeemed = await tokens.redeem_ticket((await tokens.issue_ticket(claims))["ticket"])
+        await tokens.revoke_user("m1")
+        with pytest.raises(InvalidToken):
+            await tokens.check(redeemed)
+
+    asyncio.run(run())
+
+
+def test_refresh_tokens_rotate_and_a_reused_one_ends_the_session(http, register):
+    tokens = register("ana@example.com")
+
+    rotated = http.post("/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert rotated.status_code == 200
+    rotated = rotated.json()
+    assert rotated["refresh_token"] != tokens["refresh_token"]
+    assert http.get("/api/user/profile", headers={"Authorization": f"Bearer {rotated['access_token']}"}).status_code == 200
+
+    # Replaying the spent token (a stolen copy) revokes the whole family
+    assert http.post("/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]}).status_code == 401
+    assert http.post("/api/auth/refresh", json={"refresh_token": rotated["refresh_token"]}).status_code == 401
+
+    again = http.post("/api/auth/login", json={"email": "ana@example.com", "password": "secret"}).json()
+    assert http.post("/api/auth/logout", json={"refresh_token": again["refresh_token"]}).status_code == 200
+    assert http.post("/api/auth/refresh", json={"refresh_token": again["refresh_token"]}).status_code == 401
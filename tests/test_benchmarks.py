@@ -0,0 +1,30 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+pytest.importorskip("httpx")
+
+API_BENCH = Path(__file__).resolve().parent.parent / "benchmarks" / "api_bench.py"
+
+
+def test_api_bench_runs_every_scenario_against_mongomock(tmp_path):
+    output = tmp_path / "result.json"
+    # A subprocess: api_bench sets DB_NAME and RATE_LIMIT_ENABLED before importing server
+    subprocess.run(
+        [sys.executable, str(API_BENCH), "run", "--mock", "--requests", "4", "--concurrency", "2",
+         "--sessions", "2", "--output", str(output)],
+        check=True, capture_output=True, timeout=120, env={**os.environ, "BCRYPT_ROUNDS": "4"},
+    )
+
+    result = json.loads(output.read_text())
+    assert result["target"] == "in-process (mongomock)"
+    for name, scenario in result["scenarios"].items():
+        assert scenario["count"] == 4 and scenario["errors"] == {}, name
+    assert set(result["scenarios"]) == {
+        "login", "profile", "stores", "products", "search", "transactions", "create_transaction", "analytics",
+    }
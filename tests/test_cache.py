@@ -0,0 +1,65 @@
+import time
+
+from jose import jwt
+
+import server
+from cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl=5, clock=clock)
+    cache.set("a", 1)
+    assert cache.get("a") == 1 and "a" in cache
+    clock.now = 5
+    assert "a" not in cache
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_pop_invalidates():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    assert cache.pop("a") == 1
+    assert cache.get("a") is None
+    assert cache.pop("missing") is None
+
+
+def test_tokens_without_a_user_type_claim_use_the_principal_cache(app, http, register):
+    merchant = register("loja@example.com", "merchant")
+    # Issued before user_type was a claim: no kid, no user_type
+    legacy = jwt.encode({"sub": merchant["user_id"], "exp": int(time.time()) + 600}, server.SECRET_KEY, algorithm="HS256")
+    legacy = {"headers": {"Authorization": f"Bearer {legacy}"}}
+    cache = app.state.services.user_cache
+
+    for _ in range(3):
+        assert http.get("/api/analytics/dashboard", headers=legacy["headers"]).status_code == 200
+    assert (cache.stats()["misses"], cache.stats()["hits"]) == (1, 2)
+
+    # Tokens that carry user_type never touch the cache
+    assert http.get("/api/analytics/dashboard", headers=merchant["headers"]).status_code == 200
+    assert cache.stats()["hits"] == 2
+
+    assert http.post("/api/user/deactivate", headers=legacy["headers"]).status_code == 200
+    assert http.get("/api/user/profile", headers=legacy["headers"]).status_code == 401
+    assert http.get("/api/user/profile", headers=merchant["headers"]).status_code == 401
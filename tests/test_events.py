@@ -0,0 +1,135 @@
+import asyncio
+import json
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+import server
+from events import ChangeStreamBroker, LocalBroker, format_sse, merchant_channel
+
+
+def test_local_broker_fans_out_per_channel():
+    broker = LocalBroker()
+
+    async def run():
+        first = broker.subscribe(merchant_channel("m1"))
+        second = broker.subscribe(merchant_channel("m1"))
+        other = broker.subscribe(merchant_channel("m2"))
+        await broker.publish(merchant_channel("m1"), {"type": "payment_received", "n": 1})
+        received = [await first.get(0.1), await second.get(0.1), await other.get(0.01)]
+        first.close()
+        second.close()
+        other.close()
+        return received
+
+    received = asyncio.run(run())
+    assert received[:2] == [{"type": "payment_received", "n": 1}] * 2
+    assert received[2] is None
+    assert broker.stats()["subscribers"] == 0
+    assert broker.stats()["delivered"] == 2
+
+
+def test_slow_subscriber_drops_oldest_events():
+    broker = LocalBroker()
+
+    async def run():
+        with broker.subscribe("c") as subscription:
+            subscription.queue = asyncio.Queue(maxsize=2)
+            for n in range(5):
+                await broker.publish("c", {"n": n})
+            return [await subscription.get(0.1), await subscription.get(0.1)], subscription.dropped
+
+    events, dropped = asyncio.run(run())
+    assert events == [{"n": 3}, {"n": 4}]
+    assert dropped == 3
+
+
+def test_change_stream_broker_writes_a_batch_in_one_insert(monkeypatch):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    broker = ChangeStreamBroker(mongomock_motor.AsyncMongoMockClient()["paycoin_test"])
+
+    async def one_at_a_time(*args, **kwargs):
+        raise AssertionError("published one event per insert")
+
+    monkeypatch.setattr(type(broker.collection), "insert_one", one_at_a_time)
+    events = [(merchant_channel(f"m{n % 2}"), {"type": "payment_received", "n": n}) for n in range(3)]
+    asyncio.run(broker.publish_many(events))
+
+    stored = asyncio.run(broker.collection.find({}, {"_id": 0, "channel": 1, "event": 1}).to_list(None))
+    assert [(doc["channel"], doc["event"]) for doc in stored] == events
+    assert broker.stats()["published"] == 3
+
+
+def test_batch_ingestion_publishes_every_payment_together(app, http, monkeypatch, register):
+    published = []
+
+    async def publish(channel, event):
+        raise AssertionError("published one event at a time")
+
+    async def publish_many(events):
+        published.append(events)
+
+    monkeypatch.setattr(app.state.services.event_broker, "publish", publish)
+    monkeypatch.setattr(app.state.services.event_broker, "publish_many", publish_many)
+    merchant = register("loja@example.com", "merchant")
+    client = register("cliente@example.com")
+
+    items = [{"to_user_id": merchant["user_id"], "amount": float(n), "token_type": "USDT"} for n in range(1, 4)]
+    assert http.post("/api/transactions/batch", headers=client["headers"], json=items).json()["created"] == 3
+    [events] = published
+    assert [channel for channel, _ in events] == [merchant_channel(merchant["user_id"])] * 3
+    assert [event["transaction"]["amount"] for _, event in events] == [1.0, 2.0, 3.0]
+
+
+def test_format_sse():
+    frame = format_sse({"type": "payment_received", "transaction": {"id": "t"}})
+    event_line, data_line, *_ = frame.decode().split("\n")
+    assert event_line == "event: payment_received"
+    assert json.loads(data_line.removeprefix("data: "))["transaction"] == {"id": "t"}
+    assert frame.endswith(b"\n\n")
+
+
+def events_ticket(http, tokens):
+    response = http.post("/api/events/ticket", headers=tokens["headers"])
+    assert response.status_code == 200
+    return response.json()["ticket"]
+
+
+def test_merchant_websocket_takes_a_single_use_ticket_and_closes_when_revoked(http, monkeypatch, register):
+    monkeypatch.setattr(server, "EVENTS_HEARTBEAT", 0.05)
+    merchant = register("loja@example.com", "merchant")
+    client = register("cliente@example.com")
+    assert http.post("/api/events/ticket", headers=client["headers"]).status_code == 403
+
+    ticket = events_ticket(http, merchant)
+    with http.websocket_connect(f"/api/ws/merchant?ticket={ticket}") as ws:
+        assert ws.receive_json() == {"type": "ping"}
+        http.post("/api/transactions", headers=client["headers"], json={
+            "to_user_id": merchant["user_id"], "amount": 10.0, "token_type": "USDT",
+        })
+        while (event := ws.receive_json())["type"] == "ping":
+            pass
+        assert event["type"] == "payment_received" and event["transaction"]["amount"] == 10.0
+
+        http.post("/api/user/deactivate", headers=merchant["headers"])
+        with pytest.raises(WebSocketDisconnect) as closed:
+            while True:
+                ws.receive_json()
+        assert closed.value.code == 1008
+
+    for url in (f"/api/ws/merchant?ticket={ticket}", f"/api/ws/merchant?token={merchant['access_token']}"):
+        with pytest.raises(WebSocketDisconnect):
+            with http.websocket_connect(url) as ws:
+                ws.receive_json()
+
+
+def test_merchant_sse_ends_when_the_access_token_expires(app, http, monkeypatch, register):
+    monkeypatch.setattr(server, "EVENTS_HEARTBEAT", 0.2)
+    app.state.services.auth_tokens.access_ttl = 2
+    merchant = register("loja@example.com", "merchant")
+
+    assert http.get(f"/api/events/merchant?token={merchant['access_token']}").status_code == 401
+    with http.stream("GET", f"/api/events/merchant?ticket={events_ticket(http, merchant)}") as response:
+        assert response.status_code == 200
+        lines = [line for line in response.iter_lines() if line]
+    assert lines[0] == "retry: 3000" and ": ping" in lines
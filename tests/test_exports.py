@@ -0,0 +1,129 @@
+import asyncio
+import io
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+import pytest
+from pydantic import BaseModel
+
+from exports import ExportJobs, ExportWriter, parquet_available, stream_export
+from storage import LocalBlobStore
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+class Row(BaseModel):
+    id: str
+    amount: float
+    confirmations: Optional[int] = None
+    created_at: datetime
+
+
+def rows_collection(count: int):
+    collection = mongomock_motor.AsyncMongoMockClient()["paycoin_test"].transactions
+    start = datetime(2024, 1, 1)
+    docs = [
+        {"id": f"t{n:02}", "amount": n + 0.5, "created_at": start + timedelta(hours=n), "extra": "not exported"}
+        for n in range(count)
+    ]
+    docs[1]["confirmations"] = 12
+    asyncio.run(collection.insert_many(list(reversed(docs))))
+    return collection
+
+
+async def collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+def test_csv_is_streamed_in_chunks_oldest_first():
+    collection = rows_collection(5)
+    writer = ExportWriter(Row, "csv")
+    chunks = asyncio.run(collect(stream_export(collection, {}, writer, chunk_size=2)))
+
+    assert len(chunks) == 3
+    lines = b"".join(chunks).decode().splitlines()
+    assert lines[0] == "id,amount,confirmations,created_at"
+    assert lines[1] == "t00,0.5,,2024-01-01T00:00:00.000000"
+    assert lines[2] == "t01,1.5,12,2024-01-01T01:00:00.000000"
+    assert len(lines) == 6 and writer.rows == 5
+
+
+def test_empty_csv_export_still_has_a_header():
+    collection = rows_collection(2)
+    chunks = asyncio.run(collect(stream_export(collection, {"id": "none"}, ExportWriter(Row, "csv"))))
+    assert b"".join(chunks) == b"id,amount,confirmations,created_at\n"
+
+
+@pytest.mark.skipif(not parquet_available(), reason="pyarrow is not installed")
+def test_parquet_writes_one_row_group_per_chunk():
+    import pyarrow.parquet as pq
+
+    collection = rows_collection(5)
+    data = b"".join(asyncio.run(collect(stream_export(collection, {}, ExportWriter(Row, "parquet"), chunk_size=2))))
+
+    parquet = pq.ParquetFile(io.BytesIO(data))
+    assert parquet.num_row_groups == 3
+    table = parquet.read()
+    assert str(table.schema.field("confirmations").type) == "int64"
+    assert table.column("id").to_pylist() == ["t00", "t01", "t02", "t03", "t04"]
+    assert table.column("confirmations").to_pylist()[:2] == [None, 12]
+
+
+def test_background_job_writes_a_private_file_that_expires(tmp_path):
+    collection = rows_collection(3)
+    store = LocalBlobStore(tmp_path / "exports")
+    jobs = ExportJobs(collection.database.export_jobs, store)
+
+    async def run():
+        job = await jobs.start("u1", collection, {}, ExportWriter(Row, "csv"))
+        await jobs.drain()
+        done, chunks = await jobs.download(job["id"], "u1")
+        data = b"".join([chunk async for chunk in chunks])
+        foreign = await jobs.get(job["id"], "someone-else"), await jobs.download(job["id"], "someone-else")
+        return job, done, data, foreign
+
+    queued, done, data, foreign = asyncio.run(run())
+    assert queued["status"] == "queued"
+    assert done["status"] == "completed" and done["rows"] == 3 and "key" not in done
+    assert data.decode().splitlines()[1].startswith("t00,")
+    assert foreign == (None, None)
+    [path] = [path for path in store.root.rglob("*") if path.is_file()]
+    assert path.name == f"{done['id']}.csv"
+
+    assert asyncio.run(jobs.sweep()) == 0
+    jobs.ttl = -1
+    assert asyncio.run(jobs.sweep()) == 1 and not path.exists()
+    assert asyncio.run(jobs.download(done["id"], "u1")) is None
+
+
+def test_transaction_exports_stream_or_run_as_jobs(app, http, register, pay):
+    merchant = register("loja@example.com", "merchant")
+    client = register("cliente@example.com")
+    for amount in (10.0, 20.0):
+        pay(client, merchant, amount)
+
+    streamed = http.get("/api/transactions/export", headers=merchant["headers"])
+    assert streamed.status_code == 200 and streamed.headers["content-type"].startswith("text/csv")
+    assert "attachment" in streamed.headers["content-disposition"]
+    header, *rows = streamed.text.splitlines()
+    assert "amount" in header.split(",") and len(rows) == 2
+    empty = http.get("/api/transactions/export?from=2000-01-01&to=2000-01-02", headers=merchant["headers"])
+    assert len(empty.text.splitlines()) == 1
+
+    started = http.get("/api/transactions/export?background=true", headers=client["headers"])
+    assert started.status_code == 202
+    job_url = f"/api/transactions/export/{started.json()['id']}"
+    assert http.get(job_url, headers=merchant["headers"]).status_code == 404
+    for _ in range(100):
+        job = http.get(job_url, headers=client["headers"]).json()
+        if job["status"] in ("completed", "failed"):
+            break
+        time.sleep(0.05)
+    assert job["status"] == "completed" and job["rows"] == 2
+    assert http.get(f"{job_url}/download", headers=merchant["headers"]).status_code == 404
+    downloaded = http.get(job["download_url"], headers=client["headers"])
+    assert downloaded.status_code == 200 and downloaded.headers["cache-control"] == "private, no-store"
+    assert len(downloaded.text.splitlines()) == 3
+    # Nothing under the public /uploads mount
+    assert not any(path.is_file() for path in app.state.services.blob_store.root.rglob("*"))
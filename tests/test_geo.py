@@ -0,0 +1,45 @@
+import pytest
+
+import geo
+
+
+def test_location_for_address_uses_geojson_order():
+    assert geo.location_for_address({"latitude": -23.5, "longitude": -46.6}) == {
+        "type": "Point",
+        "coordinates": [-46.6, -23.5],
+    }
+    assert geo.location_for_address({"latitude": None, "longitude": -46.6}) is None
+    assert geo.location_for_address({"latitude": 123, "longitude": -46.6}) is None
+    assert geo.location_for_address(None) is None
+
+
+def test_box_polygon_is_closed_ring():
+    ring = geo.box_polygon(-24, -47, -23, -46)["coordinates"][0]
+    assert ring[0] == ring[-1] == [-47, -24]
+    assert len(ring) == 5
+    with pytest.raises(ValueError):
+        geo.box_polygon(-23, -47, -24, -46)
+
+
+def test_distance_cursor_round_trip():
+    cursor = geo.encode_distance_cursor(152.5, ["a", "b"])
+    assert geo.decode_distance_cursor(cursor) == (152.5, ["a", "b"])
+    with pytest.raises(ValueError):
+        geo.decode_distance_cursor("garbage")
+
+
+def test_stores_get_a_geojson_location_and_geo_queries_check_their_input(http, register):
+    merchant = register("loja@example.com", "merchant")
+    address = {"street": "Av. Paulista", "number": "1000", "city": "SP", "state": "SP", "zip_code": "01310"}
+    mapped = http.post("/api/stores", headers=merchant["headers"], json={
+        "name": "Paulista", "address": {**address, "latitude": -23.5614, "longitude": -46.6559},
+    }).json()
+    unmapped = http.post("/api/stores", headers=merchant["headers"], json={"name": "Sem mapa", "address": address}).json()
+
+    assert mapped["location"] == {"type": "Point", "coordinates": [-46.6559, -23.5614]}
+    assert unmapped["location"] is None
+
+    # mongomock has no $geoNear/$geoWithin, so only the input checks run here
+    assert http.get("/api/stores/within?min_lat=-23&min_lng=-46&max_lat=-24&max_lng=-47").status_code == 400
+    assert http.get("/api/stores/nearby?lat=-23.5&lng=-46.6&cursor=nonsense").status_code == 400
+    assert http.get("/api/stores/nearby?lat=-123.5&lng=-46.6").status_code == 422
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+import server
+from hashing import HashPoolSaturated, PasswordHasher
+
+
+def test_hash_and_verify_round_trip():
+    hasher = PasswordHasher(rounds=4, workers=2, max_queue=4)
+
+    async def run():
+        hashed = await hasher.hash("secret")
+        assert await hasher.verify_and_update("secret", hashed) == (True, None)
+        assert (await hasher.verify_and_update("wrong", hashed))[0] is False
+
+    try:
+        asyncio.run(run())
+    finally:
+        hasher.shutdown()
+    stats = hasher.stats()
+    assert stats["hash_calls"] == 1
+    assert stats["verify_calls"] == 2
+    assert stats["queue_depth"] == 0
+
+
+def test_rehash_when_cost_factor_changes():
+    old, new = PasswordHasher(rounds=4), PasswordHasher(rounds=5)
+
+    async def run():
+        hashed = await old.hash("secret")
+        valid, new_hash = await new.verify_and_update("secret", hashed)
+        assert valid
+        assert new_hash.startswith("$2b$05$")
+
+    try:
+        asyncio.run(run())
+    finally:
+        old.shutdown()
+        new.shutdown()
+    assert new.stats()["rehashes"] == 1
+
+
+def test_saturated_pool_rejects():
+    hasher = PasswordHasher(rounds=4, workers=1, max_queue=1)
+
+    async def run():
+        results = await asyncio.gather(
+            *(hasher.hash("secret") for _ in range(4)), return_exceptions=True
+        )
+        rejected = [r for r in results if isinstance(r, HashPoolSaturated)]
+        assert len(rejected) == 2
+
+    try:
+        asyncio.run(run())
+    finally:
+        hasher.shutdown()
+    assert hasher.stats()["rejected"] == 2
+
+
+def test_internal_stats_needs_the_internal_token(http, monkeypatch, register):
+    merchant = register("loja@example.com", "merchant")
+    assert http.get("/api/internal/stats", headers=merchant["headers"]).status_code == 404
+
+    monkeypatch.setattr(server, "INTERNAL_STATS_TOKEN", "s3cret")
+    assert http.get("/api/internal/stats").status_code == 401
+    assert http.get("/api/internal/stats", headers={"X-Internal-Token": "wrong"}).status_code == 401
+    stats = http.get("/api/internal/stats", headers={"X-Internal-Token": "s3cret"})
+    assert stats.status_code == 200 and stats.json()["process"]["ready"] is True
+
+
+def test_login_sheds_load_when_the_hash_pool_is_full_and_upgrades_old_hashes(app, http, monkeypatch, register):
+    hasher = server.password_hasher
+    register("ana@example.com")
+    credentials = {"email": "ana@example.com", "password": "secret"}
+
+    with monkeypatch.context() as patched:
+        patched.setattr(hasher, "_pending", hasher.workers + hasher.max_queue)
+        busy = http.post("/api/auth/login", json=credentials)
+        assert busy.status_code == 429 and busy.headers["retry-after"] == "1"
+        assert http.post("/api/auth/register", json={
+            "email": "bia@example.com", "name": "bia", "password": "secret", "user_type": "client",
+        }).status_code == 429
+
+    users = app.state.services.db.users
+    old_hash = http.portal.call(users.find_one, {"email": "ana@example.com"})["hashed_password"]
+    monkeypatch.setattr(hasher, "rounds", hasher.rounds + 1)
+    assert http.post("/api/auth/login", json=credentials).status_code == 200
+    new_hash = http.portal.call(users.find_one, {"email": "ana@example.com"})["hashed_password"]
+    assert new_hash != old_hash and http.post("/api/auth/login", json=credentials).status_code == 200
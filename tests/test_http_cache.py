@@ -0,0 +1,65 @@
+import asyncio
+
+from starlette.requests import Request
+
+from http_cache import ResponseCache, etag_matches
+
+
+def _request(query=b"", if_none_match=None):
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({"type": "http", "method": "GET", "path": "/api/stores", "query_string": query, "headers": headers})
+
+
+def test_etag_matching():
+    assert etag_matches('"a", "b"', '"b"')
+    assert etag_matches('W/"b"', '"b"')
+    assert etag_matches("*", '"b"')
+    assert not etag_matches(None, '"b"')
+    assert not etag_matches('"a"', '"b"')
+
+
+def test_cached_until_invalidated_and_misses_are_coalesced():
+    cache = ResponseCache(maxsize=10, ttl=60)
+    calls = []
+
+    async def produce():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return b'[{"n": %d}]' % len(calls), {"X-Next-Cursor": "c"}
+
+    async def run():
+        first, second = await asyncio.gather(
+            cache.respond(_request(), "stores", produce),
+            cache.respond(_request(), "stores", produce),
+        )
+        assert len(calls) == 1
+        assert first.body == second.body
+        assert first.headers["x-next-cursor"] == "c"
+        assert first.headers["cache-control"] == "private, no-cache"
+
+        revalidated = await cache.respond(_request(if_none_match=first.headers["etag"]), "stores", produce)
+        assert revalidated.status_code == 304
+
+        cache.invalidate("stores")
+        fresh = await cache.respond(_request(if_none_match=first.headers["etag"]), "stores", produce)
+        assert fresh.status_code == 200
+        assert fresh.headers["etag"] != first.headers["etag"]
+        assert len(calls) == 2
+
+    asyncio.run(run())
+
+
+def test_catalog_revalidates_with_etags(http, register):
+    merchant = register("loja@example.com", "merchant")
+    first = http.get("/api/stores")
+    assert first.status_code == 200 and first.json() == []
+    assert first.headers["cache-control"] == "private, no-cache"
+
+    etag = first.headers["etag"]
+    assert http.get("/api/stores", headers={"If-None-Match": etag}).status_code == 304
+
+    http.post("/api/stores", headers=merchant["headers"], json={
+        "name": "Café", "address": {"street": "Rua A", "number": "1", "city": "SP", "state": "SP", "zip_code": "01000"},
+    })
+    changed = http.get("/api/stores", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and [store["name"] for store in changed.json()] == ["Café"]
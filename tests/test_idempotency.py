@@ -0,0 +1,109 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from idempotency import IdempotencyConflict, IdempotencyStore, fingerprint
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def _collection():
+    return mongomock_motor.AsyncMongoMockClient()["paycoin_test"].idempotency_keys
+
+
+def test_concurrent_duplicates_run_the_handler_once():
+    collection = _collection()
+    store = IdempotencyStore(poll_interval=0.01)
+    calls = []
+
+    async def produce():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return {"id": f"tx-{len(calls)}"}
+
+    async def run():
+        results = await asyncio.gather(*(
+            store.run(collection, "transactions:u1", "key-1", fingerprint({"amount": 10}), produce)
+            for _ in range(5)
+        ))
+        # A second process has an empty front cache and reads the stored record
+        other = IdempotencyStore()
+        from_db = await other.run(collection, "transactions:u1", "key-1", fingerprint({"amount": 10}), produce)
+        return results, from_db
+
+    results, from_db = asyncio.run(run())
+    assert len(calls) == 1
+    assert [body for body, _ in results] == [{"id": "tx-1"}] * 5
+    assert sorted(replayed for _, replayed in results) == [False, True, True, True, True]
+    assert from_db == ({"id": "tx-1"}, True)
+    assert store.stats()["locks"] == 0
+
+
+def test_key_reused_with_other_body_or_by_failed_request():
+    collection = _collection()
+    store = IdempotencyStore()
+
+    async def fail():
+        raise RuntimeError("insert failed")
+
+    async def succeed():
+        return {"id": "tx"}
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await store.run(collection, "s", "k", "fp", fail)
+        # The failed attempt left nothing behind, so the retry runs
+        assert await store.run(collection, "s", "k", "fp", succeed) == ({"id": "tx"}, False)
+        with pytest.raises(IdempotencyConflict) as excinfo:
+            await store.run(collection, "s", "k", "other-fp", succeed)
+        assert excinfo.value.status_code == 422
+
+    asyncio.run(run())
+
+
+def test_in_progress_record_of_another_process():
+    collection = _collection()
+    store = IdempotencyStore(wait=0.05, lock_timeout=60, poll_interval=0.01)
+
+    async def succeed():
+        return {"id": "tx"}
+
+    async def run():
+        await collection.insert_one(
+            {"_id": "s:busy", "fingerprint": "fp", "state": "in_progress", "created_at": datetime.utcnow()}
+        )
+        with pytest.raises(IdempotencyConflict) as excinfo:
+            await store.run(collection, "s", "busy", "fp", succeed)
+        assert excinfo.value.status_code == 409
+
+        # Abandoned by a crashed worker: taken over
+        await collection.insert_one({
+            "_id": "s:stale", "fingerprint": "fp", "state": "in_progress",
+            "created_at": datetime.utcnow() - timedelta(minutes=5),
+        })
+        assert await store.run(collection, "s", "stale", "fp", succeed) == ({"id": "tx"}, False)
+
+    asyncio.run(run())
+
+
+def test_idempotency_key_replays_the_first_response(app, http, register):
+    merchant = register("loja@example.com", "merchant")
+    client = register("cliente@example.com")
+    headers = {**client["headers"], "Idempotency-Key": "pedido-1"}
+    payment = {"to_user_id": merchant["user_id"], "amount": 10.0, "token_type": "USDT"}
+
+    first = http.post("/api/transactions", headers=headers, json=payment)
+    assert first.status_code == 200 and "idempotent-replayed" not in first.headers
+    retried = http.post("/api/transactions", headers=headers, json=payment)
+    assert retried.status_code == 200 and retried.headers["idempotent-replayed"] == "true"
+    assert retried.json() == first.json()
+    assert http.portal.call(app.state.services.db.transactions.count_documents, {}) == 1
+
+    changed = http.post("/api/transactions", headers=headers, json={**payment, "amount": 20.0})
+    assert changed.status_code == 422
+    # Keys are per user
+    other = register("outro@example.com")
+    assert http.post(
+        "/api/transactions", headers={**other["headers"], "Idempotency-Key": "pedido-1"}, json=payment
+    ).json()["id"] != first.json()["id"]
@@ -0,0 +1,90 @@
+import io
+import time
+
+import pytest
+
+import server
+from images import render_variants, select_variant
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def _jpeg(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def test_render_variants_downscales_without_upscaling():
+    variants = render_variants(_jpeg(800, 400), [64, 256, 1024], "webp")
+    assert sorted(variants) == [64, 256]
+    with Image.open(io.BytesIO(variants[256])) as image:
+        assert image.format == "WEBP"
+        assert image.size == (256, 128)
+
+
+def test_select_variant_picks_smallest_adequate():
+    variants = {"64": "/s.webp", "256": "/m.webp", "1024": "/l.webp"}
+    assert select_variant("/orig.jpg", variants, 100) == "/m.webp"
+    assert select_variant("/orig.jpg", variants, 64) == "/s.webp"
+    assert select_variant("/orig.jpg", variants, 2000) == "/orig.jpg"
+    assert select_variant("/orig.jpg", None, 100) == "/orig.jpg"
+    assert select_variant("/orig.jpg", variants, None) == "/orig.jpg"
+
+
+def test_product_images_get_resized_variants(http, register, upload):
+    merchant = register("loja@example.com", "merchant")
+    image_url = upload(merchant, _jpeg(800, 600)).json()["image_url"]
+    http.post("/api/products", headers=merchant["headers"], json={"name": "Caneca", "price": 25.0, "image": image_url})
+
+    for _ in range(200):
+        [product] = http.get("/api/products").json()
+        if product["image_variants"]:
+            break
+        time.sleep(0.05)
+    variants = product["image_variants"]
+    # No upscaling: the 800px original has no 1024px variant
+    assert sorted(variants, key=int) == ["64", "256"] and all(url.endswith(".webp") for url in variants.values())
+
+    assert http.get("/api/products?image_size=100").json()[0]["image"] == variants["256"]
+    assert http.get("/api/products?image_size=2000").json()[0]["image"] == image_url
+
+
+def _wait_for(fetch, ready):
+    for _ in range(200):
+        value = fetch()
+        if ready(value):
+            return value
+        time.sleep(0.05)
+    raise AssertionError("image variants were not recorded")
+
+
+def test_store_and_profile_images_get_resized_variants(http, register, upload):
+    merchant = register("loja@example.com", "merchant")
+    small, large = (upload(merchant, _jpeg(*size)).json()["image_url"] for size in ((100, 80), (800, 600)))
+    http.post("/api/stores", headers=merchant["headers"], json={
+        "name": "Vitrine", "images": [small, large],
+        "address": {"street": "Rua A", "number": "1", "city": "SP", "state": "SP", "zip_code": "01000"},
+    })
+
+    [store] = _wait_for(lambda: http.get("/api/stores").json(), lambda stores: all(stores[0]["image_variants"]))
+    first, second = store["image_variants"]
+    assert sorted(first, key=int) == ["64"] and sorted(second, key=int) == ["64", "256"]
+    assert http.get("/api/stores?image_size=200").json()[0]["images"] == [small, second["256"]]
+    assert http.get("/api/stores?image_size=32").json()[0]["images"] == [first["64"], second["64"]]
+
+    profile = _wait_for(
+        lambda: http.get("/api/user/profile", headers=merchant["headers"]).json(),
+        lambda user: user["profile_image_variants"],
+    )
+    assert profile["profile_image_url"] == large
+    resized = http.get("/api/user/profile?image_size=100", headers=merchant["headers"]).json()
+    assert resized["profile_image_url"] == profile["profile_image_variants"]["256"]
+
+
+def test_store_images_without_variants_are_kept():
+    transform = server.store_images_for(50)
+    assert transform({"images": ["a", "b"], "image_variants": [{"64": "a64"}]})["images"] == ["a64", "b"]
+    assert transform({"images": ["a"], "image_variants": None})["images"] == ["a"]
+    assert transform({"images": None})["images"] is None
+    assert server.store_images_for(None) is None
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from pymongo.errors import DuplicateKeyError
+
+from indexes import HANDLER_QUERIES, INDEXES, ensure_indexes, find_collscans
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def test_ensure_indexes_creates_every_index():
+    db = mongomock_motor.AsyncMongoMockClient()["paycoin_test"]
+
+    async def run():
+        await ensure_indexes(db)
+        for collection, models in INDEXES.items():
+            info = await db[collection].index_information()
+            for model in models:
+                assert model.document["name"] in info
+
+        await db.users.insert_one({"id": "1", "email": "a@example.com"})
+        with pytest.raises(DuplicateKeyError):
+            await db.users.insert_one({"id": "2", "email": "a@example.com"})
+
+    asyncio.run(run())
+
+
+def test_every_handler_query_targets_an_indexed_collection():
+    for query in HANDLER_QUERIES:
+        assert query["collection"] in INDEXES
+
+
+def test_find_collscans_detects_nested_scans():
+    indexed = {
+        "queryPlanner": {
+            "winningPlan": {
+                "stage": "SUBPLAN",
+                "inputStage": {
+                    "stage": "OR",
+                    "inputStages": [
+                        {"stage": "IXSCAN", "indexName": "from_user_id_created_at"},
+                        {"stage": "IXSCAN", "indexName": "to_user_id_created_at"},
+                    ],
+                },
+            },
+            "rejectedPlans": [{"stage": "COLLSCAN"}],
+        }
+    }
+    assert find_collscans(indexed) == []
+
+    aggregate = {
+        "stages": [
+            {"$cursor": {"queryPlanner": {"winningPlan": {"stage": "COLLSCAN", "direction": "forward"}}}},
+            {"$group": {}},
+        ]
+    }
+    assert len(find_collscans(aggregate)) == 1
+
+
+def test_startup_creates_the_indexes(app):
+    with TestClient(app) as http:
+        for collection, models in INDEXES.items():
+            info = http.portal.call(app.state.services.db[collection].index_information)
+            assert {model.document["name"] for model in models} <= set(info), collection
@@ -0,0 +1,150 @@
+import asyncio
+import json
+
+import pytest
+from starlette.requests import Request
+
+from indexes import INDEXES
+from ingest import BatchRejected, duplicate_of, insert_batch, read_items
+from quotes import CachedSource
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def _request(body: bytes, content_type: str, chunk_size: int = 7):
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)] or [b""]
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+        for i, chunk in enumerate(chunks)
+    ]
+
+    async def receive():
+        return messages.pop(0)
+
+    headers = [(b"content-type", content_type.encode())]
+    return Request({"type": "http", "method": "POST", "path": "/", "headers": headers}, receive)
+
+
+def test_read_items_json_and_ndjson():
+    items = [{"amount": i} for i in range(3)]
+
+    async def run():
+        as_json = await read_items(_request(json.dumps(items).encode(), "application/json"))
+        ndjson = b"\n".join(json.dumps(item).encode() for item in items) + b"\n\n"
+        as_ndjson = await read_items(_request(ndjson, "application/x-ndjson"))
+        return as_json, as_ndjson
+
+    assert asyncio.run(run()) == (items, items)
+
+
+@pytest.mark.parametrize("body,content_type,status", [
+    (b'{"amount": 1}', "application/json", 400),
+    (b"[]", "application/json", 400),
+    (b'{"amount": 1}\nnot json\n', "application/x-ndjson", 400),
+    (b'{"a": 1}\n' * 5, "application/x-ndjson", 413),
+    (json.dumps([{"a": 1}] * 5).encode(), "application/json", 413),
+])
+def test_read_items_rejects(body, content_type, status):
+    with pytest.raises(BatchRejected) as excinfo:
+        asyncio.run(read_items(_request(body, content_type), max_items=4))
+    assert excinfo.value.status_code == status
+
+
+def _doc(n, key):
+    return {"id": f"tx-{n}", "from_user_id": "client", "idempotency_key": key}
+
+
+def test_insert_batch_reports_duplicates_per_position():
+    db = mongomock_motor.AsyncMongoMockClient()["paycoin_test"]
+
+    # mongomock ignores partialFilterExpression, so only this index is built
+    # and every document carries a key
+    index = next(i for i in INDEXES["transactions"] if i.document["name"] == "from_user_id_idempotency_key_unique")
+
+    async def run():
+        await db.transactions.create_indexes([index])
+        await insert_batch(db.transactions, [_doc(0, "k0")])
+        unordered = await insert_batch(db.transactions, [_doc(1, "k1"), _doc(2, "k0"), _doc(3, "k3"), _doc(4, "k1")])
+        ordered = await insert_batch(db.transactions, [_doc(5, "k5"), _doc(6, "k0"), _doc(7, "k7")], ordered=True)
+        return unordered, ordered, await db.transactions.count_documents({})
+
+    unordered, ordered, count = asyncio.run(run())
+    assert sorted(unordered) == [1, 3]
+    assert all(duplicate_of(error, "idempotency_key") for error in unordered.values())
+    assert sorted(ordered) == [1, 2] and ordered[2]["code"] is None
+    assert count == 4
+
+
+@pytest.mark.mongo
+def test_duplicate_keys_are_told_apart(app, http, register, pay):
+    sources = app.state.services.quote_service.sources
+    sources["usd_brl"] = CachedSource("usd_brl", lambda: 5.0, ttl=300)
+    sources["pspay_usd"] = CachedSource("pspay_usd", lambda: 0.5, ttl=30)
+    merchant = register("loja@example.com", "merchant")
+    client = register("cliente@example.com")
+    transactions = app.state.services.db.transactions
+
+    payment = {"to_user_id": merchant["user_id"], "amount": 10.0, "token_type": "USDT", "idempotency_key": "k1"}
+    first = http.post("/api/transactions", headers=client["headers"], json=payment)
+    assert first.status_code == 200
+    retried = http.post("/api/transactions", headers=client["headers"], json=payment)
+    assert retried.status_code == 200 and retried.json()["id"] == first.json()["id"]
+    reused = http.post("/api/transactions", headers=client["headers"], json={**payment, "amount": 20.0})
+    assert reused.status_code == 409 and "idempotency key" in reused.json()["detail"]
+
+    quote = http.get("/api/quotes?token=PSPAY&amount_brl=25").json()
+    pay(client, merchant, 10.0, "PSPAY", quote=quote)
+    spent = http.post("/api/transactions", headers=client["headers"], json={
+        "to_user_id": merchant["user_id"], "amount": 10.0, "token_type": "PSPAY", "quote": quote,
+    })
+    assert spent.status_code == 409 and spent.json()["detail"] == "Quote already used"
+
+    # The unique indexes are partial: payments with neither key never collide
+    pay(client, merchant, 1.0)
+    pay(client, merchant, 2.0)
+    assert http.portal.call(transactions.count_documents, {}) == 4
+
+
+def _batch_item(merchant, key, **fields):
+    return {"to_user_id": merchant["user_id"], "amount": 10.0, "token_type": "USDT", "idempotency_key": key, **fields}
+
+
+def test_batch_ingestion_reports_each_item(app, http, register):
+    merchant = register("loja@example.com", "merchant")
+    client = register("cliente@example.com")
+    items = [_batch_item(merchant, "k1"), _batch_item(merchant, "k2"), _batch_item(merchant, "k3", amount="ten")]
+
+    body = "\n".join(json.dumps(item) for item in items)
+    first = http.post(
+        "/api/transactions/batch", headers={**client["headers"], "Content-Type": "application/x-ndjson"}, content=body
+    ).json()
+    assert (first["created"], first["duplicate"], first["error"]) == (2, 0, 1)
+    assert first["results"][2]["status"] == "error" and "amount" in first["results"][2]["error"]
+
+    retried = http.post("/api/transactions/batch?ordered=true", headers=client["headers"], json=[
+        _batch_item(merchant, "k4", amount="ten"), _batch_item(merchant, "k5"),
+    ]).json()
+    assert [result["status"] for result in retried["results"]] == ["error", "skipped"]
+    assert http.portal.call(app.state.services.db.transactions.count_documents, {}) == 2
+    dashboard = http.get("/api/analytics/dashboard", headers=merchant["headers"]).json()
+    assert dashboard["transaction_count"] == 2
+
+    assert http.post("/api/transactions/batch", headers=client["headers"], content=b"[{").status_code == 400
+
+
+@pytest.mark.mongo
+def test_batch_duplicates_point_at_the_stored_transaction(app, http, register):
+    merchant = register("loja@example.com", "merchant")
+    client = register("cliente@example.com")
+    items = [_batch_item(merchant, "k1"), _batch_item(merchant, "k2"), _batch_item(merchant, "k1")]
+
+    first = http.post("/api/transactions/batch", headers=client["headers"], json=items).json()
+    assert (first["created"], first["duplicate"], first["error"]) == (2, 1, 0)
+    created = {result["index"]: result for result in first["results"]}
+    assert created[2] == {"index": 2, "status": "duplicate", "id": created[0]["id"]}
+
+    # Resending the whole batch creates nothing
+    again = http.post("/api/transactions/batch", headers=client["headers"], json=items).json()
+    assert [result["status"] for result in again["results"]] == ["duplicate"] * 3
+    assert [result["id"] for result in again["results"]] == [created[0]["id"], created[1]["id"], created[0]["id"]]
+    assert http.portal.call(app.state.services.db.transactions.count_documents, {}) == 2
@@ -0,0 +1,80 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from lifecycle import Lifecycle
+from leases import Lease
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def test_lease_has_one_holder_until_it_expires():
+    collection = mongomock_motor.AsyncMongoMockClient()["paycoin_test"].leases
+    first = Lease(collection, "settlement", timedelta(seconds=30), owner="a")
+    second = Lease(collection, "settlement", timedelta(seconds=30), owner="b")
+    start = datetime(2024, 1, 1)
+
+    async def run():
+        return [
+            await first.acquire(start),
+            await second.acquire(start + timedelta(seconds=10)),
+            await first.acquire(start + timedelta(seconds=20)),   # renewed until 50s
+            await second.acquire(start + timedelta(seconds=45)),
+            await second.acquire(start + timedelta(seconds=51)),  # first stopped renewing
+            await first.acquire(start + timedelta(seconds=52)),
+        ]
+
+    assert asyncio.run(run()) == [True, False, True, False, True, False]
+
+
+def test_drain_wakes_waiters_and_fails_readiness():
+    lifecycle = Lifecycle()
+    assert not lifecycle.ready
+    lifecycle.started = True
+    assert lifecycle.ready
+
+    async def run():
+        waiter = asyncio.create_task(lifecycle.wait_draining())
+        await asyncio.sleep(0)
+        lifecycle.begin_drain()
+        await asyncio.wait_for(waiter, 1)
+
+    asyncio.run(run())
+    assert lifecycle.draining and not lifecycle.ready
+
+
+def test_each_app_uses_the_client_it_was_built_with(http, register):
+    tokens = register("ana@example.com")
+    assert http.get("/api/user/profile", headers=tokens["headers"]).json()["email"] == "ana@example.com"
+    assert http.get("/api/health/ready").json()["status"] == "healthy"
+
+    with TestClient(server.create_app(mongomock_motor.AsyncMongoMockClient())) as other:
+        # Same signing key, so the token is valid, but the user is not in this database
+        assert other.get("/api/user/profile", headers=tokens["headers"]).status_code == 404
+        assert other.post(
+            "/api/auth/login", json={"email": "ana@example.com", "password": "secret"}
+        ).status_code == 401
+
+
+def test_readiness_follows_startup_mongo_and_drain(app, monkeypatch):
+    assert TestClient(app).get("/api/health/ready").json()["status"] == "starting"
+
+    with TestClient(app) as http:
+        assert http.get("/api/health").status_code == 200
+
+        async def unreachable(db):
+            raise OSError("connection refused")
+
+        with monkeypatch.context() as patched:
+            patched.setattr(server, "ping", unreachable)
+            down = http.get("/api/health/ready")
+            assert down.status_code == 503 and down.json()["mongo"] == "unreachable"
+            assert http.get("/api/health/live").status_code == 200
+
+        http.portal.call(app.state.services.lifecycle.begin_drain)
+        draining = http.get("/api/health/ready")
+        assert draining.status_code == 503 and draining.json()["status"] == "draining"
+        assert http.get("/api/health/live").json()["status"] == "alive"
@@ -0,0 +1,88 @@
+import json
+import logging
+from types import SimpleNamespace
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import logs
+import metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("t_seconds", "Test.", ("op",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, ("a",))
+
+    lines = histogram.render()
+    assert 't_seconds_bucket{op="a",le="0.1"} 2' in lines
+    assert 't_seconds_bucket{op="a",le="1.0"} 3' in lines
+    assert 't_seconds_bucket{op="a",le="+Inf"} 4' in lines
+    assert 't_seconds_count{op="a"} 4' in lines
+
+
+def test_mongo_listener_times_commands_by_collection():
+    listener = metrics.MongoCommandMetrics()
+    labels = ("find", "metrics_probe")
+    before = metrics.MONGO_DURATION.count(labels)
+    listener.started(SimpleNamespace(command_name="find", command={"find": "metrics_probe"}, request_id=1))
+    listener.succeeded(SimpleNamespace(command_name="find", request_id=1, duration_micros=1500))
+    listener.started(SimpleNamespace(command_name="getMore", command={"getMore": 7, "collection": "metrics_probe"},
+                                     request_id=2))
+    listener.failed(SimpleNamespace(command_name="getMore", request_id=2, duration_micros=900))
+
+    assert metrics.MONGO_DURATION.count(labels) == before + 1
+    assert metrics.MONGO_COMMANDS.value(("getMore", "metrics_probe", "error")) >= 1
+
+
+def test_middleware_labels_route_templates_and_sets_request_id():
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: str):
+        return {"id": item_id}
+
+    app.add_middleware(metrics.InstrumentationMiddleware)
+    client = TestClient(app)
+
+    first = client.get("/items/1")
+    client.get("/items/2")
+    client.get("/nothing-here")
+    replayed = client.get("/items/3", headers={"X-Request-ID": "lb-42"})
+
+    assert len(first.headers["x-request-id"]) == 32
+    assert replayed.headers["x-request-id"] == "lb-42"
+    assert metrics.HTTP_REQUESTS.value(("GET", "/items/{item_id}", "200")) == 3
+    assert metrics.HTTP_REQUESTS.value(("GET", "unmatched", "404")) >= 1
+    assert metrics.HTTP_IN_FLIGHT.value(("GET", "/items/{item_id}")) == 0
+
+
+def test_json_log_lines_carry_the_request_id():
+    record = logging.LogRecord("paycoin", logging.INFO, __file__, 1, "hello %s", ("world",), None)
+    token = logs.request_id.set("req-1")
+    try:
+        logs.RequestIdFilter().filter(record)
+    finally:
+        logs.request_id.reset(token)
+
+    entry = json.loads(logs.JsonFormatter().format(record))
+    assert entry["message"] == "hello world"
+    assert entry["request_id"] == "req-1"
+    assert entry["level"] == "info"
+
+
+def test_metrics_label_requests_by_route_template(http, register):
+    def sample(name):
+        text = http.get("/metrics").text
+        return next((float(line.rsplit(" ", 1)[1]) for line in text.splitlines() if line.startswith(name)), 0.0)
+
+    requests = 'http_requests_total{method="GET",route="/api/transactions/export/{job_id}",status="404"}'
+    hashes = 'bcrypt_duration_seconds_count{operation="hash"}'
+    before = sample(requests), sample(hashes)
+
+    tokens = register("ana@example.com")
+    for job_id in ("a", "b"):
+        assert http.get(f"/api/transactions/export/{job_id}", headers=tokens["headers"]).status_code == 404
+
+    assert (sample(requests), sample(hashes)) == (before[0] + 2, before[1] + 1)
+    assert http.get("/metrics").headers["content-type"].startswith("text/plain")
@@ -0,0 +1,93 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+from typing import Optional
+
+import pytest
+
+from pagination import decode_cursor, encode_cursor, fetch_page, stream_ndjson
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2024, 5, 1, 12, 30, 15, 123000)
+    cursor = encode_cursor({"created_at": created_at, "id": "abc"})
+    assert decode_cursor(cursor) == (created_at, "abc")
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+
+def test_pages_cover_every_row_once_even_with_equal_timestamps():
+    collection = mongomock_motor.AsyncMongoMockClient()["paycoin_test"]["products"]
+    base = datetime(2024, 1, 1)
+    docs = [
+        {"id": f"p{i:02d}", "created_at": base + timedelta(minutes=i // 3), "is_active": True}
+        for i in range(10)
+    ]
+
+    async def run():
+        await collection.insert_many([dict(d) for d in docs])
+        seen, cursor = [], None
+        while True:
+            page, cursor = await fetch_page(collection, {"is_active": True}, 4, cursor)
+            seen.extend(doc["id"] for doc in page)
+            if cursor is None:
+                break
+        streamed = [line async for line in stream_ndjson(collection, {"is_active": True})]
+        return seen, streamed
+
+    seen, streamed = asyncio.run(run())
+    expected = [d["id"] for d in sorted(docs, key=lambda d: (d["created_at"], d["id"]), reverse=True)]
+    assert seen == expected
+    assert len(streamed) == 10
+    assert b'"_id"' not in streamed[0]
+
+
+def test_stream_fills_defaults_like_the_json_pages():
+    from pydantic import BaseModel
+
+    from serialization import RowEncoder
+
+    class Row(BaseModel):
+        id: str
+        created_at: datetime
+        currency: str = "BRL"
+        note: Optional[str] = None
+
+    collection = mongomock_motor.AsyncMongoMockClient()["paycoin_test"]["products"]
+    encoder = RowEncoder(Row, validate=False)
+
+    async def run():
+        await collection.insert_many([
+            {"id": "old", "created_at": datetime(2024, 1, 1), "search_terms": ["x"]},  # before currency/note
+            {"id": "new", "created_at": datetime(2024, 1, 2), "currency": "USDT", "note": "n"},
+        ])
+        page, _ = await fetch_page(collection, {}, 10, None, encoder.projection)
+        streamed = [line async for line in stream_ndjson(collection, {}, encoder=encoder)]
+        return page, streamed
+
+    page, streamed = asyncio.run(run())
+    assert [json.loads(line) for line in streamed] == json.loads(encoder.encode(page))
+    assert json.loads(streamed[1]) == {"id": "old", "created_at": "2024-01-01T00:00:00", "currency": "BRL", "note": None}
+
+
+def test_list_endpoints_page_by_cursor_and_stream_ndjson(http, register, pay):
+    merchant = register("loja@example.com", "merchant")
+    client = register("cliente@example.com")
+    ids = [pay(client, merchant, float(amount))["id"] for amount in range(1, 6)]
+
+    seen, url = [], "/api/transactions?limit=2"
+    while url:
+        page = http.get(url, headers=client["headers"])
+        assert page.status_code == 200 and len(page.json()) <= 2
+        seen += [row["id"] for row in page.json()]
+        cursor = page.headers.get("x-next-cursor")
+        url = cursor and f"/api/transactions?limit=2&cursor={cursor}"
+    # Newest first; payments within the same millisecond fall back to id order
+    assert len(seen) == 5 and set(seen) == set(ids)
+
+    streamed = http.get("/api/transactions?stream=true", headers=merchant["headers"])
+    assert streamed.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line)["id"] for line in streamed.text.splitlines()] == seen
+    assert http.get("/api/transactions?cursor=nonsense", headers=client["headers"]).status_code == 400
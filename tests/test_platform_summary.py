@@ -0,0 +1,87 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+
+import platform_summary
+from platform_summary import PARTIALS, SUMMARIES, partition_bounds, run
+
+mongomock = pytest.importorskip("mongomock")
+
+START = datetime(2024, 3, 1)
+END = START + timedelta(days=7)
+
+
+def seeded_db():
+    db = mongomock.MongoClient()["paycoin_test"]
+    rows = [
+        ("m1", START - timedelta(days=40), 10.0, "USDT", "completed"),  # churned before the range
+        ("m2", START - timedelta(days=25), 10.0, "USDT", "completed"),  # churns on START + 5 days
+        ("m3", START + timedelta(hours=3), 5.0, "PSPAY", "completed"),
+        ("m3", START + timedelta(hours=5), 7.0, "USDT", "pending"),
+        ("m4", START + timedelta(days=1), 100.0, "USDT", "failed"),
+        ("m5", START + timedelta(days=2), 20.0, "USDT", "completed"),
+        ("m5", START + timedelta(days=2, hours=1), 1.0, "PSPAY", "completed"),
+        ("m6", START + timedelta(days=8), 50.0, "USDT", "completed"),  # after the range
+    ]
+    db.transactions.insert_many([
+        {"id": f"t{n}", "from_user_id": "c1", "to_user_id": merchant, "amount": amount,
+         "token_type": token, "status": status, "created_at": at}
+        for n, (merchant, at, amount, token, status) in enumerate(rows)
+    ])
+    return db
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = seeded_db()
+    # Thread pool stand-in for the process pool: the workers share this database
+    monkeypatch.setattr(platform_summary, "_worker_db", db)
+    return db
+
+
+def test_partitions_cover_every_merchant_without_overlap(db):
+    assert partition_bounds(db.transactions, 2) == [(None, "m3"), ("m3", "m4"), ("m4", "m6"), ("m6", None)]
+    assert partition_bounds(db.transactions, 100) == [(None, None)]
+
+
+def test_daily_summaries_add_the_partitions_up(db):
+    states = []
+    with ThreadPoolExecutor(2) as executor:
+        job = run(db, executor, START, END, churn_days=30, rows_per_partition=2, progress=lambda s: states.append(dict(s)))
+
+    assert job["status"] == "completed" and job["days"] == 7 and len(job["partitions"]) == 4
+    assert [state["done"] for state in states] == [0, 1, 2, 3, 4]
+    days = {doc["_id"]: doc for doc in db[SUMMARIES].find()}
+    assert sorted(days) == [START + timedelta(days=n) for n in range(7)]
+
+    first = days[START]
+    assert first["gmv"] == {"PSPAY": 5.0, "USDT": 7.0}
+    assert first["transaction_count"] == 2 and first["token_mix"] == {"PSPAY": 0.5, "USDT": 0.5}
+    assert first["active_merchants"] == 1
+    assert days[START + timedelta(days=1)]["transaction_count"] == 0  # failed transactions are left out
+    assert days[START + timedelta(days=2)]["transactions"] == {"PSPAY": 1, "USDT": 1}
+    assert [days[day]["churned_merchants"] for day in sorted(days)] == [0, 0, 0, 0, 0, 1, 0]
+    assert db[PARTIALS].count_documents({}) == 0
+
+
+def test_interrupted_run_resumes_from_its_checkpoints(db, monkeypatch):
+    summarize = platform_summary.summarize_partition
+    def flaky(partition, *args):
+        if partition == ("m3", "m4"):
+            raise RuntimeError("worker died")
+        return summarize(partition, *args)
+
+    monkeypatch.setattr(platform_summary, "summarize_partition", flaky)
+    with ThreadPoolExecutor(1) as executor, pytest.raises(RuntimeError):
+        run(db, executor, START, END, rows_per_partition=2)
+    assert db[PARTIALS].count_documents({}) >= 1
+
+    monkeypatch.setattr(platform_summary, "summarize_partition", summarize)
+    states = []
+    with ThreadPoolExecutor(1) as executor:
+        job = run(db, executor, START, END, rows_per_partition=2, progress=lambda s: states.append(dict(s)))
+
+    assert states[0]["resumed"] >= 1
+    assert states[-1]["done"] == 4 and job["status"] == "completed"
+    assert db[SUMMARIES].find_one({"_id": START})["gmv"] == {"PSPAY": 5.0, "USDT": 7.0}
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import quotes
+from quotes import CachedSource, InvalidQuote, QuoteService, QuoteUnavailable
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _counting_fetch(value):
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.02)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    return fetch, calls
+
+
+def test_concurrent_misses_share_one_upstream_call():
+    fetch, calls = _counting_fetch(5.0)
+    source = CachedSource("usd_brl", fetch, ttl=10, clock=FakeClock())
+
+    async def run():
+        results = await asyncio.gather(*(source.get() for _ in range(20)))
+        assert results == [(5.0, False)] * 20
+        assert await source.get() == (5.0, False)
+
+    asyncio.run(run())
+    assert len(calls) == 1
+    assert source.stats()["hits"] == 1
+
+
+def test_stale_value_served_while_refreshing():
+    clock = FakeClock()
+    fetch, calls = _counting_fetch(5.0)
+    source = CachedSource("usd_brl", fetch, ttl=10, max_stale=60, clock=clock)
+
+    async def run():
+        await source.get()
+        clock.now = 30
+        source.fetch = lambda: 6.0
+        assert await source.get() == (5.0, True)
+        await source._inflight
+        assert await source.get() == (6.0, False)
+
+        clock.now = 200
+        source.fetch, _ = _counting_fetch(RuntimeError("down"))
+        with pytest.raises(QuoteUnavailable):
+            await source.get()
+
+    asyncio.run(run())
+
+
+def test_quote_round_trip_and_tampering():
+    sources = {
+        "pspay_usd": CachedSource("pspay_usd", lambda: 0.5, ttl=30),
+        "usd_brl": CachedSource("usd_brl", lambda: 5.0, ttl=300),
+    }
+    service = QuoteService("secret", sources)
+    quote = asyncio.run(service.quote("PSPAY", amount_brl=25.0))
+
+    assert quote["brl_per_token"] == 2.5
+    assert quote["amount_token"] == 10.0
+    assert service.verify(quote)["quote_id"] == quote["quote_id"]
+
+    with pytest.raises(InvalidQuote):
+        service.verify({**quote, "amount_token": 100.0})
+    with pytest.raises(InvalidQuote):
+        QuoteService("other-secret", sources).verify(quote)
+    with pytest.raises(InvalidQuote):
+        service.verify(quote, now=datetime.utcnow() + timedelta(hours=1))
+
+    usdt = asyncio.run(service.quote("USDT"))
+    assert usdt["usd_per_token"] == 1.0 and usdt["brl_per_token"] == 5.0
+
+
+@pytest.fixture
+def upstream():
+    """Local HTTP server standing in for the price APIs: path -> (status, body, delay)."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from threading import Thread
+
+    routes = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, body, delay = routes[self.path]
+            time.sleep(delay)
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield routes, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_sources_fetch_over_http_and_fail_on_timeouts_and_5xx(upstream, monkeypatch):
+    routes, base = upstream
+    monkeypatch.setattr(quotes, "QUOTE_HTTP_TIMEOUT", 0.2)
+    pool = {"data": {
+        "relationships": {"base_token": {"data": {"id": f"bsc_{quotes.PSPAY_TOKEN_ADDRESS}"}}},
+        "attributes": {"base_token_price_usd": "0.5"},
+    }}
+    routes.update({
+        "/pool": (200, pool, 0),
+        "/fx": (200, {"amount": 1.0, "base": "USD", "rates": {"BRL": 5.0}}, 0),  # Frankfurter's shape
+        "/slow": (200, {"rates": {"BRL": 5.0}}, 1.0),
+        "/down": (502, {"error": "bad gateway"}, 0),
+    })
+    assert quotes.fetch_pspay_usd(f"{base}/pool") == 0.5
+    assert quotes.fetch_usd_brl(f"{base}/fx") == 5.0
+
+    def service(fx_path):
+        return QuoteService("secret", {
+            "pspay_usd": CachedSource("pspay_usd", lambda: quotes.fetch_pspay_usd(f"{base}/pool"), ttl=30),
+            "usd_brl": CachedSource("usd_brl", lambda: quotes.fetch_usd_brl(f"{base}{fx_path}"), ttl=300),
+        })
+
+    assert asyncio.run(service("/fx").quote("PSPAY"))["brl_per_token"] == 2.5
+    for path in ("/slow", "/down"):
+        with pytest.raises(QuoteUnavailable):
+            asyncio.run(service(path).quote("PSPAY"))
+
+
+
+def test_signed_quotes_are_checked_when_paying(app, http, register):
+    def down():
+        raise OSError("price API down")
+
+    sources = app.state.services.quote_service.sources
+    sources["usd_brl"] = CachedSource("usd_brl", down, ttl=300)
+    unavailable = http.get("/api/quotes?token=USDT")
+    assert unavailable.status_code == 503 and unavailable.headers["retry-after"] == "5"
+
+    sources["usd_brl"] = CachedSource("usd_brl", lambda: 5.0, ttl=300)
+    sources["pspay_usd"] = CachedSource("pspay_usd", lambda: 0.5, ttl=30)
+    quote = http.get("/api/quotes?token=PSPAY&amount_brl=25").json()
+    assert quote["brl_per_token"] == 2.5 and quote["amount_token"] == 10.0
+
+    merchant = register("loja@example.com", "merchant")
+    client = register("cliente@example.com")
+    payment = {"to_user_id": merchant["user_id"], "amount": 10.0, "token_type": "PSPAY", "quote": quote}
+    paid = http.post("/api/transactions", headers=client["headers"], json=payment)
+    assert paid.status_code == 200 and paid.json()["quote_id"] == quote["quote_id"]
+
+    for changed in ({**payment, "amount": 12.0}, {**payment, "quote": {**quote, "brl_per_token": 1.0}}):
+        assert http.post("/api/transactions", headers=client["headers"], json=changed).status_code == 400
+
+
+def test_a_bare_quote_id_or_settlement_fields_are_dropped(http, register, pay):
+    merchant = register("loja@example.com", "merchant")
+    client = register("cliente@example.com")
+    forged = {
+        "quote_id": "not-a-signed-quote", "status": "completed", "confirmations": 99,
+        "block_number": 1, "settled_at": "2024-01-01T00:00:00",
+    }
+
+    paid = pay(client, merchant, 10.0, "PSPAY", **forged)
+    assert paid["quote_id"] is None and paid["status"] == "pending"
+    assert (paid["confirmations"], paid["block_number"], paid["settled_at"]) == (None, None, None)
+
+    batch = http.post("/api/transactions/batch", headers=client["headers"], json=[
+        {"to_user_id": merchant["user_id"], "amount": 5.0, "token_type": "PSPAY", **forged},
+    ]).json()
+    assert batch["created"] == 1
+    [stored] = [row for row in http.get("/api/transactions", headers=client["headers"]).json() if row["amount"] == 5.0]
+    assert stored["quote_id"] is None and stored["status"] == "pending"
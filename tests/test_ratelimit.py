@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+from pymongo.errors import ServerSelectionTimeoutError
+
+import metrics
+from ratelimit import Limit, MemoryBackend, MongoBackend, RateLimited, RateLimiter
+
+
+def memory_backend():
+    return MemoryBackend()
+
+
+def mongo_backend():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    return MongoBackend(mongomock_motor.AsyncMongoMockClient()["paycoin_test"].rate_limits)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.parametrize("make_backend", [memory_backend, mongo_backend])
+def test_bucket_allows_a_burst_then_refills_evenly(make_backend):
+    backend = make_backend()
+    limit = Limit.parse("3/60")  # a token every 20s
+    start = 1_700_000_000.0
+
+    async def run():
+        burst = [await backend.take("auth:ip:1.2.3.4", limit, start) for _ in range(4)]
+        other = await backend.take("auth:ip:5.6.7.8", limit, start)
+        refilled = [
+            await backend.take("auth:ip:1.2.3.4", limit, start + 19),
+            await backend.take("auth:ip:1.2.3.4", limit, start + 20),
+            await backend.take("auth:ip:1.2.3.4", limit, start + 20),
+        ]
+        idle = [await backend.take("auth:ip:1.2.3.4", limit, start + 500) for _ in range(3)]
+        return burst, other, refilled, idle
+
+    burst, other, refilled, idle = asyncio.run(run())
+    assert burst[:3] == [0, 0, 0] and burst[3] == pytest.approx(20)
+    assert other == 0
+    assert refilled[0] == pytest.approx(1) and refilled[1] == 0 and refilled[2] == pytest.approx(20)
+    # An idle bucket is full again, not over-full
+    assert idle == [0, 0, 0]
+
+
+def test_limiter_raises_with_retry_after_and_counts_rejections():
+    clock = Clock()
+    limiter = RateLimiter(MemoryBackend(), {"auth": Limit(2, 10), "catalog": None}, enabled=True, clock=clock)
+    before = metrics.RATE_LIMIT_REJECTIONS.value(("auth", "ip"))
+
+    async def run():
+        await limiter.check("auth", "ip", "1.2.3.4")
+        await limiter.check("auth", "ip", "1.2.3.4")
+        with pytest.raises(RateLimited) as rejected:
+            await limiter.check("auth", "ip", "1.2.3.4")
+        for _ in range(10):
+            await limiter.check("catalog", "ip", "1.2.3.4")  # class switched off
+        clock.now += 5
+        await limiter.check("auth", "ip", "1.2.3.4")
+        return rejected.value
+
+    assert asyncio.run(run()).retry_after == 5
+    assert metrics.RATE_LIMIT_REJECTIONS.value(("auth", "ip")) == before + 1
+    assert limiter.stats()["rejected"] == 1
+    assert limiter.stats()["limits"] == {"auth": "2/10", "catalog": "off"}
+
+
+def test_limiter_lets_requests_through_when_the_backend_fails():
+    class Unreachable:
+        name = "mongo"
+
+        async def take(self, key, limit, now):
+            raise ServerSelectionTimeoutError("no servers")
+
+        def stats(self):
+            return {}
+
+    limiter = RateLimiter(Unreachable(), {"auth": Limit(1, 60)}, enabled=True)
+    asyncio.run(limiter.check("auth", "ip", "1.2.3.4"))
+    assert limiter.stats()["errors"] == 1
+
+
+def test_rate_limited_requests_get_429_with_retry_after(app, http):
+    limiter = app.state.services.rate_limiter
+    limiter.enabled = True
+    limiter.limits = {**limiter.limits, "catalog": Limit(2, 60)}
+
+    assert [http.get("/api/stores").status_code for _ in range(2)] == [200, 200]
+    limited = http.get("/api/stores")
+    assert limited.status_code == 429
+    assert 1 <= int(limited.headers["retry-after"]) <= 30
@@ -0,0 +1,145 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from reports import InvalidReport, ReportService, build_report, load_transactions
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+MONDAY = datetime(2024, 1, 1)
+
+
+def transaction(n, amount, token="USDT", customer="c1", at=MONDAY, status="completed", merchant="m1"):
+    return {
+        "id": f"t{n:03}", "from_user_id": customer, "to_user_id": merchant, "amount": amount,
+        "token_type": token, "status": status, "created_at": at,
+    }
+
+
+def transactions_collection(docs):
+    collection = mongomock_motor.AsyncMongoMockClient()["paycoin_test"].transactions
+    asyncio.run(collection.insert_many(docs))
+    return collection
+
+
+def load(collection, merchant_id="m1", **kwargs):
+    return asyncio.run(load_transactions(collection, merchant_id, **kwargs))
+
+
+def test_report_is_split_by_token_with_percentiles_and_rankings():
+    docs = [transaction(n, float(n), customer=f"c{n % 3}", at=MONDAY + timedelta(minutes=n)) for n in range(1, 101)]
+    docs += [
+        transaction(101, 7.0, token="PSPAY", customer="c9", at=MONDAY + timedelta(days=2, hours=15)),
+        transaction(102, 1000.0, status="failed"),
+        transaction(103, 1000.0, merchant="m2"),
+    ]
+    frame, truncated = load(transactions_collection(docs), batch_size=16)
+    report = build_report(frame, top=2)
+
+    assert not truncated and report["transaction_count"] == 101
+    usdt = report["by_token"]["USDT"]
+    assert usdt["revenue"] == 5050 and usdt["count"] == 100 and usdt["min"] == 1 and usdt["max"] == 100
+    assert usdt["percentiles"]["p50"] == pytest.approx(50.5)
+    assert usdt["percentiles"]["p99"] == pytest.approx(99.01)
+    assert report["by_token"]["PSPAY"]["revenue"] == 7
+
+    assert [c["user_id"] for c in report["top_customers"]["USDT"]] == ["c1", "c0"]
+    assert report["top_customers"]["USDT"][0] == {"user_id": "c1", "revenue": 1717.0, "count": 34}
+    assert report["top_customers"]["PSPAY"] == [{"user_id": "c9", "revenue": 7.0, "count": 1}]
+
+    heatmap = report["heatmap"]
+    assert heatmap["count"][0][0] == 59 and heatmap["count"][0][1] == 41
+    assert heatmap["count"][2][15] == 1 and heatmap["revenue"]["PSPAY"][2][15] == 7
+    assert heatmap["revenue"]["USDT"][2][15] == 0
+
+
+def test_buckets_use_the_requested_timezone():
+    docs = [
+        transaction(1, 10.0, at=datetime(2024, 2, 1, 1, 0)),  # still January in Sao Paulo (UTC-3)
+        transaction(2, 5.0, token="PSPAY", at=datetime(2024, 2, 1, 12, 0)),
+    ]
+    frame, _ = load(transactions_collection(docs))
+
+    utc = build_report(frame, granularity="month")
+    assert [bucket["bucket"] for bucket in utc["series"]] == [datetime(2024, 2, 1)]
+
+    local = build_report(frame, granularity="month", timezone="America/Sao_Paulo")
+    assert [bucket["bucket"] for bucket in local["series"]] == [datetime(2024, 1, 1), datetime(2024, 2, 1)]
+    assert local["series"][0]["by_token"] == {"PSPAY": {"revenue": 0.0, "count": 0}, "USDT": {"revenue": 10.0, "count": 1}}
+    # Wednesday 22:00 local time
+    assert local["heatmap"]["count"][2][22] == 1
+
+
+def test_load_keeps_the_newest_rows_up_to_the_limit():
+    docs = [transaction(n, 1.0, at=MONDAY + timedelta(hours=n)) for n in range(5)]
+    frame, truncated = load(transactions_collection(docs), max_rows=3)
+    assert truncated and len(frame) == 3
+    assert frame["created_at"].min() == MONDAY + timedelta(hours=2)
+
+
+def test_service_memoizes_per_merchant_until_invalidated():
+    collection = transactions_collection([transaction(1, 10.0), transaction(2, 3.0, merchant="m2")])
+    service = ReportService(collection)
+
+    async def run():
+        first = await service.report("m1")
+        await collection.insert_one(transaction(3, 5.0))
+        cached = await service.report("m1")
+        other = await service.report("m2")
+        service.invalidate("m1")
+        fresh = await service.report("m1")
+        return first, cached, other, fresh
+
+    first, cached, other, fresh = asyncio.run(run())
+    assert cached is first and first["by_token"]["USDT"]["revenue"] == 10
+    assert other["by_token"]["USDT"]["revenue"] == 3
+    assert fresh["by_token"]["USDT"]["revenue"] == 15
+    assert service.stats()["computed"] == 3
+
+
+def test_service_caps_cached_reports_across_parameters():
+    collection = transactions_collection([transaction(1, 10.0), transaction(2, 3.0, merchant="m2")])
+    service = ReportService(collection, cache_size=3)
+
+    async def run():
+        for top in range(1, 6):
+            await service.report("m1", top=top)
+        await service.report("m2")
+        service.invalidate("m1")
+        return await service.report("m2"), await service.report("m1", top=5)
+
+    asyncio.run(run())
+    # Five parameter sets for m1 and one for m2 never hold more than three reports
+    assert service.stats()["size"] <= 3 and service.stats()["evictions"] == 3
+    # Invalidating m1 kept m2's report; m1 was computed again
+    assert service.stats()["hits"] == 1 and service.stats()["computed"] == 7
+    assert all(len(keys) <= 3 for keys in service._keys.values())
+
+
+def test_service_rejects_unknown_parameters():
+    service = ReportService(transactions_collection([transaction(1, 1.0)]))
+    with pytest.raises(InvalidReport):
+        asyncio.run(service.report("m1", timezone="Mars/Olympus"))
+    with pytest.raises(InvalidReport):
+        asyncio.run(service.report("m1", granularity="week"))
+
+
+def test_merchant_report_is_recomputed_after_a_new_payment(http, register, pay):
+    merchant = register("loja@example.com", "merchant")
+    client = register("cliente@example.com")
+    pay(client, merchant, 10.0)
+    pay(client, merchant, 30.0)
+    pay(client, merchant, 5.0, "PSPAY")
+
+    report = http.get("/api/analytics/report?timezone=America/Sao_Paulo", headers=merchant["headers"]).json()
+    assert report["transaction_count"] == 3 and report["timezone"] == "America/Sao_Paulo"
+    assert report["by_token"]["USDT"]["revenue"] == 40.0 and report["by_token"]["USDT"]["max"] == 30.0
+    assert report["top_customers"]["USDT"] == [{"user_id": client["user_id"], "revenue": 40.0, "count": 2}]
+
+    pay(client, merchant, 1.0, "PSPAY")
+    report = http.get("/api/analytics/report?timezone=America/Sao_Paulo", headers=merchant["headers"]).json()
+    assert report["by_token"]["PSPAY"]["count"] == 2
+
+    assert http.get("/api/analytics/report?timezone=Mars/Base", headers=merchant["headers"]).status_code == 400
+    assert http.get("/api/analytics/report", headers=client["headers"]).status_code == 403
@@ -0,0 +1,75 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import rollups
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def _tx(amount, token_type, created_at, status="pending"):
+    return {
+        "id": f"{token_type}-{amount}",
+        "from_user_id": "client",
+        "to_user_id": "merchant",
+        "amount": amount,
+        "token_type": token_type,
+        "status": status,
+        "created_at": created_at,
+    }
+
+
+def test_incremental_rollups_match_rebuild():
+    db = mongomock_motor.AsyncMongoMockClient()["paycoin_test"]
+    txs = [
+        _tx(10.0, "PSPAY", datetime(2024, 3, 1, 9, 15)),
+        _tx(30.0, "PSPAY", datetime(2024, 3, 1, 18, 40)),
+        _tx(20.0, "USDT", datetime(2024, 3, 2, 8, 5)),
+    ]
+
+    async def run():
+        for tx in txs:
+            await db.transactions.insert_one(dict(tx))
+            await rollups.record_transaction(db, tx)
+        await db.transactions.update_one({"id": txs[2]["id"]}, {"$set": {"status": "completed"}})
+        await rollups.record_status_change(db, txs[2], "pending", "completed")
+
+        incremental = await rollups.merchant_summary(db, "merchant")
+        await rollups.rebuild(db)
+        rebuilt = await rollups.merchant_summary(db, "merchant")
+        hourly = await rollups.merchant_summary(
+            db, "merchant", start=datetime(2024, 3, 1, 12), end=datetime(2024, 3, 2), granularity="hour"
+        )
+        return incremental, rebuilt, hourly
+
+    incremental, rebuilt, hourly = asyncio.run(run())
+    assert incremental["total_revenue"] == rebuilt["total_revenue"] == 60.0
+    assert incremental["by_status"] == rebuilt["by_status"] == {
+        "pending": {"revenue": 40.0, "count": 2},
+        "completed": {"revenue": 20.0, "count": 1},
+    }
+    assert [p["revenue"] for p in rebuilt["series"]] == [40.0, 20.0]
+    assert rebuilt["series"][0]["min"] == 10.0
+    assert hourly["transaction_count"] == 1
+    assert hourly["series"][0]["bucket"] == datetime(2024, 3, 1, 18)
+
+
+def test_dashboard_reads_the_rollups_written_with_each_payment(http, register, pay):
+    merchant = register("loja@example.com", "merchant")
+    client = register("cliente@example.com")
+    pay(client, merchant, 10.0)
+    pay(client, merchant, 30.0)
+    pay(client, merchant, 5.0, "PSPAY")
+
+    dashboard = http.get("/api/analytics/dashboard?granularity=month", headers=merchant["headers"]).json()
+    assert dashboard["total_revenue"] == 45.0 and dashboard["transaction_count"] == 3
+    assert dashboard["avg_transaction"] == 15.0
+    assert dashboard["by_token"] == {"USDT": {"revenue": 40.0, "count": 2}, "PSPAY": {"revenue": 5.0, "count": 1}}
+    assert dashboard["by_status"] == {"pending": {"revenue": 45.0, "count": 3}}
+    [point] = dashboard["series"]
+    assert (point["count"], point["min"], point["max"]) == (3, 5.0, 30.0)
+
+    future = http.get("/api/analytics/dashboard?start=2999-01-01T00:00:00", headers=merchant["headers"]).json()
+    assert future["transaction_count"] == 0 and future["series"] == []
+    assert http.get("/api/analytics/dashboard", headers=client["headers"]).status_code == 403
@@ -0,0 +1,84 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import search
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def test_terms_are_accent_folded_prefixes():
+    fields = search.search_fields("products", {"name": "Café Especial", "description": None, "category": "Bebidas"})
+    assert "caf" in fields["search_terms"] and "cafe" in fields["search_terms"]
+    assert "beb" in fields["search_terms"] and "beb" not in fields["search_name_terms"]
+    assert "c" not in fields["search_terms"]
+    assert search.query_terms("CAFÉ  café e") == ["cafe"]
+
+
+def _product(n, name, category, price, currency="BRL", description=None):
+    doc = {
+        "id": f"p{n}",
+        "merchant_id": "m",
+        "name": name,
+        "description": description,
+        "price": price,
+        "currency": currency,
+        "category": category,
+        "is_active": True,
+        "created_at": datetime(2024, 1, 1) + timedelta(minutes=n),
+    }
+    return {**doc, **search.search_fields("products", doc)}
+
+
+def test_search_ranks_and_counts_facets():
+    db = mongomock_motor.AsyncMongoMockClient()["paycoin_test"]
+    products = [
+        _product(1, "Camiseta azul", "Roupas", 49.9),
+        _product(2, "Calça jeans", "Roupas", 120.0, description="Combina com camiseta"),
+        _product(3, "Caneca", "Casa", 25.0, currency="USDT"),
+        _product(4, "Camiseta preta", "Roupas", 59.9),
+        {**_product(5, "Camiseta antiga", "Roupas", 10.0), "is_active": False},
+    ]
+
+    async def run():
+        await db.products.insert_many(products)
+        everything = await search.search_collection(db, "products", "cam")
+        filtered = await search.search_collection(db, "products", "cam", category="Roupas", max_price=100, limit=1)
+        browse = await search.search_collection(db, "products", None, limit=2)
+        return everything, filtered, browse
+
+    everything, filtered, browse = asyncio.run(run())
+
+    # Name hits rank above the description-only hit, newest first among equals
+    assert [p["id"] for p in everything["results"]] == ["p4", "p1", "p2"]
+    assert "search_terms" not in everything["results"][0]
+    assert everything["total"] == 3
+    assert everything["facets"]["category"] == [{"value": "Roupas", "count": 3}]
+    assert {"min": 100, "max": 500, "count": 1} in everything["facets"]["price"]
+
+    assert filtered["total"] == 2 and len(filtered["results"]) == 1
+    assert filtered["next_offset"] == 1
+
+    assert [p["id"] for p in browse["results"]] == ["p4", "p3"]
+    assert {"value": "USDT", "count": 1} in browse["facets"]["currency"]
+
+
+def test_search_finds_what_merchants_create(http, register):
+    merchant = register("loja@example.com", "merchant")
+    http.post("/api/stores", headers=merchant["headers"], json={
+        "name": "Cafeteria Central", "category": "Café",
+        "address": {"street": "Rua A", "number": "1", "city": "SP", "state": "SP", "zip_code": "01000"},
+    })
+    products = [("Café coado", 7.5, "Café"), ("Pão de queijo", 5.0, "Padaria"), ("Cafézinho", 3.0, "Café")]
+    for name, price, category in products:
+        http.post("/api/products", headers=merchant["headers"], json={"name": name, "price": price, "category": category})
+
+    found = http.get("/api/search?q=cafe").json()
+    assert sorted(product["name"] for product in found["products"]["results"]) == ["Café coado", "Cafézinho"]
+    assert [store["name"] for store in found["stores"]["results"]] == ["Cafeteria Central"]
+    assert found["products"]["facets"]["category"] == [{"value": "Café", "count": 2}]
+
+    cheap = http.get("/api/search?type=products&max_price=4").json()
+    assert list(cheap) == ["products"] and [p["name"] for p in cheap["products"]["results"]] == ["Cafézinho"]
+    assert http.get("/api/search?type=users").status_code == 422
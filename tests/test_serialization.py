@@ -0,0 +1,71 @@
+import json
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+from serialization import RowEncoder
+
+
+class Item(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    name: str
+    price: float
+    currency: str = "BRL"
+    note: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+DOCS = [
+    {"id": "a", "name": "Café", "price": 9.5, "currency": "USDT", "note": "x",
+     "created_at": datetime(2024, 1, 1, 12, 0, 0, 123000)},
+    # Stored before currency/note existed
+    {"id": "b", "name": "Pão", "price": 3, "created_at": datetime(2024, 1, 2)},
+]
+
+
+def test_fast_rows_match_the_model_output():
+    encoder = RowEncoder(Item, validate=False)
+    assert encoder.projection == {"_id": 0, "id": 1, "name": 1, "price": 1, "currency": 1, "note": 1, "created_at": 1}
+
+    rows = json.loads(encoder.encode(DOCS))
+    expected = [json.loads(Item(**doc).model_dump_json()) for doc in DOCS]
+    assert rows == expected
+    assert list(rows[1]) == list(Item.model_fields)
+    # Without validation values are not coerced (the model would write 3.0)
+    assert b'"price":3,' in encoder.encode(DOCS[1:])
+
+
+def test_validated_rows_coerce_like_the_model():
+    encoder = RowEncoder(Item, validate=True)
+    assert json.loads(encoder.encode(DOCS)) == [json.loads(Item(**doc).model_dump_json()) for doc in DOCS]
+
+
+def test_response_carries_headers():
+    response = RowEncoder(Item, validate=False).response(DOCS[:1], {"X-Next-Cursor": "abc"})
+    assert response.media_type == "application/json"
+    assert response.headers["x-next-cursor"] == "abc"
+    assert json.loads(response.body)[0]["created_at"] == "2024-01-01T12:00:00.123000"
+
+
+def test_list_rows_encode_like_the_models(app, http, register):
+    merchant = register("loja@example.com", "merchant")
+    created = http.post("/api/products", headers=merchant["headers"], json={
+        "name": "Café coado", "price": 7.5, "category": "Café",
+    }).json()
+    # Written before currency and description existed
+    http.portal.call(app.state.services.db.products.insert_one, {
+        "id": "legacy", "merchant_id": merchant["user_id"], "name": "Pão", "price": 1.0,
+        "is_active": True, "created_at": datetime(2020, 1, 1),
+    })
+
+    new, legacy = http.get("/api/products").json()
+    # Search terms and _id are stored but never sent; MongoDB keeps milliseconds
+    assert new.pop("created_at")[:23] == created.pop("created_at")[:23]
+    assert new == created
+    assert legacy == {
+        "id": "legacy", "merchant_id": merchant["user_id"], "name": "Pão", "description": None, "price": 1.0,
+        "currency": "BRL", "category": None, "image": None, "image_variants": None, "is_active": True,
+        "created_at": "2020-01-01T00:00:00",
+    }
@@ -0,0 +1,178 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import rollups
+import server
+from settlement import RpcError, SettlementWatcher, next_check_delay
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+class StubRpc:
+    """In-memory chain: receipts by hash and a head block number."""
+
+    def __init__(self, head, receipts):
+        self.head = head
+        self.receipts = receipts
+        self.batches = []
+
+    async def batch(self, calls):
+        self.batches.append(len(calls))
+        results = []
+        for method, params in calls:
+            receipt = self.receipts.get(params[0])
+            results.append(receipt if not isinstance(receipt, Exception) else RpcError(str(receipt)))
+        return results
+
+    async def block_number(self):
+        return self.head
+
+
+def _tx(tx_id, tx_hash, created_at):
+    return {
+        "id": tx_id,
+        "from_user_id": "client",
+        "to_user_id": "merchant",
+        "amount": 10.0,
+        "token_type": "PSPAY",
+        "transaction_hash": tx_hash,
+        "status": "pending",
+        "created_at": created_at,
+    }
+
+
+def test_backoff_is_capped():
+    assert next_check_delay(1, base=15, cap=600) == 30
+    assert next_check_delay(10, base=15, cap=600) == 600
+
+
+def test_pending_transactions_are_settled_in_batches():
+    db = mongomock_motor.AsyncMongoMockClient()["paycoin_test"]
+    now = datetime(2024, 3, 1, 12)
+    rpc = StubRpc(head=100, receipts={
+        "0xok": {"blockNumber": hex(80), "status": "0x1"},
+        "0xreverted": {"blockNumber": hex(80), "status": "0x0"},
+        "0xshallow": {"blockNumber": hex(98), "status": "0x1"},
+        "0xerror": Exception("node hiccup"),
+    })
+    txs = [
+        _tx("ok", "0xok", now - timedelta(minutes=5)),
+        _tx("reverted", "0xreverted", now - timedelta(minutes=5)),
+        _tx("shallow", "0xshallow", now - timedelta(minutes=5)),
+        _tx("unknown", "0xunknown", now - timedelta(minutes=5)),
+        _tx("dropped", "0xdropped", now - timedelta(days=2)),
+        _tx("error", "0xerror", now - timedelta(minutes=5)),
+        _tx("no-hash", None, now - timedelta(minutes=5)),
+    ]
+    watcher = SettlementWatcher(db, rpc, confirmations=12, batch_size=4, interval=15, timeout=timedelta(hours=24))
+
+    async def run():
+        for tx in txs:
+            await db.transactions.insert_one(dict(tx))
+            await rollups.record_transaction(db, tx)
+        checked = await watcher.run_once(now)
+        # "unknown" backs off, so an immediate second pass skips it
+        rechecked = await watcher.run_once(now + timedelta(seconds=1))
+        docs = {d["id"]: d async for d in db.transactions.find({}, {"_id": 0})}
+        summary = await rollups.merchant_summary(db, "merchant")
+        return checked, rechecked, docs, summary
+
+    checked, rechecked, docs, summary = asyncio.run(run())
+    assert checked == 6
+    assert rpc.batches[:2] == [4, 2]
+    assert rechecked == 1  # only "error" is retried right away
+    assert docs["ok"]["status"] == "completed" and docs["ok"]["confirmations"] == 21
+    assert docs["reverted"]["status"] == "failed"
+    assert docs["shallow"]["status"] == "pending" and docs["shallow"]["confirmations"] == 3
+    assert docs["unknown"]["settlement_attempts"] == 1
+    assert docs["unknown"]["settlement_next_check_at"] == now + timedelta(seconds=30)
+    assert docs["dropped"]["status"] == "failed"
+    assert docs["error"]["status"] == "pending"
+    assert docs["no-hash"]["status"] == "pending"
+    assert summary["by_status"]["completed"]["count"] == 1
+    assert summary["by_status"]["failed"]["count"] == 2
+    assert watcher.stats()["completed"] == 1
+
+
+def test_only_transactions_this_pass_moved_out_of_pending_are_announced():
+    db = mongomock_motor.AsyncMongoMockClient()["paycoin_test"]
+    now = datetime(2024, 3, 1, 12)
+    notified = []
+
+    class RacingRpc(StubRpc):
+        async def batch(self, calls):
+            # Another writer settles "raced" while the receipts are being looked up
+            await db.transactions.update_one({"id": "raced"}, {"$set": {"status": "failed"}})
+            return await super().batch(calls)
+
+    async def notify(tx):
+        notified.append(tx["id"])
+
+    rpc = RacingRpc(head=100, receipts={"0xa": {"blockNumber": hex(80), "status": "0x1"},
+                                        "0xb": {"blockNumber": hex(80), "status": "0x1"}})
+    watcher = SettlementWatcher(db, rpc, confirmations=12, interval=15, notify=notify)
+
+    async def run():
+        await db.transactions.insert_many([_tx("settled", "0xa", now), _tx("raced", "0xb", now)])
+        await watcher.run_once(now)
+        return {d["id"]: d["status"] async for d in db.transactions.find({}, {"_id": 0})}
+
+    statuses = asyncio.run(run())
+    assert statuses == {"settled": "completed", "raced": "failed"}
+    assert notified == ["settled"]
+    assert watcher.stats()["completed"] == 1
+
+
+def test_pass_holds_the_lease_and_stops_when_it_is_taken_over():
+    db = mongomock_motor.AsyncMongoMockClient()["paycoin_test"]
+    now = datetime(2024, 3, 1, 12)
+
+    class TakeoverRpc(StubRpc):
+        async def batch(self, calls):
+            # The lease expires during the first batch and another watcher takes it
+            await db.leases.update_one(
+                {"_id": "settlement"},
+                {"$set": {"owner": "other", "expires_at": datetime.utcnow() + timedelta(minutes=5)}},
+            )
+            return await super().batch(calls)
+
+    receipts = {f"0x{n}": {"blockNumber": hex(80), "status": "0x1"} for n in range(4)}
+    watcher = SettlementWatcher(db, TakeoverRpc(head=100, receipts=receipts), batch_size=2, concurrency=1)
+    idle = SettlementWatcher(db, StubRpc(head=100, receipts=receipts))
+
+    async def run():
+        await db.transactions.insert_many([_tx(f"t{n}", f"0x{n}", now) for n in range(4)])
+        await watcher.run_once(now)
+        skipped = await idle.run_once(now)
+        return skipped, await db.transactions.count_documents({"status": "completed"})
+
+    skipped, completed = asyncio.run(run())
+    assert completed == 2  # the second batch was not written
+    assert watcher.stats()["lease_lost"] == 1 and not watcher.leader
+    assert skipped == 0 and idle.rpc.batches == []  # "other" still holds the lease
+
+
+def test_settled_payments_show_up_in_lists_events_and_the_dashboard(app, http, monkeypatch, register, pay):
+    monkeypatch.setattr(server, "EVENTS_HEARTBEAT", 0.05)
+    merchant = register("loja@example.com", "merchant")
+    client = register("cliente@example.com")
+    payment = pay(client, merchant, 10.0, transaction_hash="0xabc")
+    watcher = app.state.services.settlement_watcher
+    http.portal.call(watcher.stop)  # passes run by hand below
+    watcher.rpc = StubRpc(head=100, receipts={"0xabc": {"blockNumber": hex(80), "status": "0x1"}})
+    watcher.confirmations = 12
+
+    ticket = http.post("/api/events/ticket", headers=merchant["headers"]).json()["ticket"]
+    with http.websocket_connect(f"/api/ws/merchant?ticket={ticket}") as ws:
+        assert http.portal.call(watcher.run_once) == 1
+        while (event := ws.receive_json())["type"] == "ping":
+            pass
+    assert event["type"] == "payment_status" and event["transaction"]["status"] == "completed"
+
+    [listed] = http.get("/api/transactions", headers=client["headers"]).json()
+    assert listed["id"] == payment["id"]
+    assert (listed["status"], listed["confirmations"], listed["block_number"]) == ("completed", 21, 80)
+    dashboard = http.get("/api/analytics/dashboard", headers=merchant["headers"]).json()
+    assert dashboard["by_status"] == {"completed": {"revenue": 10.0, "count": 1}}
@@ -0,0 +1,160 @@
+import asyncio
+import base64
+import io
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import storage
+from storage import LocalBlobStore, S3BlobStore, migrate_profile_pictures, parse_data_uri
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 32
+
+
+class FakeS3Client:
+    """Stand-in for the boto3 client: keeps objects in a dict."""
+
+    def __init__(self):
+        self.objects = {}
+        self.headers = {}
+        self.modified = {}
+
+    def head_object(self, Bucket, Key):
+        from botocore.exceptions import ClientError
+
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[(Bucket, Key)] = Body
+        self.headers[(Bucket, Key)] = kwargs
+        self.modified[(Bucket, Key)] = datetime.now(timezone.utc)
+
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def get_paginator(self, operation):
+        client = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                yield {"Contents": [
+                    {"Key": key, "LastModified": client.modified[(bucket, key)]}
+                    for bucket, key in client.objects if bucket == Bucket and key.startswith(Prefix)
+                ]}
+
+        return Paginator()
+
+    def delete_objects(self, Bucket, Delete):
+        for item in Delete["Objects"]:
+            del self.objects[(Bucket, item["Key"])]
+
+
+def test_local_store_deduplicates_by_content(tmp_path):
+    store = LocalBlobStore(tmp_path)
+
+    async def run():
+        first = await store.put(PNG, "image/png")
+        second = await store.put(PNG, "image/png")
+        other = await store.put(PNG + b"x", "image/png")
+        return first, second, other
+
+    first, second, other = asyncio.run(run())
+    assert first == second != other
+    assert first.startswith("/uploads/") and first.endswith(".png")
+    assert len([p for p in tmp_path.rglob("*") if p.is_file()]) == 2
+
+
+def test_s3_store_writes_each_blob_once():
+    pytest.importorskip("botocore")
+    client = FakeS3Client()
+    store = S3BlobStore("bucket", client=client, public_url="https://cdn.example.com")
+
+    async def run():
+        return [await store.put(PNG, "image/png") for _ in range(2)]
+
+    urls = asyncio.run(run())
+    assert urls[0] == urls[1]
+    assert urls[0].startswith("https://cdn.example.com/uploads/")
+    assert len(client.objects) == 1
+
+
+def test_s3_export_store_is_private_and_expires(monkeypatch):
+    pytest.importorskip("boto3")
+    client = FakeS3Client()
+    monkeypatch.setattr("boto3.client", lambda *args, **kwargs: client)
+    monkeypatch.setattr(storage, "BLOB_STORE", "s3")
+    monkeypatch.setattr(storage, "S3_BUCKET", "bucket")
+    store = storage.create_export_store()
+
+    async def run():
+        await store.write("job.csv", b"a,b\n", "text/csv")
+        data = b"".join([chunk async for chunk in store.iter_chunks("job.csv")])
+        kept = await store.delete_older_than(datetime.utcnow() - timedelta(hours=1))
+        return data, kept, await store.delete_older_than(datetime.utcnow() + timedelta(seconds=1))
+
+    assert asyncio.run(run()) == (b"a,b\n", 0, 1)
+    assert client.headers[("bucket", "exports/job.csv")]["CacheControl"] == "private, no-store"
+    assert client.objects == {}
+
+
+def test_migrate_profile_pictures(tmp_path):
+    db = mongomock_motor.AsyncMongoMockClient()["paycoin_test"]
+    data_uri = "data:image/png;base64," + base64.b64encode(PNG).decode()
+    store = LocalBlobStore(tmp_path)
+
+    # Declared as HTML, but the bytes are a PNG
+    mislabeled = "data:text/html;base64," + base64.b64encode(PNG).decode()
+    html = "data:image/png;base64," + base64.b64encode(b"<script>alert(1)</script>").decode()
+
+    async def run():
+        await db.users.insert_many([
+            {"id": "a", "profile": {"name": "A", "profile_picture": data_uri}},
+            {"id": "b", "profile": {"name": "B", "profile_picture": "/uploads/existing.png"}},
+            {"id": "c", "profile": {"name": "C", "profile_picture": mislabeled}},
+            {"id": "d", "profile": {"name": "D", "profile_picture": html}},
+        ])
+        migrated = await migrate_profile_pictures(db, store)
+        again = await migrate_profile_pictures(db, store)
+        users = {user["id"]: user["profile"]["profile_picture"] async for user in db.users.find()}
+        return migrated, again, users
+
+    migrated, again, pictures = asyncio.run(run())
+    assert (migrated, again) == (2, 0)
+    assert pictures["a"].startswith("/uploads/") and pictures["a"].endswith(".png")
+    assert pictures["c"] == pictures["a"]  # stored as the PNG it is
+    assert pictures["d"] == html
+    assert [path.suffix for path in tmp_path.rglob("*") if path.is_file()] == [".png"]
+    assert parse_data_uri(data_uri) == PNG
+
+
+
+def _png(width=800, height=600):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 120, 40)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_uploads_are_content_addressed(app, http, register, upload):
+    pytest.importorskip("PIL")
+    ana, bia = register("ana@example.com"), register("bia@example.com")
+    image = _png()
+
+    first = upload(ana, image)
+    assert first.status_code == 200
+    url = first.json()["image_url"]
+    # Same bytes, same blob
+    assert upload(bia, image, filename="other.png").json()["image_url"] == url
+    store = app.state.services.blob_store
+    assert store.path_for(store.key_for_url(url)).read_bytes() == image
+
+    # Removing one user's picture keeps the blob the other one still uses
+    assert http.delete("/api/upload/image/profile", headers=ana["headers"]).status_code == 200
+    assert http.get("/api/user/profile", headers=ana["headers"]).json()["profile_image_url"] is None
+    assert http.get("/api/user/profile", headers=bia["headers"]).json()["profile_image_url"] == url
+    assert store.path_for(store.key_for_url(url)).exists()
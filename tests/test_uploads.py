@@ -0,0 +1,49 @@
+import asyncio
+import io
+
+import pytest
+from fastapi import UploadFile
+
+from uploads import MAX_UPLOAD_BYTES, UploadRejected, sniff_image_type, stage_upload
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 200
+
+
+def test_sniff_image_type_uses_magic_bytes():
+    assert sniff_image_type(PNG) == "image/png"
+    assert sniff_image_type(b"\xff\xd8\xff\xe0rest") == "image/jpeg"
+    assert sniff_image_type(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "image/webp"
+    assert sniff_image_type(b"<html>") is None
+
+
+def test_stage_upload_hashes_and_caps_size(tmp_path):
+    async def run(data, max_bytes):
+        return await stage_upload(UploadFile(io.BytesIO(data), filename="x"), tmp_path, max_bytes=max_bytes)
+
+    staged = asyncio.run(run(PNG, 1024))
+    assert staged.content_type == "image/png"
+    assert staged.size == len(PNG)
+    assert staged.path.read_bytes() == PNG
+
+    with pytest.raises(UploadRejected) as too_large:
+        asyncio.run(run(PNG * 10, 1024))
+    assert too_large.value.status_code == 413
+
+    with pytest.raises(UploadRejected):
+        asyncio.run(run(b"not an image", 1024))
+
+    assert list(tmp_path.iterdir()) == [staged.path]
+
+
+def test_uploads_are_sniffed_and_capped(register, upload):
+    Image = pytest.importorskip("PIL.Image")
+    ana = register("ana@example.com")
+    jpeg = io.BytesIO()
+    Image.new("RGB", (32, 32)).save(jpeg, "JPEG")
+
+    # The declared type and file name are ignored: the bytes decide
+    stored = upload(ana, jpeg.getvalue(), filename="foto.png", content_type="image/png")
+    assert stored.status_code == 200 and stored.json()["image_url"].endswith(".jpg")
+    assert upload(ana, b"<?php echo 1; ?>", filename="x.png").status_code == 400
+    too_large = upload(ana, PNG + bytes(MAX_UPLOAD_BYTES))
+    assert too_large.status_code == 413